@@ -1,20 +1,39 @@
 import asyncio
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, status
+import json
+import hashlib
+import logging
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Header, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from typing import Optional, List, Dict
-import tiktoken
-import time
+from typing import AsyncIterator, Optional, List, Set, Tuple
+import math
 import re
 import random
+import time
+import openai
 
 from app.database.models.user import User
-from app.database.models.session import get_db
-from app.api.endpoints.users import get_current_user
-from app.api.endpoints.noa import get_noa_config
+from app.database.models.session import get_db, SessionLocal
+from app.api.endpoints.users import get_current_user, token_session_id
+from app.core.services import api_key_service
+from app.services.session_store import session_store
+from app.services.tokenizer import count_tokens, count_tokens_batch, truncate_to_token_limit
+from app.services.noa_config_cache import noa_config_cache
+from app.services.conversation_store import conversation_store
+from app.services.rate_limiter import chat_rate_limiter
+from app.services.answer_cache import answer_cache, CachedLookup
+from app.services.usage_recorder import usage_recorder
+from app.services.conversation_summarizer import conversation_summarizer
+from app.services.retrieval_filters import build_file_search_filters
+from app.services.request_coalescer import CoalescingConflictError, request_coalescer
+from app.services.llm_limiter import llm_limiter, LLMUnavailableError
+from app.services.context_retriever import context_retriever
+from app.services.model_router import model_router
+from app.core.config import settings
 
 # Importamos la función para enviar mensajes vía Responses API
-from app.services.ML.embeddings.openai.responses_session import send_message
+from app.services.ML.embeddings.openai.responses_session import send_message, stream_message
 
 router = APIRouter()
 
@@ -22,47 +41,12 @@ router = APIRouter()
 class ChatRequest(BaseModel):
     message: str
     selected_file_ids: Optional[List[int]] = None
+    selected_manual_entry_ids: Optional[List[int]] = None
+    sections: Optional[List[str]] = None
 
 class ChatResponse(BaseModel):
     response: str
 
-# Estructura para mantener el seguimiento de las conversaciones por usuario
-class ConversationTracker:
-    def __init__(self):
-        self.response_id: Optional[str] = None
-        self.message_count: int = 0
-        self.last_reset: float = time.time()
-        self.last_request_time: float = 0
-
-# Diccionario global para mantener el seguimiento de conversaciones por usuario
-active_conversations: Dict[int, ConversationTracker] = {}
-
-# Tokenizer para contar tokens
-def count_tokens(text: str, model: str = "gpt-4o") -> int:
-    try:
-        encoder = tiktoken.encoding_for_model(model)
-        return len(encoder.encode(text))
-    except Exception:
-        # Estimación aproximada si tiktoken falla
-        return len(text.split()) * 1.3
-
-# Función para truncar texto a un número máximo de tokens
-def truncate_to_token_limit(text: str, max_tokens: int) -> str:
-    try:
-        encoder = tiktoken.encoding_for_model("gpt-4o")
-        tokens = encoder.encode(text)
-        
-        if len(tokens) <= max_tokens:
-            return text
-        
-        truncated_tokens = tokens[:max_tokens]
-        return encoder.decode(truncated_tokens)
-    except Exception:
-        # Estimación muy aproximada si falla
-        words = text.split()
-        estimated_words = int(max_tokens / 1.3)
-        return " ".join(words[:estimated_words]) + " [texto truncado...]"
-
 # Función para extraer el tiempo de espera recomendado de un mensaje de error
 def extract_retry_after(error_message: str) -> float:
     match = re.search(r'Please try again in (\d+\.\d+)s', error_message)
@@ -70,7 +54,20 @@ def extract_retry_after(error_message: str) -> float:
         return float(match.group(1))
     return 1.0  # Valor por defecto si no se encuentra
 
+def _retry_after_from_error(e: Exception) -> float:
+    """Espera sugerida por el proveedor: encabezado Retry-After o, si no, el mensaje de error."""
+    response = getattr(e, "response", None)
+    if response is not None:
+        header = response.headers.get("retry-after")
+        if header:
+            try:
+                return float(header)
+            except ValueError:
+                pass
+    return extract_retry_after(str(e))
+
 async def send_message_with_retry(
+    model,
     message, 
     previous_response_id, 
     tools, 
@@ -78,14 +75,25 @@ async def send_message_with_retry(
     max_output_tokens, 
     top_p, 
     store,
+    route=None,
     max_retries=3
 ):
+    """
+    Envía el mensaje a través del limitador compartido de OpenAI. Solo se reintentan
+    los 429 por límite de tokens/solicitudes; la espera ocurre fuera del limitador,
+    sin retener un cupo de concurrencia. Si se indica `route`, el router registra
+    la latencia del intento exitoso (sin esperas de reintento).
+    """
     retries = 0
     backoff_time = 1  # Tiempo inicial de espera en segundos
     
     while retries <= max_retries:
         try:
-            return send_message(
+            started = time.monotonic()
+            response = await llm_limiter.run_sync(
+                "chat",
+                send_message,
+                model=model,
                 message=message,
                 previous_response_id=previous_response_id,
                 tools=tools,
@@ -94,186 +102,759 @@ async def send_message_with_retry(
                 top_p=top_p,
                 store=store
             )
-        except Exception as e:
-            error_str = str(e)
+            if route is not None:
+                model_router.record(route, (time.monotonic() - started) * 1000)
+            return response
+        except openai.RateLimitError as e:
+            # Sin saldo en la cuenta: reintentar no sirve
+            if getattr(e, "code", None) == "insufficient_quota":
+                raise
             
-            # Si es un error de formato de solicitud, debemos detener inmediatamente
-            if "invalid_request_error" in error_str:
-                raise  # No hay punto en reintentar errores de formato
+            retries += 1
+            if retries > max_retries:
+                raise  # Reenvía la excepción si se agotaron los reintentos
             
-            # Si es un error de límite de velocidad de tokens
-            if "rate_limit_exceeded" in error_str and "tokens" in error_str:
-                retries += 1
-                
-                if retries > max_retries:
-                    raise  # Reenvía la excepción si se agotaron los reintentos
-                
-                # Extrae el tiempo de espera sugerido o usa el tiempo de retroceso calculado
-                wait_time = extract_retry_after(error_str)
-                wait_time = max(wait_time, backoff_time)
-                
-                # Añadir un poco de aleatoriedad para evitar que múltiples clientes se sincronicen
-                jitter = random.uniform(0, 0.1 * wait_time)
-                total_wait = wait_time + jitter
-                
-                # Espera antes de reintentar
-                await asyncio.sleep(total_wait)
-                
-                # Incrementar el tiempo de espera para el próximo reintento (retroceso exponencial)
-                backoff_time *= 2
-            else:
-                # Para otros tipos de errores, reenvía la excepción inmediatamente
-                raise
+            # Extrae el tiempo de espera sugerido o usa el tiempo de retroceso calculado
+            wait_time = max(_retry_after_from_error(e), backoff_time)
+            
+            # Añadir un poco de aleatoriedad para evitar que múltiples clientes se sincronicen
+            jitter = random.uniform(0, 0.1 * wait_time)
+            await asyncio.sleep(wait_time + jitter)
+            
+            # Incrementar el tiempo de espera para el próximo reintento (retroceso exponencial)
+            backoff_time *= 2
+
+def _usage_from_response(turn: dict, response, output_text: str):
+    """
+    Retorna (input_tokens, output_tokens) reportados por la API en `response.usage`.
+    Solo si no vienen se estiman con el tokenizer.
+    """
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        return usage.input_tokens, usage.output_tokens
+    system_tokens, user_tokens, output_tokens = count_tokens_batch(
+        [turn["system_prompt"], turn["user_message"], output_text]
+    )
+    return system_tokens + user_tokens, output_tokens
+
+async def _record_usage(turn: dict, current_user: User, input_tokens: int, output_tokens: int, endpoint: str):
+    """Ajusta el rate limiter y encola el uso real en el registro write-behind."""
+    await _settle_rate_limit(turn, current_user, input_tokens + output_tokens)
+    usage_recorder.record(
+        user_id=current_user.id,
+        api_key=current_user.api_key,
+        model=turn["model"],
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        endpoint=endpoint
+    )
+
+async def _prepare_chat_turn(chat_req: ChatRequest, current_user: User, db: Session):
+    """
+    Prepara un turno de conversación: actualiza el tracker del usuario y construye
+    el payload, las tools y los parámetros para la Responses API.
+    Se comparte entre el endpoint normal y el de streaming.
+    """
+    user_id = current_user.id
+    max_output_tokens = 1024  # Reducimos para mantenernos bajo límites
+    
+    # 1. Recuperar la configuración NOA compilada (prompt de sistema ya truncado a 1500 tokens)
+    config = await noa_config_cache.get(db, current_user)
+    system_prompt = config.system_prompt
+    
+    # Limitar el mensaje del usuario a un máximo de 2000 tokens
+    user_message = truncate_to_token_limit(chat_req.message, 2000)
+    
+    # Modelo del turno: tier rápido o fuerte según el mensaje y lo permitido al tenant
+    selection_scoped = bool(chat_req.selected_file_ids or chat_req.selected_manual_entry_ids or chat_req.sections)
+    route = model_router.route(user_message, config.model, scoped=selection_scoped)
+    model = route.model
+    
+    summary_mode = settings.CHAT_CONTEXT_MODE == "summary"
+    managed_retrieval = settings.CHAT_RETRIEVAL_MODE == "managed"
+    
+    # Rechazar temprano (429 + Retry-After) si el usuario, su empresa o el total
+    # superan su presupuesto de tokens. El costo estimado incluye la salida máxima
+    # y, en modo resumen, el presupuesto completo de contexto.
+    estimated_tokens = config.system_prompt_tokens + count_tokens(user_message) + max_output_tokens
+    if summary_mode:
+        estimated_tokens += conversation_summarizer.context_token_budget
+    if managed_retrieval:
+        estimated_tokens += context_retriever.token_budget
+    await chat_rate_limiter.acquire(user_id, current_user.company_id, estimated_tokens)
+    
+    # Registrar el mensaje en el estado compartido de la conversación. En modo legacy el
+    # store reinicia la conversación después de 10 mensajes; el contador es atómico.
+    try:
+        conversation, was_reset = await conversation_store.start_turn(user_id, reset_after_max=not summary_mode)
+    except BaseException:
+        # El turno no llega a existir: devolver el presupuesto reservado
+        await chat_rate_limiter.refund(user_id, current_user.company_id, estimated_tokens)
+        raise
+    if was_reset:
+        logging.info(f"Reiniciando conversación para usuario {user_id} después de 10 mensajes")
+    
+    # 2. Contexto de la conversación: en modo resumen se envía el resumen de los turnos
+    # antiguos y los últimos turnos, con un presupuesto fijo de tokens
+    if summary_mode:
+        context_messages, _ = conversation_summarizer.build_context(conversation)
+    else:
+        context_messages = []
+    
+    # 3. Preparar el payload para Responses API (con límites de tokens)
+    # Formateamos correctamente la entrada según la documentación de OpenAI
+    input_payload = [
+        {
+            "role": "system",
+            "content": system_prompt
+        },
+        *context_messages,
+        {
+            "role": "user",
+            "content": user_message
+        }
+    ]
+    
+    # 4. Preparar tools para Responses API (incluyendo file_search siempre)
+    tools = [{
+        "type": "file_search",
+        "vector_store_ids": [settings.OPENAI_VECTOR_STORE_ID],
+        "max_num_results": 3  # Limitamos a 3 resultados para reducir uso de tokens
+    }]
+    # Acotar la búsqueda a los archivos, cargas manuales y secciones seleccionados
+    file_search_filters = build_file_search_filters(
+        user_id,
+        file_ids=chat_req.selected_file_ids,
+        manual_entry_ids=chat_req.selected_manual_entry_ids,
+        sections=chat_req.sections
+    )
+    if file_search_filters:
+        tools[0]["filters"] = file_search_filters
+    # En recuperación gestionada el contexto se inyecta antes de llamar al modelo;
+    # file_search queda solo como respaldo si la búsqueda propia falla
+    fallback_tools = tools
+    if managed_retrieval:
+        tools = []
+    
+    # 5. Obtener el previous_response_id si existe y si no hemos reiniciado la conversación (modo legacy)
+    # Para gestionar mejor los tokens, solo usamos el previous_response_id para los primeros intercambios
+    # Después de cierto punto, descartamos el historial para evitar acumulación de tokens
+    if summary_mode:
+        previous_response_id = None
+    elif conversation.message_count <= 5:
+        previous_response_id = conversation.response_id
+    else:
+        previous_response_id = None
+    
+    return {
+        "conversation": conversation,
+        "config": config,
+        "model": model,
+        "route": route,
+        "system_prompt": system_prompt,
+        "user_message": user_message,
+        "estimated_tokens": estimated_tokens,
+        # Solo las preguntas sin contexto previo ni búsqueda acotada usan la caché de respuestas
+        "cacheable": (
+            previous_response_id is None
+            and not context_messages
+            and file_search_filters is None
+        ),
+        "summary_mode": summary_mode,
+        "fallback_tools": fallback_tools,
+        "request_params": {
+            "model": model,
+            "message": input_payload,
+            "previous_response_id": previous_response_id,
+            "tools": tools,
+            "temperature": config.temperature,
+            "max_output_tokens": max_output_tokens,
+            "top_p": 1,
+            # En modo resumen el contexto viaja en cada solicitud: no hace falta guardar la respuesta
+            "store": not summary_mode
+        }
+    }
 
-async def track_token_usage(user_id: int, input_tokens: int, output_tokens: int, model: str = "gpt-4o"):
+async def _settle_rate_limit(turn: dict, current_user: User, used_tokens: int):
     """
-    Función para rastrear el uso de tokens (versión simple)
-    En un sistema completo, esto guardaría en DB o Redis
+    Ajusta el rate limiter con la diferencia entre los tokens estimados y los reales
+    (devuelve lo estimado de más o cobra el exceso).
+    Solo la primera liquidación del turno tiene efecto, así los caminos de error
+    pueden devolver el costo completo (`used_tokens=0`) sin duplicar reembolsos.
     """
+    if turn.get("tokens_settled"):
+        return
+    turn["tokens_settled"] = True
+    await chat_rate_limiter.refund(
+        current_user.id,
+        current_user.company_id,
+        turn["estimated_tokens"] - used_tokens
+    )
+
+async def _lookup_cached_answer(turn: dict, current_user: User) -> CachedLookup:
+    """Busca la pregunta en la caché de respuestas del tenant si el turno lo permite."""
+    if not turn["cacheable"]:
+        return CachedLookup(None, None)
+    lookup = await answer_cache.lookup(current_user.id, turn["config"], turn["user_message"])
+    if lookup.hit:
+        # Respuesta sin llamada al modelo: se devuelve todo el costo estimado al rate limiter
+        await _settle_rate_limit(turn, current_user, 0)
+        logging.info(f"Respuesta servida desde caché ({lookup.kind}) para usuario {current_user.id}")
+    return lookup
+
+def _start_retrieval(chat_req: ChatRequest, current_user: User) -> Optional[asyncio.Task]:
+    """En modo de recuperación gestionada, lanza la búsqueda en el vector store."""
+    if settings.CHAT_RETRIEVAL_MODE != "managed":
+        return None
+    filters = build_file_search_filters(
+        current_user.id,
+        file_ids=chat_req.selected_file_ids,
+        manual_entry_ids=chat_req.selected_manual_entry_ids,
+        sections=chat_req.sections
+    )
+    return asyncio.create_task(context_retriever.retrieve(chat_req.message, filters))
+
+async def _attach_retrieved_context(turn: dict, retrieval: asyncio.Task):
+    """Inserta el contexto recuperado tras el prompt de sistema; si falla, vuelve a file_search."""
     try:
-        # Aquí se implementaría la lógica real de registro
-        total_tokens = input_tokens + output_tokens
-        print(f"[Token Usage] User ID: {user_id}, Input: {input_tokens}, Output: {output_tokens}, Total: {total_tokens}, Model: {model}")
-        # En un sistema real, aquí guardaríamos en una DB
+        context, _ = await retrieval
+    except LLMUnavailableError:
+        raise
     except Exception as e:
-        print(f"Error tracking token usage: {e}")
+        logging.error(f"Error en la recuperación gestionada, usando file_search: {str(e)}")
+        turn["request_params"]["tools"] = turn["fallback_tools"]
+        return
+    if context:
+        turn["request_params"]["message"].insert(1, {"role": "system", "content": context})
 
-@router.post("/", response_model=ChatResponse)
-async def chat_endpoint(
+async def _begin_chat_turn(chat_req: ChatRequest, current_user: User, db: Session):
+    """
+    Prepara el turno y consulta la caché de respuestas. En recuperación gestionada la
+    búsqueda corre en paralelo con la preparación del prompt y la consulta a la caché.
+    Retorna (turn, cache_lookup).
+    """
+    retrieval = _start_retrieval(chat_req, current_user)
+    if retrieval is not None:
+        # Ceder el loop una vez para que la búsqueda se despache antes del trabajo síncrono
+        await asyncio.sleep(0)
+    try:
+        turn = await _prepare_chat_turn(chat_req, current_user, db)
+        try:
+            cache_lookup = await _lookup_cached_answer(turn, current_user)
+            if retrieval is not None and not cache_lookup.hit:
+                await _attach_retrieved_context(turn, retrieval)
+        except BaseException:
+            await _settle_rate_limit(turn, current_user, 0)
+            raise
+        return turn, cache_lookup
+    finally:
+        if retrieval is not None:
+            if not retrieval.done():
+                retrieval.cancel()
+            elif not retrieval.cancelled():
+                retrieval.exception()  # Marcar como recuperada si no se usó
+
+def _chat_http_error(e: Exception, user_id: int) -> HTTPException:
+    """
+    Traduce un error de la Responses API a la HTTPException correspondiente.
+    """
+    # Circuito abierto o sin capacidad hacia OpenAI: fallar rápido con 503
+    if isinstance(e, LLMUnavailableError):
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="El servicio de IA está saturado o no disponible. Intente de nuevo en unos momentos.",
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+        )
+    # Si es un error de límite de tokens, reiniciar la conversación automáticamente
+    if "rate_limit_exceeded" in str(e) and "tokens" in str(e):
+        # Se agenda en el loop: la traducción del error no espera a Redis
+        _run_in_background(conversation_store.reset_history(user_id))
+        
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Se ha excedido el límite de tokens. La conversación se ha reiniciado automáticamente. Por favor, intente de nuevo en unos momentos."
+        )
+    elif "invalid_request_error" in str(e):
+        # Error de formato de solicitud
+        return HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Error en el formato de la solicitud: {str(e)}"
+        )
+    return HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+# Referencias a las tareas lanzadas tras un stream, para que no sean recolectadas antes de terminar
+_stream_background_tasks: Set[asyncio.Task] = set()
+
+def _run_in_background(coro):
+    task = asyncio.create_task(coro)
+    _stream_background_tasks.add(task)
+    task.add_done_callback(_stream_background_tasks.discard)
+
+def _sse_event(event: str, data: dict) -> str:
+    """Formatea un evento Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def _run_chat_turn(
     chat_req: ChatRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
-    background_tasks: BackgroundTasks = None
-):
+    current_user: User,
+    db: Session,
+    background_tasks: BackgroundTasks
+) -> dict:
+    """Ejecuta un turno completo de chat y retorna el cuerpo de la respuesta."""
+    user_id = current_user.id
+    turn = None
     try:
-        user_id = current_user.id
+        # Preguntas repetidas se responden desde la caché, sin costo de tokens
+        turn, cache_lookup = await _begin_chat_turn(chat_req, current_user, db)
+        if cache_lookup.hit:
+            return {"response": cache_lookup.answer}
         
-        # Inicializar o recuperar el tracker de conversación para este usuario
-        if user_id not in active_conversations:
-            active_conversations[user_id] = ConversationTracker()
+        # 6. Enviar la consulta a Responses API con reintentos
+        response = await send_message_with_retry(**turn["request_params"], route=turn["route"])
         
-        conversation = active_conversations[user_id]
+        # 7. Actualizar el último response_id (modo legacy)
+        if not turn["summary_mode"]:
+            await conversation_store.update(user_id, response_id=response.id)
         
-        # Verificar si debemos reiniciar la conversación (después de 10 mensajes)
-        if conversation.message_count >= 10:
-            conversation.response_id = None
-            conversation.message_count = 0
-            conversation.last_reset = time.time()
-            print(f"Reiniciando conversación para usuario {user_id} después de 10 mensajes")
+        # 8. Obtener el texto de respuesta
+        respuesta = response.output_text
         
-        # Incrementar el contador de mensajes
-        conversation.message_count += 1
+        # En modo resumen, guardar el turno y compactar después de responder
+        if turn["summary_mode"]:
+            background_tasks.add_task(
+                conversation_summarizer.record_turn,
+                current_user,
+                turn["user_message"],
+                respuesta
+            )
         
-        # 1. Recuperar la configuración NOA del usuario desde la BD
-        config = get_noa_config(db=db, current_user=current_user)
+        # 9. Tracking de tokens con los valores reportados por la API
+        input_tokens, output_tokens = _usage_from_response(turn, response, respuesta)
+        await _record_usage(turn, current_user, input_tokens, output_tokens, "/api/v1/chat")
+        if turn["cacheable"]:
+            background_tasks.add_task(
+                answer_cache.store,
+                user_id,
+                turn["config"],
+                turn["user_message"],
+                respuesta,
+                cache_lookup.embedding
+            )
         
-        # 2. Construir el prompt sistema a partir de la configuración (con límite de tokens)
-        system_prompt_full = (
-            f"Instrucción: {config.prompt}\n"
-            f"Personalidad: {config.personality}\n"
-            f"Objetivo: {config.objective}\n"
-            "Utiliza el siguiente contexto cuando sea necesario para responder de forma precisa."
+    except HTTPException:
+        raise
+    except Exception as e:
+        # Log detallado del error para depuración
+        logging.error(f"Error en chat_endpoint: {str(e)}")
+        raise _chat_http_error(e, user_id)
+    finally:
+        # Si el turno falló antes de registrar el uso, devolver todo el costo estimado
+        if turn is not None:
+            await _settle_rate_limit(turn, current_user, 0)
+    
+    return {"response": respuesta}
+
+def _request_fingerprint(chat_req: ChatRequest) -> str:
+    """
+    Huella del contenido de la solicitud: el mensaje y la selección de archivos.
+    """
+    return json.dumps({
+        "message": chat_req.message,
+        "files": sorted(chat_req.selected_file_ids or []),
+        "manual": sorted(chat_req.selected_manual_entry_ids or []),
+        "sections": sorted(chat_req.sections or [])
+    }, sort_keys=True)
+
+def _coalescing_key(user_id: int, fingerprint: str, idempotency_key: Optional[str]) -> str:
+    """
+    Clave de coalescencia: la Idempotency-Key si el cliente la envía; si no, la
+    huella de la solicitud, de modo que un doble clic comparta la llamada.
+    """
+    if idempotency_key:
+        return request_coalescer.make_key(user_id, f"idem:{idempotency_key}")
+    return request_coalescer.make_key(user_id, f"msg:{fingerprint}")
+
+@router.post("/", response_model=ChatResponse)
+async def chat_endpoint(
+    chat_req: ChatRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks = None,
+    idempotency_key: Optional[str] = Header(None, max_length=255)
+):
+    # Duplicados concurrentes (doble clic, reintentos del frontend) comparten una sola
+    # llamada al modelo y reciben la misma respuesta. La huella se guarda con el
+    # resultado para rechazar una Idempotency-Key reutilizada con otro contenido.
+    fingerprint = _request_fingerprint(chat_req)
+    try:
+        result = await request_coalescer.run(
+            _coalescing_key(current_user.id, fingerprint, idempotency_key),
+            lambda: _run_chat_turn(chat_req, current_user, db, background_tasks),
+            result_ttl_seconds=settings.CHAT_IDEMPOTENCY_TTL_SECONDS if idempotency_key else None,
+            fingerprint=hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
         )
+    except CoalescingConflictError:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="La Idempotency-Key ya se usó con una solicitud distinta."
+        )
+    return ChatResponse(**result)
+
+async def _open_chat_stream(turn: dict, current_user: User):
+    """
+    Abre el stream de la Responses API dentro del limitador compartido. El cupo se
+    mantiene hasta cerrar el stream; la latencia que alimenta el ajuste de
+    concurrencia es la de apertura (hasta los encabezados). Si no se puede abrir,
+    devuelve al rate limiter todo el costo estimado del turno.
+    """
+    try:
+        llm_slot = await llm_limiter.acquire("chat_stream")
+        turn["stream_started_at"] = time.monotonic()
+        try:
+            stream = await stream_message(**turn["request_params"])
+        except BaseException as e:
+            llm_slot.failure(e)
+            raise
+    except BaseException:
+        await _settle_rate_limit(turn, current_user, 0)
+        raise
+    llm_slot.success(release=False)
+    return stream, llm_slot
+
+async def _chat_stream_events(
+    turn: dict,
+    current_user: User,
+    stream,
+    llm_slot,
+    cache_lookup: CachedLookup,
+    endpoint: str,
+    is_disconnected
+) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Consume el stream de la Responses API y produce los eventos (`delta`, `done`,
+    `error`) del turno. Al completarse registra el uso y lanza las tareas posteriores;
+    siempre cierra el stream y libera el cupo del limitador.
+    """
+    user_id = current_user.id
+    output_parts: List[str] = []
+    completed_response = None
+    first_token_ms = None
+    try:
+        async for event in stream:
+            # Detenerse limpiamente si el cliente cerró la conexión
+            if await is_disconnected():
+                logging.info(f"Cliente desconectado durante el streaming (usuario {user_id})")
+                break
+            
+            if event.type == "response.output_text.delta":
+                if first_token_ms is None:
+                    first_token_ms = (time.monotonic() - turn["stream_started_at"]) * 1000
+                output_parts.append(event.delta)
+                yield "delta", {"delta": event.delta}
+            elif event.type == "response.completed":
+                completed_response = event.response
+            elif event.type in ("response.failed", "error"):
+                logging.error(f"Error en el stream de la Responses API: {event}")
+                yield "error", {"detail": "Error generando la respuesta"}
+                return
         
-        # Limitar el sistema a un máximo de 1500 tokens para dejar espacio para otras partes
-        system_prompt = truncate_to_token_limit(system_prompt_full, 1500)
-        
-        # Limitar el mensaje del usuario a un máximo de 2000 tokens
-        user_message = truncate_to_token_limit(chat_req.message, 2000)
-        
-        # 3. Preparar el payload para Responses API (con límites de tokens)
-        # AQUÍ ESTÁ EL CAMBIO IMPORTANTE: Formateamos correctamente la entrada según la documentación de OpenAI
-        input_payload = [
-            {
-                "role": "system",
-                "content": system_prompt
-            },
-            {
-                "role": "user",
-                "content": user_message
-            }
-        ]
+        if completed_response is None:
+            return
+        model_router.record(
+            turn["route"],
+            (time.monotonic() - turn["stream_started_at"]) * 1000,
+            first_token_ms
+        )
         
-        # 4. Preparar tools para Responses API (incluyendo file_search siempre)
-        tools = [{
-            "type": "file_search",
-            "vector_store_ids": ["vs_67da2a9a90b4819194ed77849ac443db"],  # Tu vector store ID
-            "max_num_results": 3  # Limitamos a 3 resultados para reducir uso de tokens
-        }]
+        # Actualizar el último response_id (modo legacy)
+        if not turn["summary_mode"]:
+            await conversation_store.update(user_id, response_id=completed_response.id)
+        output_text = "".join(output_parts)
         
-        # 5. Obtener el previous_response_id si existe y si no hemos reiniciado la conversación
-        # Para gestionar mejor los tokens, solo usamos el previous_response_id para los primeros intercambios
-        # Después de cierto punto, descartamos el historial para evitar acumulación de tokens
-        if conversation.message_count <= 5:
-            previous_response_id = conversation.response_id
-        else:
-            previous_response_id = None
+        # Tracking de tokens con los valores reportados por la API
+        input_tokens, output_tokens = _usage_from_response(turn, completed_response, output_text)
+        await _record_usage(turn, current_user, input_tokens, output_tokens, endpoint)
         
-        # Registra el tiempo actual antes de la solicitud
-        now = time.time()
+        yield "done", {
+            "response_id": completed_response.id,
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens}
+        }
         
-        # Verifica si han pasado menos de 2 segundos desde la última solicitud
-        # y maneja el espaciado de las solicitudes si es necesario
-        time_since_last_request = now - conversation.last_request_time
-        if conversation.last_request_time > 0 and time_since_last_request < 2.0:
-            # Espera un poco para reducir la velocidad de las solicitudes
-            await asyncio.sleep(max(0, 2.0 - time_since_last_request))
+        # Tareas posteriores fuera del stream para no retener la conexión
+        if turn["summary_mode"]:
+            _run_in_background(
+                conversation_summarizer.record_turn(current_user, turn["user_message"], output_text)
+            )
+        if turn["cacheable"]:
+            _run_in_background(
+                answer_cache.store(
+                    user_id,
+                    turn["config"],
+                    turn["user_message"],
+                    output_text,
+                    cache_lookup.embedding
+                )
+            )
+    except Exception as e:
+        logging.error(f"Error en el streaming del chat: {str(e)}")
+        yield "error", {"detail": str(e)}
+    finally:
+        # Cerrar el stream libera la conexión con OpenAI (también al desconectarse el cliente)
+        await stream.close()
+        llm_slot.release()
+        # Sin `response.completed` no hubo registro de uso: se cobra solo lo generado
+        # (nada si falló antes del primer delta) y se devuelve el resto de la estimación
+        used_tokens = sum(_usage_from_response(turn, None, "".join(output_parts))) if output_parts else 0
+        await _settle_rate_limit(turn, current_user, used_tokens)
+
+@router.post("/stream")
+async def chat_stream_endpoint(
+    chat_req: ChatRequest,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Variante en streaming de /chat: reenvía los deltas de texto de la Responses API
+    como Server-Sent Events a medida que se generan.
+    
+    Eventos emitidos:
+    - `delta`: fragmento de texto ({"delta": "..."})
+    - `done`: fin de la respuesta ({"response_id": "...", "usage": {...}})
+    - `error`: error durante la generación ({"detail": "..."})
+    """
+    user_id = current_user.id
+    try:
+        turn, cache_lookup = await _begin_chat_turn(chat_req, current_user, db)
+        if cache_lookup.hit:
+            async def cached_generator():
+                yield _sse_event("delta", {"delta": cache_lookup.answer})
+                yield _sse_event("done", {"response_id": None, "cached": True})
+            
+            return StreamingResponse(
+                cached_generator(),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
         
-        # Actualiza el tiempo de la última solicitud
-        conversation.last_request_time = time.time()
+        # Abrimos el stream antes de responder para poder devolver errores HTTP normales
+        stream, llm_slot = await _open_chat_stream(turn, current_user)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error en chat_stream_endpoint: {str(e)}")
+        raise _chat_http_error(e, user_id)
+    
+    async def event_generator():
+        async for event, data in _chat_stream_events(
+            turn, current_user, stream, llm_slot, cache_lookup,
+            "/api/v1/chat/stream", request.is_disconnected
+        ):
+            yield _sse_event(event, data)
+    
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Evita el buffering de proxies (nginx)
+        }
+    )
+
+class _ChatWebSocketSession:
+    """
+    Conexión WebSocket de chat autenticada una sola vez.
+    
+    El usuario queda asociado a la conexión, por lo que cada turno evita decodificar
+    el JWT, consultar el usuario en Postgres, validar la sesión en Redis y contar el
+    uso de la API Key (se hace al conectar; la sesión se revalida cada
+    WS_SESSION_RECHECK_SECONDS). La configuración NOA se lee de su caché en proceso y
+    el estado de la conversación, de Redis en una sola operación por turno.
+    
+    Protocolo (JSON):
+    - cliente: {"type": "message", "id": "...", "message": "...", "selected_file_ids": [...]},
+      {"type": "cancel"}, {"type": "ping"}, {"type": "pong"}
+    - servidor: {"type": "delta"|"done"|"error", "id": "...", ...}, {"type": "ping"}, {"type": "pong"}
+    
+    Backpressure: los deltas pasan por una cola acotada hacia la tarea que escribe en el
+    socket; si el cliente lee más lento de lo que genera el modelo, los deltas pendientes
+    se agrupan en un solo mensaje en lugar de acumular mensajes en memoria.
+    """
+    
+    def __init__(self, websocket: WebSocket, user: User, session_id: Optional[str]):
+        self.websocket = websocket
+        self.user = user
+        self.session_id = session_id
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self.turn_task: Optional[asyncio.Task] = None
+        self.last_received = time.monotonic()
+        self.session_checked_at = time.monotonic()
+        self.closed = False
+    
+    async def run(self):
+        sender = asyncio.create_task(self._sender())
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            await self._receiver()
+        finally:
+            self.closed = True
+            for task in (self.turn_task, heartbeat, sender):
+                if task is not None:
+                    task.cancel()
+            await asyncio.gather(
+                *(t for t in (self.turn_task, heartbeat, sender) if t is not None),
+                return_exceptions=True
+            )
+    
+    async def _send(self, payload: dict):
+        await self.outbox.put(payload)
+    
+    async def _sender(self):
+        while True:
+            payload = await self.outbox.get()
+            await self.websocket.send_json(payload)
+    
+    async def _heartbeat(self):
+        interval = settings.WS_HEARTBEAT_SECONDS
+        while True:
+            await asyncio.sleep(interval)
+            # El cliente responde cada ping con pong: sin mensajes durante
+            # WS_IDLE_TIMEOUT_SECONDS la conexión se considera muerta
+            if self.turn_task is None and time.monotonic() - self.last_received > settings.WS_IDLE_TIMEOUT_SECONDS:
+                logging.info(f"Cerrando WebSocket inactivo (usuario {self.user.id})")
+                await self.websocket.close(code=status.WS_1001_GOING_AWAY)
+                return
+            await self._send({"type": "ping", "ts": time.time()})
+    
+    async def _receiver(self):
+        while True:
+            try:
+                data = await self.websocket.receive_json()
+            except (WebSocketDisconnect, RuntimeError):
+                # Desconexión del cliente o cierre iniciado por el heartbeat
+                return
+            except ValueError:
+                await self._send({"type": "error", "detail": "Mensaje JSON inválido"})
+                continue
+            self.last_received = time.monotonic()
+            kind = data.get("type")
+            
+            if kind == "ping":
+                await self._send({"type": "pong", "ts": data.get("ts")})
+            elif kind == "pong":
+                continue
+            elif kind == "cancel":
+                if self.turn_task is not None:
+                    self.turn_task.cancel()
+            elif kind == "message":
+                if self.turn_task is not None:
+                    await self._send({
+                        "type": "error", "id": data.get("id"), "status": status.HTTP_409_CONFLICT,
+                        "detail": "Hay una respuesta en curso; espere o envíe cancel"
+                    })
+                    continue
+                self.turn_task = asyncio.create_task(self._run_turn(data))
+                self.turn_task.add_done_callback(self._turn_finished)
+            else:
+                await self._send({"type": "error", "detail": f"Tipo de mensaje desconocido: {kind}"})
+    
+    def _turn_finished(self, task: asyncio.Task):
+        if self.turn_task is task:
+            self.turn_task = None
+    
+    async def _session_still_valid(self) -> bool:
+        """Revalida periódicamente la sesión en Redis (logout, expiración)."""
+        if time.monotonic() - self.session_checked_at < settings.WS_SESSION_RECHECK_SECONDS:
+            return True
+        self.session_checked_at = time.monotonic()
+        return await session_store.validate(self.session_id, self.user.id)
+    
+    async def _run_turn(self, data: dict):
+        message_id = data.get("id")
         
-        # 6. Enviar la consulta a Responses API con reintentos
-        response = await send_message_with_retry(
-            message=input_payload,
-            previous_response_id=previous_response_id,
-            tools=tools,
-            temperature=config.temperature,
-            max_output_tokens=1024,  # Reducimos para mantenernos bajo límites
-            top_p=1,
-            store=True
-        )
+        async def emit(event: str, payload: dict):
+            await self._send({"type": event, "id": message_id, **payload})
         
-        # 7. Actualizar el último response_id
-        conversation.response_id = response.id
+        if not await self._session_still_valid():
+            await emit("error", {"status": status.HTTP_401_UNAUTHORIZED, "detail": "Sesión expirada o inválida"})
+            await self.websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
         
-        # 8. Obtener el texto de respuesta
-        respuesta = response.output_text
+        try:
+            chat_req = ChatRequest(**{k: v for k, v in data.items() if k in ChatRequest.model_fields})
+        except ValueError as e:
+            await emit("error", {"status": status.HTTP_422_UNPROCESSABLE_ENTITY, "detail": str(e)})
+            return
         
-        # 9. Tracking de tokens (versión simple)
-        input_tokens = count_tokens(system_prompt) + count_tokens(user_message)
-        output_tokens = count_tokens(respuesta)
-        background_tasks.add_task(
-            track_token_usage,
-            user_id=current_user.id,
-            input_tokens=input_tokens,
-            output_tokens=output_tokens
-        )
+        # Sesión de base de datos solo para el turno (la configuración suele venir de caché)
+        db = SessionLocal()
+        try:
+            turn, cache_lookup = await _begin_chat_turn(chat_req, self.user, db)
+            if cache_lookup.hit:
+                await emit("delta", {"delta": cache_lookup.answer})
+                await emit("done", {"response_id": None, "cached": True})
+                return
+            stream, llm_slot = await _open_chat_stream(turn, self.user)
+        except HTTPException as e:
+            await emit("error", {"status": e.status_code, "detail": e.detail, "headers": e.headers or {}})
+            return
+        except Exception as e:
+            logging.error(f"Error en chat WebSocket: {str(e)}")
+            http_error = _chat_http_error(e, self.user.id)
+            await emit("error", {"status": http_error.status_code, "detail": http_error.detail})
+            return
+        finally:
+            db.close()
         
-    except Exception as e:
-        # Log detallado del error para depuración
-        import logging
-        logging.error(f"Error en chat_endpoint: {str(e)}")
+        async def is_disconnected() -> bool:
+            return self.closed
         
-        # Si es un error de límite de tokens, reiniciar la conversación automáticamente
-        if "rate_limit_exceeded" in str(e) and "tokens" in str(e):
-            if user_id in active_conversations:
-                active_conversations[user_id].response_id = None
-                active_conversations[user_id].message_count = 0
-                
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="Se ha excedido el límite de tokens. La conversación se ha reiniciado automáticamente. Por favor, intente de nuevo en unos momentos."
-            )
-        elif "invalid_request_error" in str(e):
-            # Error de formato de solicitud
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Error en el formato de la solicitud: {str(e)}"
-            )
-        else:
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+        pending = ""
+        async for event, payload in _chat_stream_events(
+            turn, self.user, stream, llm_slot, cache_lookup, "/api/v1/chat/ws", is_disconnected
+        ):
+            if event != "delta":
+                if pending:
+                    await emit("delta", {"delta": pending})
+                    pending = ""
+                await emit(event, payload)
+                continue
+            pending += payload["delta"]
+            # Cola llena (cliente lento): seguir agrupando deltas sin bloquear el stream
+            if not self.outbox.full():
+                await emit("delta", {"delta": pending})
+                pending = ""
+
+@router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket):
+    """
+    Canal de chat por WebSocket. El primer mensaje debe ser
+    {"type": "auth", "token": "<JWT>"}; luego se aceptan mensajes de chat y las
+    respuestas se transmiten token a token.
+    """
+    await websocket.accept()
+    try:
+        data = await asyncio.wait_for(websocket.receive_json(), timeout=settings.WS_AUTH_TIMEOUT_SECONDS)
+        if data.get("type") != "auth" or not data.get("token"):
+            raise ValueError("Se esperaba un mensaje de autenticación")
+    except (asyncio.TimeoutError, ValueError, WebSocketDisconnect):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    # Autenticación completa una sola vez por conexión
+    db = SessionLocal()
+    try:
+        user = await get_current_user(token=data["token"], db=db, request=None)
+        api_key_service.increment_usage(user.api_key, websocket)
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "status": e.status_code, "detail": e.detail})
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    finally:
+        db.close()
     
-    return ChatResponse(response=respuesta)
+    await websocket.send_json({"type": "ready", "user_id": user.id})
+    await _ChatWebSocketSession(websocket, user, token_session_id(data["token"])).run()
 
 @router.post("/new", response_model=ChatResponse)
 async def new_chat_session(
@@ -286,9 +867,6 @@ async def new_chat_session(
     user_id = current_user.id
     
     # Reiniciar completamente la conversación
-    if user_id in active_conversations:
-        active_conversations[user_id] = ConversationTracker()
-    else:
-        active_conversations[user_id] = ConversationTracker()
+    await conversation_store.reset(user_id)
     
     return ChatResponse(response="Nueva sesión de chat iniciada. ¿En qué puedo ayudarte hoy?")
\ No newline at end of file
@@ -0,0 +1,157 @@
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from pydantic import BaseModel, model_validator
+from sqlalchemy.orm import Session
+
+from app.api.endpoints.users import get_current_user
+from app.core.config import settings
+from app.core.logger import logger
+from app.database.models.lead import Lead
+from app.database.models.session import get_db
+from app.database.models.user import User
+from app.services.chat_batch import chat_batch_service, render_lead_prompt
+from app.services.noa_config_cache import noa_config_cache
+
+router = APIRouter()
+
+class BatchItem(BaseModel):
+    prompt: Optional[str] = None
+    lead_id: Optional[int] = None
+    custom_id: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_source(self):
+        if not self.prompt and self.lead_id is None:
+            raise ValueError("Cada ítem necesita un prompt o un lead_id")
+        return self
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    # Instrucciones aplicadas a los ítems con lead_id (por defecto, un mensaje de seguimiento)
+    instructions: Optional[str] = None
+    # "online": Responses API con concurrencia acotada; "provider": Batch API (más barata, asíncrona)
+    mode: Literal["online", "provider"] = "online"
+
+class BatchResumeRequest(BaseModel):
+    retry_failed: bool = False
+
+async def _get_owned_job(job_id: str, current_user: User) -> dict:
+    job = await chat_batch_service.get_job(job_id, current_user.id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Trabajo no encontrado")
+    return job
+
+@router.post("/", status_code=status.HTTP_202_ACCEPTED)
+async def create_batch(
+    batch_req: BatchRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Crea un trabajo de chat por lotes a partir de prompts o ids de leads y lo ejecuta
+    en segundo plano. El progreso y los resultados por ítem se consultan con
+    GET /batch/{job_id} y GET /batch/{job_id}/results.
+    """
+    if not batch_req.items:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="El lote no tiene ítems")
+    if len(batch_req.items) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"El lote supera el máximo de {settings.BATCH_MAX_ITEMS} ítems"
+        )
+
+    # Los leads deben pertenecer a la empresa del usuario
+    lead_ids = {item.lead_id for item in batch_req.items if item.lead_id is not None}
+    leads = {}
+    if lead_ids and current_user.company_id is None:
+        # Sin empresa no hay leads a los que el usuario tenga acceso
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Los ítems con lead_id requieren que el usuario pertenezca a una empresa"
+        )
+    if lead_ids:
+        leads = {
+            lead.id: lead
+            for lead in db.query(Lead).filter(
+                Lead.id.in_(lead_ids),
+                Lead.company_id == current_user.company_id
+            ).all()
+        }
+        missing = sorted(lead_ids - set(leads))
+        if missing:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Leads no encontrados: {missing}"
+            )
+
+    items = []
+    for index, item in enumerate(batch_req.items):
+        prompt = item.prompt
+        if item.lead_id is not None:
+            prompt = render_lead_prompt(leads[item.lead_id], item.prompt or batch_req.instructions)
+        items.append({
+            "custom_id": item.custom_id or (f"lead-{item.lead_id}" if item.lead_id is not None else str(index)),
+            "lead_id": item.lead_id,
+            "prompt": prompt
+        })
+
+    config = await noa_config_cache.get(db, current_user)
+    job_id = await chat_batch_service.create_job(current_user, config, items, mode=batch_req.mode)
+    await chat_batch_service.start(job_id)
+    logger.info(f"Usuario {current_user.id} creó el trabajo por lotes {job_id} ({len(items)} ítems)")
+    return await chat_batch_service.get_job(job_id, current_user.id)
+
+@router.get("/{job_id}")
+async def get_batch(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Estado y progreso del trabajo."""
+    return await _get_owned_job(job_id, current_user)
+
+@router.get("/{job_id}/results")
+async def get_batch_results(
+    job_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=500),
+    current_user: User = Depends(get_current_user)
+):
+    """Resultados por ítem (ok, error o pending), paginados por índice."""
+    job = await _get_owned_job(job_id, current_user)
+    return {
+        "job": job,
+        "results": await chat_batch_service.get_results(job_id, offset, limit)
+    }
+
+@router.post("/{job_id}/resume")
+async def resume_batch(
+    job_id: str,
+    resume_req: BatchResumeRequest = BatchResumeRequest(),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Reanuda un trabajo interrumpido desde los ítems sin resultado; con
+    `retry_failed` también reintenta los ítems con error (solo en modo online).
+    """
+    job = await _get_owned_job(job_id, current_user)
+    if job["status"] == "cancelled":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="El trabajo fue cancelado")
+    if resume_req.retry_failed and job["mode"] == "provider":
+        # El lote del proveedor ya terminó: los ítems con error se reenvían en un lote nuevo
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="retry_failed solo está disponible en modo online; cree un nuevo lote con los ítems con error"
+        )
+    if not await chat_batch_service.start(job_id, retry_failed=resume_req.retry_failed):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="El trabajo ya se está ejecutando")
+    return await _get_owned_job(job_id, current_user)
+
+@router.post("/{job_id}/cancel")
+async def cancel_batch(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Cancela el trabajo; los resultados ya obtenidos se conservan."""
+    await _get_owned_job(job_id, current_user)
+    await chat_batch_service.cancel(job_id)
+    return await _get_owned_job(job_id, current_user)
@@ -7,6 +7,7 @@ from app.api.endpoints.users import get_current_user
 from app.database.models.session import get_db
 from app.database.models.manual_entries import ManualEntry
 from app.database.models.user import User
+from app.services.answer_cache import answer_cache
 
 router = APIRouter()
 
@@ -35,12 +36,15 @@ async def delete_manual_entry(
         # 1. Eliminar embeddings asociados mediante el servicio
         from app.services.ML.embeddings.generation.text_embeddings_processor import EnhancedTextEmbeddingsProcessor
         processor = EnhancedTextEmbeddingsProcessor(current_user.email, current_user.id)
-        await processor.delete_embeddings_for_file(entry.title)
+        await processor.delete_embeddings("manual", entry.id, entry.vector_store_file_id)
         
         # 2. Eliminar el registro de la base de datos
         db.delete(entry)
         db.commit()
         
+        # 3. El corpus compartido cambió: invalidar las respuestas cacheadas
+        await answer_cache.bump_corpus_version(current_user.id)
+        
         return None  # Código 204 No Content
     except Exception as e:
         db.rollback()
@@ -6,6 +6,7 @@ from app.database.models.session import get_db
 from app.database.models.noa_config import NoaConfig
 from app.database.models.user import User
 from app.api.endpoints.users import get_current_user  # Para vincular a un usuario logueado
+from app.services.noa_config_cache import noa_config_cache
 
 router = APIRouter()
 
@@ -82,4 +83,7 @@ def save_noa_config(
         # Registra el error para poder depurar
         raise HTTPException(status_code=500, detail="Error al guardar la configuración: " + str(e))
     
+    # Invalidar la configuración compilada en todos los workers
+    noa_config_cache.invalidate_sync(current_user.id)
+    
     return {"message": "Configuración guardada con éxito"}
@@ -15,6 +15,7 @@ from sqlalchemy.orm import Session
 
 from app.database.models.uploaded_files import UploadedFile
 from app.services.ML.embeddings.generation.text_embeddings_processor import EnhancedTextEmbeddingsProcessor
+from app.services.answer_cache import answer_cache
 
 router = APIRouter()
 
@@ -81,14 +82,23 @@ async def upload_file(
 
         # 2) Generar embeddings
         try:
-            processor = EnhancedTextEmbeddingsProcessor(current_user.email, current_user.id)
-            await processor.process_text_file(temp_file.name, file.filename)
+            processor = EnhancedTextEmbeddingsProcessor(
+                current_user.email,
+                current_user.id,
+                archivo_id=new_file.id,
+                section=section
+            )
+            vector_store_file_id = await processor.process_text_file(temp_file.name, file.filename)
             logger.info(f"Embeddings generados para '{file.filename}' (usuario: {current_user.email})")
 
             # Actualizar estado a 'completed'
             new_file.processing_status = "completed"
+            new_file.vector_store_file_id = vector_store_file_id
             db.commit()
 
+            # El corpus compartido cambió: invalidar las respuestas cacheadas
+            await answer_cache.bump_corpus_version(current_user.id)
+
         except Exception as e:
             logger.error(f"Error generando embeddings para '{file.filename}': {e}")
             new_file.processing_status = "error"
@@ -155,9 +165,13 @@ async def upload_manual(
 
         # 2) Generar embeddings
         try:
-            processor = EnhancedTextEmbeddingsProcessor(current_user.email, current_user.id)
-            await processor.process_raw_text(combined_text, title=title)
+            processor = EnhancedTextEmbeddingsProcessor(current_user.email, current_user.id, section=section)
+            new_entry.vector_store_file_id = await processor.process_raw_text(
+                combined_text, title=title, manual_entry_id=new_entry.id
+            )
+            db.commit()
             logger.info(f"Embeddings generados para la carga manual (usuario: {current_user.email})")
+            await answer_cache.bump_corpus_version(current_user.id)
         except Exception as e:
             logger.error(f"Error generando embeddings para la carga manual: {e}")
             # No fallamos toda la operación si los embeddings fallan
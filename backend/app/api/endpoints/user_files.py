@@ -8,6 +8,7 @@ from app.api.endpoints.users import get_current_user
 from app.database.models.session import get_db
 from app.database.models.uploaded_files import UploadedFile
 from app.database.models.user import User
+from app.services.answer_cache import answer_cache
 
 router = APIRouter()
 
@@ -94,12 +95,15 @@ async def delete_user_file(
         # 1. Eliminar embeddings asociados mediante el servicio
         from app.services.ML.embeddings.generation.text_embeddings_processor import EnhancedTextEmbeddingsProcessor
         processor = EnhancedTextEmbeddingsProcessor(current_user.email, current_user.id)
-        await processor.delete_embeddings_for_file(file.original_filename)
+        await processor.delete_embeddings("file", file.id, file.vector_store_file_id)
         
         # 2. Eliminar el registro de la base de datos
         db.delete(file)
         db.commit()
         
+        # 3. El corpus compartido cambió: invalidar las respuestas cacheadas
+        await answer_cache.bump_corpus_version(current_user.id)
+        
         return None  # Código 204 No Content
     except Exception as e:
         db.rollback()
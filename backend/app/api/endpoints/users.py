@@ -1,11 +1,11 @@
 # backend/app/api/endpoints/users.py
 
+import time
 from datetime import timedelta, datetime
 from typing import Any, Optional, Dict
 from loguru import logger
-import redis
 
-from fastapi import APIRouter, Depends, HTTPException, status, Request, Body
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Body, Query
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from pydantic import BaseModel, EmailStr, Field
@@ -13,30 +13,25 @@ from sqlalchemy.orm import Session
 
 # Importaciones locales
 from app.core.config import settings
-from app.core.security import verify_password, create_access_token
+from app.core.security import create_access_token
 from app.database.models.session import get_db
 from app.database.models.user import User, LicenseTypeSQLA
 from app.services.user import UserService
 from app.services.gpt_tracker import GPTTokenTracker
-from app.services.api_key import APIKeyService
 from app.services.company import get_or_create_company
+from app.services.principal_cache import principal_cache
+from app.services.session_store import session_store
+from app.services.password_hasher import password_hasher
+from app.core.logger import get_sampled_logger
+from app.core.services import api_key_service, sync_redis_client
 
 # ================================================
 # Configuración del router y OAuth2
 # ================================================
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/users/token")  # Corregido el tokenUrl
-
-# ================================================
-# Configuración de Redis
-# ================================================
-redis_client = redis.Redis(
-    host=settings.REDIS_HOST,
-    port=settings.REDIS_PORT,
-    db=settings.REDIS_DB,
-    password=settings.REDIS_PASSWORD,
-    decode_responses=True
-)
+# Mensajes emitidos en cada request autenticado: muestreados
+_auth_logger = get_sampled_logger("hot.auth")
 
 # ================================================
 #                 Esquemas (Schemas)
@@ -97,6 +92,15 @@ class Token(BaseModel):
 # ================================================
 # Dependencia para obtener usuario
 # ================================================
+def token_session_id(token: str) -> Optional[str]:
+    """
+    Claim `sid` de un token ya validado por get_current_user (no verifica la firma).
+    """
+    try:
+        return jwt.get_unverified_claims(token).get("sid")
+    except JWTError:
+        return None
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db),
@@ -106,7 +110,15 @@ async def get_current_user(
     Obtiene el usuario actual basado en el token JWT.
     Verifica también que su sesión siga activa en Redis.
     Ahora incluye tracking de uso de API Key.
+    El usuario validado se guarda en la caché de principales: mientras la entrada
+    sea válida no se decodifica el token ni se consultan Postgres ni la sesión.
     """
+    user = principal_cache.get(token)
+    if user is not None:
+        if request:
+            api_key_service.increment_usage(user.api_key, request)
+        return user
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Credenciales inválidas",
@@ -125,7 +137,7 @@ async def get_current_user(
             logger.warning("Token sin 'sub' válido")
             raise credentials_exception
 
-        logger.info(f"Token decodificado correctamente para {email}")
+        _auth_logger.debug(f"Token decodificado correctamente para {email}")
 
     except JWTError as e:
         logger.error(f"Error al decodificar token: {str(e)}")
@@ -137,9 +149,8 @@ async def get_current_user(
         logger.warning(f"Usuario no encontrado para email: {email}")
         raise credentials_exception
 
-    # Verificar sesión en Redis
-    session_data = UserService.get_user_session(user.id)
-    if not session_data or session_data.get("email") != user.email:
+    # Verificar (y renovar) la sesión del token en Redis
+    if not await session_store.validate(payload.get("sid"), user.id, payload.get("exp")):
         logger.warning(f"Sesión inválida o expirada para {user.email}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -147,9 +158,10 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    principal_cache.put(token, user, payload.get("exp"))
+
     # Trackear uso de API Key solo si se proporciona la solicitud
     if request:
-        api_key_service = APIKeyService(redis_client)
         api_key_service.increment_usage(user.api_key, request)
 
     return user
@@ -241,7 +253,7 @@ async def get_pilot_credentials(
             detail="Solo el administrador puede recuperar credenciales"
         )
     
-    password = UserService.get_user_password(email)
+    password = await UserService.get_user_password(email)
     if not password:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -269,14 +281,14 @@ async def login_for_access_token(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Verificar la contraseña
-    is_valid = verify_password(form_data.password, user.hashed_password)
+    # Verificar la contraseña fuera del event loop (503 si el pool de bcrypt está saturado)
+    is_valid, new_hash = await password_hasher.verify_and_update(form_data.password, user.hashed_password)
     
     if not is_valid:
         logger.warning(f"Contraseña incorrecta para usuario: {form_data.username}")
         
         # Para depuración - comprobación especial para usuarios piloto
-        pilot_password = UserService.get_user_password(form_data.username)
+        pilot_password = await UserService.get_user_password(form_data.username)
         if pilot_password:
             logger.info(f"Intentando login con usuario piloto. Contraseña en Redis: {pilot_password[:3]}***")
             
@@ -286,22 +298,29 @@ async def login_for_access_token(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Crear token de acceso
+    # Hash con un costo de bcrypt desactualizado: guardar el recalculado
+    if new_hash is not None:
+        try:
+            user.hashed_password = new_hash
+            db.commit()
+            logger.info(f"Hash de contraseña actualizado a {settings.BCRYPT_ROUNDS} rondas para: {user.email}")
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error actualizando el hash de contraseña de {user.email}: {str(e)}")
+    
+    # Registrar la sesión en Redis; su id viaja en el claim `sid` del token
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(data={"sub": user.email})
-
-    # Almacenar datos de sesión en Redis
-    session_data = {
-        "user_id": user.id,
-        "email": user.email,
-        "full_name": user.full_name,
-        "license_type": user.license_type.value if hasattr(user.license_type, 'value') else user.license_type,
-        "api_key": user.api_key
-    }
+    try:
+        sid = await session_store.create(user.id, token_exp=time.time() + access_token_expires.total_seconds())
+    except Exception as e:
+        logger.error(f"Error storing session in Redis: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error al almacenar la sesión"
+        )
     
-    UserService.store_user_session(
-        user.id, session_data, expires=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
-    )
+    # Crear token de acceso
+    access_token = create_access_token(data={"sub": user.email, "sid": sid})
     
     logger.info(f"Inicio de sesión exitoso para: {user.email}")
 
@@ -336,15 +355,43 @@ async def get_user_profile(
 
 @router.post("/logout")
 async def logout(
+    token: str = Depends(oauth2_scheme),
     current_user: User = Depends(get_current_user)
 ) -> Any:
     """
-    Cierra la sesión del usuario actual (elimina su sesión en Redis).
+    Cierra la sesión del token actual; las de otros dispositivos siguen activas.
     """
-    redis_key = f"user_session:{current_user.id}"
-    redis_client.delete(redis_key)
+    sid = token_session_id(token)
+    if sid:
+        await session_store.revoke(current_user.id, sid)
     return {"message": "Sesión cerrada exitosamente"}
 
+@router.post("/logout-all")
+async def logout_all(
+    keep_current: bool = Query(False),
+    token: str = Depends(oauth2_scheme),
+    current_user: User = Depends(get_current_user)
+) -> Any:
+    """
+    Cierra todas las sesiones del usuario (opcionalmente, todas menos la actual).
+    """
+    closed = await session_store.revoke_all(
+        current_user.id, keep_sid=token_session_id(token) if keep_current else None
+    )
+    return {"message": "Sesiones cerradas exitosamente", "closed": closed}
+
+@router.get("/sessions")
+async def list_sessions(
+    token: str = Depends(oauth2_scheme),
+    current_user: User = Depends(get_current_user)
+) -> Any:
+    """Sesiones activas del usuario, marcando la del token actual."""
+    current_sid = token_session_id(token)
+    sessions = await session_store.list(current_user.id)
+    for session in sessions:
+        session["current"] = session["session_id"] == current_sid
+    return {"sessions": sessions}
+
 @router.put("/me", response_model=UserResponse)
 async def update_user(
     user_update: UserUpdate,
@@ -359,6 +406,9 @@ async def update_user(
         logger.info(f"Actualizando perfil para usuario: {current_user.email}")
         logger.info(f"Datos de actualización: {user_update.model_dump()}")
         
+        # current_user puede venir de la caché de principales (desacoplado de la sesión)
+        user = db.get(User, current_user.id)
+        
         # Actualizar solo los campos incluidos en el request
         update_data = user_update.model_dump(exclude_unset=True)
         
@@ -366,15 +416,16 @@ async def update_user(
             # Manejar caso especial para company (que es company_id en el modelo)
             if field == 'company':
                 company_obj = get_or_create_company(db, value)
-                setattr(current_user, 'company_id', company_obj.id)
+                setattr(user, 'company_id', company_obj.id)
             else:
-                setattr(current_user, field, value)
+                setattr(user, field, value)
 
+        # El UPDATE invalida la caché de principales en todos los workers
         db.commit()
-        db.refresh(current_user)
+        db.refresh(user)
         
-        logger.info(f"Perfil actualizado exitosamente para: {current_user.email}")
-        return current_user
+        logger.info(f"Perfil actualizado exitosamente para: {user.email}")
+        return user
     except Exception as e:
         db.rollback()
         logger.error(f"Error al actualizar perfil: {str(e)}")
@@ -395,23 +446,30 @@ async def validate_session(
 
 @router.get("/usage", response_model=Dict[str, Any])
 async def get_token_usage(
+    days: int = Query(30, ge=1, le=settings.API_KEY_USAGE_MAX_WINDOW_DAYS),
+    granularity: str = Query("day", pattern="^(hour|day|week|month)$"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ) -> Dict[str, Any]:
     """
     Obtiene las estadísticas de uso de tokens.
     Se integran tanto las estadísticas de GPT (usando GPTTokenTracker)
-    como las estadísticas de API Key (usando APIKeyService).
+    como las estadísticas de API Key (usando APIKeyService) de los últimos
+    `days` días, agrupadas por `granularity`.
     """
+    if granularity == "hour" and days > settings.API_KEY_HOURLY_RETENTION_DAYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"El detalle por hora solo está disponible para los últimos {settings.API_KEY_HOURLY_RETENTION_DAYS} días"
+        )
     try:
         # Obtener estadísticas de uso con GPTTokenTracker
-        gpt_tracker = GPTTokenTracker(redis_client)
+        gpt_tracker = GPTTokenTracker(sync_redis_client)
         gpt_usage = gpt_tracker.get_user_usage_stats(db, current_user)
         gpt_usage["lastUpdated"] = datetime.utcnow().isoformat()
 
         # Obtener estadísticas de uso con APIKeyService
-        api_key_service = APIKeyService(redis_client)
-        api_usage = api_key_service.get_usage_stats(current_user.api_key)
+        api_usage = await api_key_service.get_usage_stats(current_user.api_key, days, granularity)
         api_usage["last_updated"] = datetime.utcnow().isoformat()
 
         # Fusionar ambos resultados en un solo diccionario
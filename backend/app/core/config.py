@@ -23,12 +23,104 @@ class Settings(BaseSettings):
    REDIS_PORT: int = 6379
    REDIS_DB: int = 0
    REDIS_PASSWORD: Optional[str] = None
+   REDIS_MAX_CONNECTIONS: int = 50  # Pool del cliente asíncrono
+   REDIS_SYNC_MAX_CONNECTIONS: int = 20  # Pool del cliente síncrono (trabajo en hilos)
+   REDIS_POOL_TIMEOUT_SECONDS: float = 5.0  # Espera máxima por una conexión libre
+   REDIS_SOCKET_TIMEOUT_SECONDS: float = 5.0
+   REDIS_CONNECT_TIMEOUT_SECONDS: float = 2.0
+   REDIS_HEALTH_CHECK_INTERVAL_SECONDS: int = 30
+
+   # Chat
+   CHAT_CONVERSATION_TTL_SECONDS: int = 3600  # TTL deslizante del estado de conversación
+   # "summary": resumen + últimos turnos con presupuesto fijo; "legacy": previous_response_id con reinicios
+   CHAT_CONTEXT_MODE: str = "summary"
+   CHAT_CONTEXT_KEEP_TURNS: int = 4
+   CHAT_CONTEXT_TOKEN_BUDGET: int = 1500
+   CHAT_SUMMARY_MODEL: str = "gpt-4o-mini"
+   # "file_search": herramienta hospedada; "managed": búsqueda propia con presupuesto de tokens
+   CHAT_RETRIEVAL_MODE: str = "file_search"
+   CHAT_RETRIEVAL_CANDIDATES: int = 12
+   CHAT_RETRIEVAL_TOKEN_BUDGET: int = 1200
+   CHAT_RETRIEVAL_MIN_SCORE: float = 0.3
+   # Enrutamiento por mensaje entre un modelo rápido y uno fuerte
+   CHAT_ROUTING_ENABLED: bool = True
+   CHAT_FAST_MODEL: str = "gpt-4o-mini"
+   CHAT_STRONG_MODEL: str = "gpt-4o"
+   CHAT_ROUTING_FAST_MAX_TOKENS: int = 40
+   CHAT_ROUTING_LONG_TOKENS: int = 120
+   CHAT_ROUTING_STRONG_LATENCY_BUDGET_MS: float = 0  # 0 = sin degradación por latencia
+
+   # Rate limiting (tokens LLM estimados por minuto)
+   RATE_LIMIT_ENABLED: bool = True
+   RATE_LIMIT_USER_TPM: int = 20000
+   RATE_LIMIT_COMPANY_TPM: int = 60000
+   RATE_LIMIT_GLOBAL_TPM: int = 400000
+
+   # Caché semántica de respuestas
+   ANSWER_CACHE_ENABLED: bool = True
+   ANSWER_CACHE_TTL_SECONDS: int = 86400
+   ANSWER_CACHE_MAX_ENTRIES: int = 500  # Máximo de respuestas por tenant/versión
+   ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.92
+   EMBEDDING_MODEL: str = "text-embedding-3-small"
+
+   # Registro write-behind de uso de tokens
+   USAGE_BUFFER_MAX: int = 10000
+   USAGE_FLUSH_SIZE: int = 200
+   USAGE_FLUSH_INTERVAL_SECONDS: float = 2.0
+
+   # Coalescencia de solicitudes de chat duplicadas
+   CHAT_COALESCE_ENABLED: bool = True
+   CHAT_COALESCE_WINDOW_SECONDS: int = 10
+   CHAT_IDEMPOTENCY_TTL_SECONDS: int = 86400
+
+   # Concurrencia adaptativa y circuit breaker hacia OpenAI
+   LLM_LIMITER_ENABLED: bool = True
+   LLM_CONCURRENCY_INITIAL: int = 16
+   LLM_CONCURRENCY_MIN: int = 2
+   LLM_CONCURRENCY_MAX: int = 128
+   LLM_QUEUE_TIMEOUT_SECONDS: float = 30.0
+   LLM_LATENCY_TOLERANCE: float = 2.0  # Latencia reciente / base a partir de la cual se reduce
+   LLM_BREAKER_ERROR_THRESHOLD: float = 0.5
+   LLM_BREAKER_MIN_REQUESTS: int = 20
+   LLM_BREAKER_WINDOW_SECONDS: float = 30.0
+   LLM_BREAKER_OPEN_SECONDS: float = 15.0
+
+   # Chat por WebSocket
+   WS_AUTH_TIMEOUT_SECONDS: float = 10.0
+   WS_HEARTBEAT_SECONDS: float = 20.0
+   WS_IDLE_TIMEOUT_SECONDS: float = 60.0  # Sin pong ni mensajes durante este tiempo se cierra
+   WS_SESSION_RECHECK_SECONDS: float = 300.0
+   WS_SEND_QUEUE_SIZE: int = 64
+
+   # Chat por lotes
+   BATCH_MAX_ITEMS: int = 1000
+   BATCH_CONCURRENCY: int = 4  # Ítems simultáneos por trabajo
+   BATCH_MAX_LIMITER_SHARE: float = 0.5  # Fracción máxima de la concurrencia LLM para lotes
+   BATCH_TTL_SECONDS: int = 7 * 86400
+   BATCH_POLL_SECONDS: float = 60.0  # Consulta del estado en la Batch API del proveedor
 
    # Security
    JWT_SECRET_KEY: str = "temporalSecretKey123"
    JWT_ALGORITHM: str = "HS256"
    ACCESS_TOKEN_EXPIRE_MINUTES: int = 1440
    REFRESH_TOKEN_EXPIRE_DAYS: int = 7
+   BCRYPT_ROUNDS: int = 12
+   # Pool de hilos para bcrypt: hilos y operaciones en espera antes de responder 503
+   PASSWORD_HASH_WORKERS: int = 2
+   PASSWORD_HASH_MAX_QUEUE: int = 32
+   # Sesiones de login: expiración por inactividad (deslizante, nunca más allá del token)
+   SESSION_IDLE_TTL_SECONDS: int = 8 * 3600
+   SESSION_MAX_PER_USER: int = 10  # 0 = sin límite; al superarlo se cierran las más antiguas
+
+   # Ventana de agregación local del uso de API Keys (0 = escribir en cada request)
+   API_KEY_USAGE_FLUSH_SECONDS: float = 0.25
+   # Días que se conservan los contadores por hora (las ventanas horarias no van más atrás)
+   API_KEY_HOURLY_RETENTION_DAYS: int = 7
+   API_KEY_USAGE_MAX_WINDOW_DAYS: int = 366
+
+   # Caché en proceso del usuario autenticado (por hash del token)
+   PRINCIPAL_CACHE_TTL_SECONDS: int = 60
+   PRINCIPAL_CACHE_MAX_ENTRIES: int = 10000
 
    # Application Hosts and Ports
    BACKEND_HOST: str = "0.0.0.0"
@@ -38,6 +130,18 @@ class Settings(BaseSettings):
 
    # OpenAI
    OPENAI_API_KEY: str
+   OPENAI_VECTOR_STORE_ID: str = "vs_67da2a9a90b4819194ed77849ac443db"
+   # Pool HTTP compartido por todos los clientes OpenAI
+   OPENAI_MAX_CONNECTIONS: int = 200
+   OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = 50
+   OPENAI_KEEPALIVE_EXPIRY_SECONDS: float = 60
+   OPENAI_CONNECT_TIMEOUT_SECONDS: float = 5
+   OPENAI_READ_TIMEOUT_SECONDS: float = 120
+   OPENAI_HTTP2: bool = False  # Requiere el paquete opcional h2
+   # Grabación/reproducción del tráfico con OpenAI: "off", "record" o "replay"
+   OPENAI_RECORD_MODE: str = "off"
+   OPENAI_RECORD_PATH: str = "recordings/openai.jsonl.gz"
+   OPENAI_REPLAY_LATENCY_SCALE: float = 1.0  # 0 = sin latencia, 0.5 = el doble de rápido
 
    # Mail
    MAIL_USERNAME: str
@@ -46,6 +150,15 @@ class Settings(BaseSettings):
    MAIL_PORT: int = 587
    MAIL_SERVER: str = "smtp.gmail.com"
    
+   # Logging
+   LOG_LEVEL: str = "INFO"
+   # Niveles por módulo o clave de muestreo, p. ej. "app.services.ML=WARNING,hot.auth=WARNING"
+   LOG_LEVELS: str = ""
+   LOG_STDLIB_LEVEL: str = "WARNING"  # Mínimo para lo que llega por `logging` (uvicorn, librerías)
+   LOG_JSON: bool = True  # Archivos en JSON (una línea por registro)
+   LOG_CONSOLE_JSON: bool = False
+   LOG_SAMPLE_PER_SECOND: float = 1.0  # Mensajes por segundo de cada logger muestreado
+
    # Admin settings for pilot program
    ADMIN_EMAIL: str = ""  # Por defecto vacío, se asignará en el init
 
@@ -1,6 +1,12 @@
 from loguru import logger
+import logging
 import sys
+import threading
+import time
+from functools import lru_cache
 from pathlib import Path
+from typing import Dict, Optional, Tuple
+from app.core.config import settings
 
 # Crear directorio de logs si no existe
 Path("logs").mkdir(exist_ok=True)
@@ -16,24 +22,68 @@ log_format = (
     "<level>{message}</level>"
 )
 
+
+# ------------------------------------------------------------------
+# Niveles por logger
+# ------------------------------------------------------------------
+def _parse_levels(spec: str) -> Dict[str, int]:
+    """Convierte "app.services.ML=WARNING,uvicorn=ERROR" en {prefijo: nivel numérico}."""
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = logger.level(level.strip().upper()).no
+    return levels
+
+_default_level = logger.level(settings.LOG_LEVEL.upper()).no
+_levels = _parse_levels(settings.LOG_LEVELS)
+
+@lru_cache(maxsize=1024)
+def _level_for(name: str) -> int:
+    # El prefijo más largo que coincida (por componentes del módulo) define el nivel
+    best, best_len = _default_level, -1
+    for prefix, level in _levels.items():
+        if (name == prefix or name.startswith(prefix + ".")) and len(prefix) > best_len:
+            best, best_len = level, len(prefix)
+    return best
+
+def _level_filter(record) -> bool:
+    return record["level"].no >= _level_for(record["name"] or "")
+
+def _audit_filter(record) -> bool:
+    return "audit" in record["extra"]
+
+
+# ------------------------------------------------------------------
+# Sinks: todos encolados (la escritura la hace un hilo de fondo de loguru) y sin
+# `diagnose`, que serializa las variables locales de cada frame en las excepciones
+# ------------------------------------------------------------------
+sink_options = dict(enqueue=True, backtrace=True, diagnose=False)
+file_options = dict(
+    sink_options,
+    rotation="1 MB",
+    compression="zip",
+    serialize=settings.LOG_JSON
+)
+
 # Añadir handler para consola (stdout)
 logger.add(
     sys.stdout,
     format=log_format,
-    level="INFO",
-    colorize=True
+    level=0,
+    filter=_level_filter,
+    colorize=not settings.LOG_CONSOLE_JSON,
+    serialize=settings.LOG_CONSOLE_JSON,
+    **sink_options
 )
 
 # Añadir handler para archivo con rotación
 logger.add(
     "logs/app.log",
     format=log_format,
-    level="INFO",
-    rotation="1 MB",
+    level=0,
+    filter=_level_filter,
     retention="10 days",
-    compression="zip",
-    backtrace=True,
-    diagnose=True
+    **file_options
 )
 
 # Añadir handler específico para errores
@@ -41,11 +91,8 @@ logger.add(
     "logs/error.log",
     format=log_format,
     level="ERROR",
-    rotation="1 MB",
     retention="10 days",
-    compression="zip",
-    backtrace=True,
-    diagnose=True
+    **file_options
 )
 
 # Handler específico para audit logs (seguridad y autenticación)
@@ -53,12 +100,94 @@ logger.add(
     "logs/audit.log",
     format=log_format,
     level="INFO",
-    rotation="1 MB",
     retention="30 days",
-    compression="zip",
-    filter=lambda record: "audit" in record["extra"]
+    filter=_audit_filter,
+    **file_options
 )
 
+
+# ------------------------------------------------------------------
+# logging estándar (uvicorn, librerías y módulos que usan `logging`) -> loguru
+# ------------------------------------------------------------------
+class InterceptHandler(logging.Handler):
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            level = logger.level(record.levelname).name
+        except ValueError:
+            level = record.levelno
+        # Subir hasta el frame que originó el log para conservar módulo, función y línea
+        frame, depth = logging.currentframe(), 2
+        while frame is not None and frame.f_code.co_filename == logging.__file__:
+            frame = frame.f_back
+            depth += 1
+        logger.opt(depth=depth, exception=record.exc_info).log(level, record.getMessage())
+
+logging.basicConfig(handlers=[InterceptHandler()], level=settings.LOG_STDLIB_LEVEL.upper(), force=True)
+
+
+# ------------------------------------------------------------------
+# Muestreo de mensajes de rutas calientes
+# ------------------------------------------------------------------
+class SampledLogger:
+    """
+    Logger con límite de frecuencia para mensajes que se emiten en cada request.
+
+    Deja pasar como máximo `per_second` mensajes por segundo (con ráfagas del mismo
+    tamaño) y descarta el resto; el siguiente mensaje emitido lleva en `extra.suppressed`
+    cuántos se descartaron desde el anterior.
+    """
+
+    def __init__(self, key: str, per_second: float):
+        self.key = key
+        self.per_second = per_second
+        self._lock = threading.Lock()
+        self._tokens = max(1.0, per_second)
+        self._updated = time.monotonic()
+        self._suppressed = 0
+
+    def _allow(self) -> Tuple[bool, int]:
+        with self._lock:
+            now = time.monotonic()
+            capacity = max(1.0, self.per_second)
+            self._tokens = min(capacity, self._tokens + (now - self._updated) * self.per_second)
+            self._updated = now
+            if self._tokens < 1.0:
+                self._suppressed += 1
+                return False, 0
+            self._tokens -= 1.0
+            suppressed, self._suppressed = self._suppressed, 0
+            return True, suppressed
+
+    def _log(self, level: str, message: str, *args, **kwargs) -> None:
+        # Comprobar el nivel primero: un mensaje filtrado no consume cupo
+        if logger.level(level).no < _level_for(self.key):
+            return
+        allowed, suppressed = self._allow()
+        if not allowed:
+            return
+        if suppressed:
+            message = f"{message} (+{suppressed} similares omitidos)"
+        logger.opt(depth=2).bind(sample=self.key, suppressed=suppressed).log(level, message, *args, **kwargs)
+
+    def log(self, level: str, message: str, *args, **kwargs) -> None:
+        self._log(level, message, *args, **kwargs)
+
+    def debug(self, message: str, *args, **kwargs) -> None:
+        self._log("DEBUG", message, *args, **kwargs)
+
+    def info(self, message: str, *args, **kwargs) -> None:
+        self._log("INFO", message, *args, **kwargs)
+
+    def warning(self, message: str, *args, **kwargs) -> None:
+        self._log("WARNING", message, *args, **kwargs)
+
+def get_sampled_logger(key: str, per_second: Optional[float] = None) -> SampledLogger:
+    """
+    Retorna un logger muestreado. `key` identifica el mensaje y también se usa como
+    nombre para LOG_LEVELS (p. ej. "hot.auth=WARNING" lo silencia).
+    """
+    return SampledLogger(key, settings.LOG_SAMPLE_PER_SECOND if per_second is None else per_second)
+
 def get_audit_logger():
     """
     Retorna un logger configurado específicamente para logs de auditoría
@@ -66,4 +195,4 @@ def get_audit_logger():
     return logger.bind(audit=True)
 
 # Exportar el logger configurado
-__all__ = ["logger", "get_audit_logger"]
\ No newline at end of file
+__all__ = ["logger", "get_audit_logger", "get_sampled_logger"]
@@ -0,0 +1,137 @@
+# app/core/openai_clients.py
+
+import importlib.util
+import threading
+from typing import Optional
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.openai_recorder import InteractionLog, RecordReplayTransport, AsyncRecordReplayTransport
+
+
+class OpenAIClientRegistry:
+    """
+    Clientes OpenAI compartidos por toda la aplicación.
+
+    Un cliente síncrono (llamadas en hilos: chunking, vector store, Batch API) y uno
+    asíncrono (Responses, embeddings, streaming), cada uno con un único pool httpx con
+    keep-alive, límites y timeouts comunes. Así las conexiones TLS se reutilizan entre
+    llamadas en lugar de abrirse un pool nuevo por cada procesador o servicio.
+    Los clientes se crean al primer uso y se cierran en el shutdown de la aplicación.
+
+    Con `recorder` (OPENAI_RECORD_MODE=record|replay) todo el tráfico pasa por un
+    transporte que graba las interacciones o las reproduce sin salir a la red.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        max_connections: int = 200,
+        max_keepalive_connections: int = 50,
+        keepalive_expiry: float = 60.0,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 120.0,
+        http2: bool = False,
+        max_retries: int = 2,
+        recorder: Optional[InteractionLog] = None
+    ):
+        self.api_key = api_key
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout, pool=connect_timeout)
+        self.http2 = http2 and self._http2_available()
+        self.max_retries = max_retries
+        self.recorder = recorder
+        self._lock = threading.Lock()
+        self._client: Optional[OpenAI] = None
+        self._async_client: Optional[AsyncOpenAI] = None
+
+    @staticmethod
+    def _http2_available() -> bool:
+        # HTTP/2 en httpx requiere el paquete opcional `h2`
+        if importlib.util.find_spec("h2") is None:
+            logger.warning("OPENAI_HTTP2 activo pero el paquete 'h2' no está instalado; se usa HTTP/1.1")
+            return False
+        return True
+
+    def _http_options(self) -> dict:
+        if self.recorder is None:
+            return {"limits": self.limits, "timeout": self.timeout, "http2": self.http2}
+        # Con un transporte propio httpx ignora `limits`: se aplican al transporte interno
+        transport = None
+        if self.recorder.mode == "record":
+            transport = httpx.HTTPTransport(limits=self.limits, http2=self.http2)
+        return {"timeout": self.timeout, "transport": RecordReplayTransport(self.recorder, transport)}
+
+    def _async_http_options(self) -> dict:
+        if self.recorder is None:
+            return {"limits": self.limits, "timeout": self.timeout, "http2": self.http2}
+        transport = None
+        if self.recorder.mode == "record":
+            transport = httpx.AsyncHTTPTransport(limits=self.limits, http2=self.http2)
+        return {"timeout": self.timeout, "transport": AsyncRecordReplayTransport(self.recorder, transport)}
+
+    @property
+    def client(self) -> OpenAI:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = OpenAI(
+                        api_key=self.api_key,
+                        timeout=self.timeout,
+                        max_retries=self.max_retries,
+                        http_client=DefaultHttpxClient(**self._http_options())
+                    )
+        return self._client
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    self._async_client = AsyncOpenAI(
+                        api_key=self.api_key,
+                        timeout=self.timeout,
+                        max_retries=self.max_retries,
+                        http_client=DefaultAsyncHttpxClient(**self._async_http_options())
+                    )
+        return self._async_client
+
+    async def close(self):
+        """Cierra los pools de conexiones (shutdown de la aplicación)."""
+        with self._lock:
+            client, self._client = self._client, None
+            async_client, self._async_client = self._async_client, None
+        if async_client is not None:
+            await async_client.close()
+        if client is not None:
+            client.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        logger.info("Clientes OpenAI cerrados")
+
+
+def _build_recorder() -> Optional[InteractionLog]:
+    if settings.OPENAI_RECORD_MODE not in ("record", "replay"):
+        return None
+    return InteractionLog(
+        settings.OPENAI_RECORD_PATH,
+        settings.OPENAI_RECORD_MODE,
+        latency_scale=settings.OPENAI_REPLAY_LATENCY_SCALE
+    )
+
+
+openai_clients = OpenAIClientRegistry(
+    api_key=settings.OPENAI_API_KEY,
+    max_connections=settings.OPENAI_MAX_CONNECTIONS,
+    max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+    connect_timeout=settings.OPENAI_CONNECT_TIMEOUT_SECONDS,
+    read_timeout=settings.OPENAI_READ_TIMEOUT_SECONDS,
+    http2=settings.OPENAI_HTTP2,
+    recorder=_build_recorder()
+)
@@ -0,0 +1,303 @@
+# app/core/openai_recorder.py
+
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Optional
+import httpx
+from app.core.logger import logger
+
+# Encabezados de respuesta que no se guardan
+_SKIPPED_HEADERS = {"set-cookie"}
+
+
+class ReplayMissError(httpx.TransportError):
+    """La solicitud no tiene una interacción grabada que reproducir."""
+
+
+def _request_key(request: httpx.Request, body: bytes) -> str:
+    """
+    Clave estable de una solicitud: método, ruta y cuerpo canónico. Los cuerpos JSON
+    se normalizan con claves ordenadas; en multipart se elimina el boundary aleatorio.
+    """
+    content_type = request.headers.get("content-type", "")
+    if "application/json" in content_type:
+        try:
+            body = json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False).encode("utf-8")
+        except ValueError:
+            pass
+    elif "boundary=" in content_type:
+        boundary = content_type.split("boundary=", 1)[1].strip('"').encode("latin-1")
+        body = body.replace(boundary, b"")
+    digest = hashlib.sha256(body).hexdigest()
+    return f"{request.method} {request.url.raw_path.decode('ascii')} {digest}"
+
+
+def _request_summary(request: httpx.Request, body: bytes) -> Optional[Dict]:
+    """Cuerpo JSON de la solicitud (sin credenciales) para analizar el tráfico grabado."""
+    if "application/json" not in request.headers.get("content-type", ""):
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+class InteractionLog:
+    """
+    Archivo JSONL comprimido con gzip de interacciones HTTP con OpenAI.
+
+    Cada línea guarda la clave de la solicitud, su cuerpo JSON, el estado y los
+    encabezados de la respuesta, el tiempo hasta los encabezados y los fragmentos del
+    cuerpo con su instante relativo, de modo que el streaming se reproduce con el
+    mismo ritmo. En modo replay las interacciones con la misma clave se entregan en
+    el orden grabado (p. ej. el polling de un archivo); agotadas, se repite la última.
+    """
+
+    def __init__(self, path: str, mode: str, latency_scale: float = 1.0):
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._file = None
+        self._recordings: Dict[str, Deque[Dict]] = defaultdict(deque)
+        self._last: Dict[str, Dict] = {}
+        if mode == "record":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # Modo append: cada sesión agrega un miembro gzip al mismo archivo
+            self._file = gzip.open(path, "at", encoding="utf-8")
+            logger.info(f"Grabando interacciones con OpenAI en {path}")
+        elif mode == "replay":
+            self._load()
+
+    def _load(self):
+        count = 0
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._recordings[entry["key"]].append(entry)
+                    count += 1
+        logger.info(f"Reproduciendo {count} interacciones con OpenAI desde {self.path}")
+
+    def write(self, entry: Dict):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def take(self, key: str) -> Dict:
+        with self._lock:
+            queue = self._recordings.get(key)
+            if queue:
+                self._last[key] = queue.popleft()
+            entry = self._last.get(key)
+        if entry is None:
+            raise ReplayMissError(f"Sin interacción grabada para {key}")
+        return entry
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # ------------------------------------------------------------------
+    # Construcción de entradas y respuestas
+    # ------------------------------------------------------------------
+    @staticmethod
+    def new_entry(key: str, request: httpx.Request, body: bytes, response: httpx.Response, headers_ms: float) -> Dict:
+        return {
+            "key": key,
+            "method": request.method,
+            "path": request.url.path,
+            "request": _request_summary(request, body),
+            "recorded_at": time.time(),
+            "status": response.status_code,
+            "headers": [
+                [name, value] for name, value in response.headers.multi_items()
+                if name.lower() not in _SKIPPED_HEADERS
+            ],
+            "headers_ms": round(headers_ms, 1),
+            "chunks": []
+        }
+
+    def delays(self, entry: Dict) -> List[float]:
+        """Pausas (en segundos) antes de cada fragmento, escaladas."""
+        previous = entry["headers_ms"]
+        delays = []
+        for offset_ms, _ in entry["chunks"]:
+            delays.append(max(0.0, offset_ms - previous) * self.latency_scale / 1000)
+            previous = offset_ms
+        return delays
+
+    @staticmethod
+    def chunk_bytes(entry: Dict) -> List[bytes]:
+        return [base64.b64decode(data) for _, data in entry["chunks"]]
+
+
+# ----------------------------------------------------------------------
+# Streams de respuesta
+# ----------------------------------------------------------------------
+class _RecordingStream(httpx.SyncByteStream):
+    def __init__(self, stream: httpx.SyncByteStream, log: InteractionLog, entry: Dict, started: float):
+        self.stream = stream
+        self.log = log
+        self.entry = entry
+        self.started = started
+        self.saved = False
+
+    def __iter__(self):
+        for chunk in self.stream:
+            self.entry["chunks"].append([
+                round((time.monotonic() - self.started) * 1000, 1),
+                base64.b64encode(chunk).decode("ascii")
+            ])
+            yield chunk
+        self._save()
+
+    def _save(self, truncated: bool = False):
+        if not self.saved:
+            self.saved = True
+            self.entry["truncated"] = truncated
+            self.log.write(self.entry)
+
+    def close(self):
+        self._save(truncated=not self.saved)
+        self.stream.close()
+
+
+class _AsyncRecordingStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, log: InteractionLog, entry: Dict, started: float):
+        self.stream = stream
+        self.log = log
+        self.entry = entry
+        self.started = started
+        self.saved = False
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            self.entry["chunks"].append([
+                round((time.monotonic() - self.started) * 1000, 1),
+                base64.b64encode(chunk).decode("ascii")
+            ])
+            yield chunk
+        self._save()
+
+    def _save(self, truncated: bool = False):
+        if not self.saved:
+            self.saved = True
+            self.entry["truncated"] = truncated
+            self.log.write(self.entry)
+
+    async def aclose(self):
+        self._save(truncated=not self.saved)
+        await self.stream.aclose()
+
+
+class _ReplayStream(httpx.SyncByteStream):
+    def __init__(self, chunks: List[bytes], delays: List[float]):
+        self.chunks = chunks
+        self.delays = delays
+
+    def __iter__(self):
+        for chunk, delay in zip(self.chunks, self.delays):
+            if delay:
+                time.sleep(delay)
+            yield chunk
+
+
+class _AsyncReplayStream(httpx.AsyncByteStream):
+    def __init__(self, chunks: List[bytes], delays: List[float]):
+        self.chunks = chunks
+        self.delays = delays
+
+    async def __aiter__(self):
+        for chunk, delay in zip(self.chunks, self.delays):
+            if delay:
+                await asyncio.sleep(delay)
+            yield chunk
+
+
+# ----------------------------------------------------------------------
+# Transportes
+# ----------------------------------------------------------------------
+class RecordReplayTransport(httpx.BaseTransport):
+    """Transporte httpx síncrono que graba o reproduce las interacciones."""
+
+    def __init__(self, log: InteractionLog, transport: Optional[httpx.BaseTransport] = None):
+        self.log = log
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        body = request.read()
+        key = _request_key(request, body)
+
+        if self.log.mode == "replay":
+            entry = self.log.take(key)
+            time.sleep(entry["headers_ms"] * self.log.latency_scale / 1000)
+            return httpx.Response(
+                entry["status"],
+                headers=entry["headers"],
+                stream=_ReplayStream(self.log.chunk_bytes(entry), self.log.delays(entry)),
+                request=request
+            )
+
+        started = time.monotonic()
+        response = self.transport.handle_request(request)
+        entry = self.log.new_entry(key, request, body, response, (time.monotonic() - started) * 1000)
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, self.log, entry, started),
+            extensions=response.extensions,
+            request=request
+        )
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class AsyncRecordReplayTransport(httpx.AsyncBaseTransport):
+    """Transporte httpx asíncrono que graba o reproduce las interacciones."""
+
+    def __init__(self, log: InteractionLog, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.log = log
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        key = _request_key(request, body)
+
+        if self.log.mode == "replay":
+            entry = self.log.take(key)
+            await asyncio.sleep(entry["headers_ms"] * self.log.latency_scale / 1000)
+            return httpx.Response(
+                entry["status"],
+                headers=entry["headers"],
+                stream=_AsyncReplayStream(self.log.chunk_bytes(entry), self.log.delays(entry)),
+                request=request
+            )
+
+        started = time.monotonic()
+        response = await self.transport.handle_async_request(request)
+        entry = self.log.new_entry(key, request, body, response, (time.monotonic() - started) * 1000)
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_AsyncRecordingStream(response.stream, self.log, entry, started),
+            extensions=response.extensions,
+            request=request
+        )
+
+    async def aclose(self):
+        if self.transport is not None:
+            await self.transport.aclose()
@@ -0,0 +1,109 @@
+# app/core/redis.py
+
+from typing import Dict
+import redis
+import redis.asyncio as aioredis
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
+from app.core.config import settings
+from app.core.logger import logger
+
+
+class RedisManager:
+    """
+    Conexiones Redis de la aplicación.
+
+    `client` es el cliente asíncrono que usa todo el código que corre en el event loop;
+    `sync_client` queda para el trabajo que ya se ejecuta en hilos (escrituras
+    write-behind, procesamiento de archivos). Ambos usan un pool bloqueante acotado
+    (`max_connections`; si no hay conexión libre se espera hasta `pool_timeout`),
+    timeouts de socket, reintentos con backoff ante timeouts y health checks de las
+    conexiones inactivas. `stats()` expone el uso de cada pool.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        db: int = 0,
+        password: str = None,
+        max_connections: int = 50,
+        sync_max_connections: int = 20,
+        pool_timeout: float = 5.0,
+        socket_timeout: float = 5.0,
+        connect_timeout: float = 2.0,
+        health_check_interval: int = 30,
+        retries: int = 3
+    ):
+        options = dict(
+            host=host,
+            port=port,
+            db=db,
+            password=password,
+            socket_timeout=socket_timeout,
+            socket_connect_timeout=connect_timeout,
+            socket_keepalive=True,
+            retry_on_timeout=True,
+            health_check_interval=health_check_interval,
+            decode_responses=True
+        )
+        self.pool = aioredis.BlockingConnectionPool(
+            max_connections=max_connections,
+            timeout=pool_timeout,
+            retry=AsyncRetry(ExponentialBackoff(cap=1.0, base=0.05), retries),
+            **options
+        )
+        self.sync_pool = redis.BlockingConnectionPool(
+            max_connections=sync_max_connections,
+            timeout=pool_timeout,
+            retry=Retry(ExponentialBackoff(cap=1.0, base=0.05), retries),
+            **options
+        )
+        self.client = aioredis.Redis(connection_pool=self.pool)
+        self.sync_client = redis.Redis(connection_pool=self.sync_pool)
+
+    async def ping(self) -> None:
+        await self.client.ping()
+
+    async def close(self) -> None:
+        await self.client.aclose()
+        await self.pool.disconnect()
+        self.sync_client.close()
+        self.sync_pool.disconnect()
+        logger.info("Conexiones Redis cerradas")
+
+    def stats(self) -> Dict:
+        # Atributos internos de redis-py: si cambian, las métricas quedan en None
+        in_use = getattr(self.pool, "_in_use_connections", None)
+        available = getattr(self.pool, "_available_connections", None)
+        created = getattr(self.sync_pool, "_connections", None)
+        queue = getattr(getattr(self.sync_pool, "pool", None), "queue", None)
+        sync_idle = sum(1 for conn in queue if conn is not None) if queue is not None else None
+        return {
+            "async": {
+                "max_connections": self.pool.max_connections,
+                "in_use": len(in_use) if in_use is not None else None,
+                "idle": len(available) if available is not None else None
+            },
+            "sync": {
+                "max_connections": self.sync_pool.max_connections,
+                "created": len(created) if created is not None else None,
+                "in_use": len(created) - sync_idle if created is not None and sync_idle is not None else None,
+                "idle": sync_idle
+            }
+        }
+
+
+redis_manager = RedisManager(
+    host=settings.REDIS_HOST,
+    port=settings.REDIS_PORT,
+    db=settings.REDIS_DB,
+    password=settings.REDIS_PASSWORD,
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+    sync_max_connections=settings.REDIS_SYNC_MAX_CONNECTIONS,
+    pool_timeout=settings.REDIS_POOL_TIMEOUT_SECONDS,
+    socket_timeout=settings.REDIS_SOCKET_TIMEOUT_SECONDS,
+    connect_timeout=settings.REDIS_CONNECT_TIMEOUT_SECONDS,
+    health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL_SECONDS
+)
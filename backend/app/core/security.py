@@ -5,7 +5,14 @@ from passlib.context import CryptContext
 from app.core.config import settings
 import secrets
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Los hashes con un costo menor a BCRYPT_ROUNDS se recalculan al iniciar sesión
+# (ver PasswordHasher.verify_and_update)
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS
+)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
@@ -1,28 +1,29 @@
 # app/core/services.py
-from redis import Redis
 from app.core.config import settings
+from app.core.redis import redis_manager
 from app.services.api_key import APIKeyService
 from app.core.logger import logger
 
-# Cliente Redis global
-redis_client = Redis(
-    host=settings.REDIS_HOST,
-    port=settings.REDIS_PORT,
-    db=settings.REDIS_DB,
-    password=settings.REDIS_PASSWORD,
-    decode_responses=True
-)
+# Clientes Redis globales (ver RedisManager): asíncrono para el event loop,
+# síncrono solo para trabajo que ya corre en hilos
+redis_client = redis_manager.client
+sync_redis_client = redis_manager.sync_client
 
 # Servicio de API Keys global
-api_key_service = APIKeyService(redis_client)
+api_key_service = APIKeyService(
+    redis_client,
+    sync_redis_client,
+    flush_interval=settings.API_KEY_USAGE_FLUSH_SECONDS,
+    hourly_retention_days=settings.API_KEY_HOURLY_RETENTION_DAYS
+)
 
-def init_services():
+async def init_services():
     """
     Inicializa y verifica la conexión con los servicios necesarios
     """
     try:
         # Verificar conexión con Redis
-        redis_client.ping()
+        await redis_manager.ping()
         logger.info("Conexión exitosa con Redis")
         
         # Inicializar otros servicios si es necesario
@@ -31,4 +32,4 @@ def init_services():
         logger.error(f"Error al inicializar servicios: {str(e)}")
         raise e
 
-__all__ = ["redis_client", "api_key_service", "init_services"]
\ No newline at end of file
+__all__ = ["redis_manager", "redis_client", "sync_redis_client", "api_key_service", "init_services"]
@@ -1,12 +1,22 @@
 # backend/app/database/models/init_db.py
 
+from sqlalchemy import text
 from app.database.models.session import engine, Base
 # Importar aquí todos tus modelos para que se registren en Base.metadata
 from app.database.models import user, lead, manual_entries, noa_config, token_usage, uploaded_files
 
+# Columnas agregadas a tablas existentes (create_all no altera tablas ya creadas)
+COLUMN_UPGRADES = (
+    "ALTER TABLE uploaded_files ADD COLUMN IF NOT EXISTS vector_store_file_id VARCHAR(255)",
+    "ALTER TABLE manual_entries ADD COLUMN IF NOT EXISTS vector_store_file_id VARCHAR(255)",
+)
+
 def init_database():
     # Esto crea todas las tablas que aún no existan en la base de datos
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        for statement in COLUMN_UPGRADES:
+            connection.execute(text(statement))
 
 if __name__ == "__main__":
     init_database()
@@ -13,4 +13,6 @@ class ManualEntry(Base):
     title = Column(String(255), nullable=False)
     content = Column(JSON, nullable=False)  # Almacena los campos como JSON
     section = Column(String(50), nullable=True, default="products")
+    # Id del archivo en el vector store de OpenAI (para eliminar sus embeddings)
+    vector_store_file_id = Column(String(255), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
@@ -16,6 +16,8 @@ class UploadedFile(Base):
     processing_status = Column(String(50), nullable=True, default="pending")
     upload_date = Column(DateTime(timezone=True), server_default=func.now())
     section = Column(String(50), nullable=True, default="products")  # Añadido campo para sección
+    # Id del archivo en el vector store de OpenAI (para eliminar sus embeddings)
+    vector_store_file_id = Column(String(255), nullable=True)
 
     # (Si quieres relacionarlo con ChatSession o Company, déjalo)
     # chat_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=True, index=True)
@@ -3,7 +3,15 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.database.models.init_db import init_database
-from app.core.services import init_services
+from app.core.services import init_services, api_key_service, redis_manager
+from app.services.cache_invalidation import invalidation_bus
+from app.services.usage_recorder import usage_recorder
+from app.services.llm_limiter import llm_limiter
+from app.services.loop_monitor import loop_lag_monitor
+from app.services.model_router import model_router
+from app.services.password_hasher import password_hasher
+from app.core.openai_clients import openai_clients
+from app.services.chat_batch import chat_batch_service
 from app.utils.error_handlers import http_error_handler, CustomException
 from starlette.responses import JSONResponse
 import openai
@@ -14,6 +22,7 @@ from app.api.endpoints import upload
 from app.api.endpoints import user_files
 from app.api.endpoints import manual_entries  # <-- Importa el archivo manual_entries.py
 from app.api.endpoints import chat
+from app.api.endpoints import chat_batch
 from app.api.endpoints import lead  # <-- Importa el endpoint de leads
 
 from app.core.logger import logger
@@ -35,12 +44,34 @@ app.add_middleware(
 async def startup_event():
     try:
         init_database()
-        init_services()
+        await init_services()
+        await invalidation_bus.start()
+        await usage_recorder.start()
+        await api_key_service.start()
+        await loop_lag_monitor.start()
+        # Reanudar los trabajos por lotes que quedaron a medias
+        await chat_batch_service.resume_pending()
         logger.info("Servicios inicializados correctamente")
     except Exception as e:
         logger.error(f"Error al inicializar servicios: {str(e)}")
         raise e
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await invalidation_bus.stop()
+    await loop_lag_monitor.stop()
+    await chat_batch_service.stop()
+    # Vaciar el buffer de uso de tokens antes de terminar
+    await usage_recorder.stop()
+    await api_key_service.stop()
+    await openai_clients.close()
+    password_hasher.shutdown()
+    # Al final: las tareas anteriores todavía escriben en Redis al detenerse
+    await redis_manager.close()
+    logger.info("Servicios detenidos correctamente")
+    # Esperar a que el hilo de escritura vacíe la cola de logs
+    await logger.complete()
+
 # Error handlers
 @app.exception_handler(HTTPException)
 async def custom_http_error_handler(request, exc):
@@ -67,7 +98,12 @@ async def status_check():
             "database": "connected",
             "redis": "connected",
             "openai": "configured"
-        }
+        },
+        "llm_limiter": llm_limiter.stats(),
+        "event_loop": loop_lag_monitor.stats(),
+        "model_router": model_router.stats(),
+        "password_hasher": password_hasher.stats(),
+        "redis_pools": redis_manager.stats()
     }
 
 # Routers existentes
@@ -79,6 +115,7 @@ app.include_router(user_files.router, prefix="/api/v1/user-files", tags=["user_f
 # <-- Registro de la ruta para entradas manuales:
 app.include_router(manual_entries.router, prefix="/api/v1/manual-entries", tags=["manual_entries"])
 app.include_router(chat.router, prefix="/api/v1/chat", tags=["chat"])
+app.include_router(chat_batch.router, prefix="/api/v1/chat/batch", tags=["chat"])
 # <-- Registro de la ruta para leads:
 app.include_router(lead.router, prefix="/api/v1/leads", tags=["leads"])
 
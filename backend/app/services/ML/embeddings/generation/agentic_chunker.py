@@ -1,9 +1,13 @@
 import json
 import re
 import asyncio
-from openai import OpenAI
-from loguru import logger
+from app.core.logger import logger, get_sampled_logger
 from typing import List, Dict, Any
+from app.core.openai_clients import openai_clients
+from app.services.llm_limiter import llm_limiter
+
+# Se emiten por cada chunk: muestreados para no inundar los logs al procesar archivos grandes
+_chunk_logger = get_sampled_logger("hot.chunker")
 
 class AgenticChunker:
     """
@@ -12,9 +16,9 @@ class AgenticChunker:
     los embeddings y la recuperación de información.
     """
     
-    def __init__(self, openai_api_key: str):
-        """Inicializa el chunker basado en agente."""
-        self.client = OpenAI(api_key=openai_api_key)
+    def __init__(self):
+        """Inicializa el chunker basado en agente con el cliente OpenAI compartido."""
+        self.client = openai_clients.client
         
     async def process_text(self, text: str, max_chunk_size: int = 1000, overlap: int = 200, document_structure: Dict = None) -> List[Dict[str, Any]]:
         """
@@ -50,7 +54,7 @@ class AgenticChunker:
             }
         
         for i, chunk in enumerate(preliminary_chunks):
-            logger.info(f"Analizando chunk preliminar {i+1}/{len(preliminary_chunks)}")
+            _chunk_logger.info(f"Analizando chunk preliminar {i+1}/{len(preliminary_chunks)}")
             
             # Solo procesar chunks significativos
             if len(chunk.split()) < 50:  # Si es muy corto, mantenerlo como está
@@ -224,7 +228,7 @@ class AgenticChunker:
                     timeout=45.0  # 45 segundos timeout
                 )
                 llm_duration = asyncio.get_event_loop().time() - llm_start_time
-                logger.info(f"LLM respondió en {llm_duration:.2f}s")
+                _chunk_logger.info(f"LLM respondió en {llm_duration:.2f}s")
             except asyncio.TimeoutError:
                 logger.warning("Timeout en la llamada al LLM para optimización de chunks")
                 # Fallback simple: dividir por párrafos o frases
@@ -311,7 +315,10 @@ class AgenticChunker:
     async def _call_llm(self, prompt: str) -> str:
         """Realiza la llamada al LLM con manejo de errores mejorado."""
         try:
-            response = self.client.chat.completions.create(
+            # Llamada bloqueante: se ejecuta en un hilo dentro del limitador compartido
+            response = await llm_limiter.run_sync(
+                "chunking",
+                self.client.chat.completions.with_raw_response.create,
                 model="gpt-3.5-turbo-16k", 
                 messages=[{"role": "system", "content": prompt}],
                 temperature=0.1,
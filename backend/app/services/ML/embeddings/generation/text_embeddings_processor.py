@@ -6,15 +6,17 @@ import unicodedata
 import time
 import os
 from datetime import datetime
+import openai
 from loguru import logger
 from app.core.config import settings
 from app.utils.file_utils import extract_text_from_file
 from app.services.ML.embeddings.generation.agentic_chunker import AgenticChunker
 from app.services.ML.embeddings.generation.document_structure_extractor import DocumentStructureExtractor
 from app.services.ML.embeddings.openai.vector_store import OpenAIVectorStore  # Importamos el wrapper
+from app.services.llm_limiter import llm_limiter
 
 class EnhancedTextEmbeddingsProcessor:
-    def __init__(self, user_email: str, user_id: int, chat_id: int = None, archivo_id: int = None):
+    def __init__(self, user_email: str, user_id: int, chat_id: int = None, archivo_id: int = None, section: str = None):
         """
         Procesador mejorado que utiliza chunking inteligente y almacena embeddings en el vector store de OpenAI.
         """
@@ -22,9 +24,10 @@ class EnhancedTextEmbeddingsProcessor:
         self.user_id = user_id
         self.chat_id = chat_id
         self.archivo_id = archivo_id
+        self.section = section or "products"
         # Se asume que ya tienes un vector store creado; si no, se puede crear aquí
-        self.vector_store = OpenAIVectorStore(vector_store_id="vs_67da2a9a90b4819194ed77849ac443db")
-        self.agentic_chunker = AgenticChunker(openai_api_key=settings.OPENAI_API_KEY)
+        self.vector_store = OpenAIVectorStore(vector_store_id=settings.OPENAI_VECTOR_STORE_ID)
+        self.agentic_chunker = AgenticChunker()
         self.structure_extractor = DocumentStructureExtractor()
 
     def sanitize_filename(self, filename: str) -> str:
@@ -46,7 +49,6 @@ class EnhancedTextEmbeddingsProcessor:
             str: El ID del archivo en el vector store de OpenAI
         """
         try:
-            safe_file_name = self.sanitize_filename(file_name)
             text_content = extract_text_from_file(file_path)
             logger.info(f"Iniciando extracción de estructura para {file_name}...")
             document_structure = await self.structure_extractor.process_document(file_path)
@@ -60,50 +62,139 @@ class EnhancedTextEmbeddingsProcessor:
             )
             del text_content
             logger.info(f"Chunking completado: {len(semantic_chunks)} chunks generados")
-            # Preparar los chunks con metadatos para subir al vector store
-            chunks_with_metadata = []
-            for i, chunk in enumerate(semantic_chunks):
-                chunk_text = chunk.get("content", "")
-                metadata = chunk.get("metadata", {})
-                metadata.update({
-                    "user_id": self.user_id,
-                    "chat_id": self.chat_id,
-                    "archivo_id": self.archivo_id,
-                    "file": file_name,
-                    "sanitized_file": safe_file_name,
-                    "chunk_number": i,
-                    "processed_at": datetime.now().isoformat()
-                })
-                chunks_with_metadata.append({
-                    "chunk_text": chunk_text,
-                    "metadata": metadata
-                })
-            # Guardar en un archivo JSON temporal
-            temp_json_file = f"/tmp/{safe_file_name}_{int(time.time())}.json"
-            with open(temp_json_file, "w", encoding="utf-8") as f:
-                json.dump(chunks_with_metadata, f)
-            
-            # Subir el archivo al vector store
-            result = self.vector_store.upload_file(temp_json_file)
-            
-            # Extraer el ID del resultado
-            logger.info(f"Resultado de upload_file: {result}")
-            
-            # Determinar el ID correcto del archivo en el vector store
-            if hasattr(result, 'id'):
-                file_id = result.id
-            elif isinstance(result, dict) and 'id' in result:
-                file_id = result['id']
-            else:
-                # Si no podemos obtener un ID válido, usar un fallback
-                logger.warning(f"No se pudo obtener ID del vector store, generando uno: {result}")
-                import uuid
-                file_id = f"file-{str(uuid.uuid4())}"
-            
-            logger.info(f"Se han subido {len(chunks_with_metadata)} chunks al vector store con ID: {file_id}")
-            os.remove(temp_json_file)
-            return file_id
+            return await self._upload_chunks(
+                semantic_chunks,
+                file_name,
+                source_type="file",
+                source_id=self.archivo_id
+            )
             
         except Exception as e:
             logger.error(f"Error procesando archivo de texto {file_name}: {e}")
-            raise
\ No newline at end of file
+            raise
+
+    async def process_raw_text(self, text: str, title: str, manual_entry_id: int = None):
+        """
+        Procesa texto ingresado manualmente (sin archivo) y lo sube al vector store
+        con los mismos metadatos que un archivo.
+        
+        Returns:
+            str: El ID del archivo en el vector store de OpenAI
+        """
+        try:
+            logger.info(f"Iniciando chunking inteligente para la carga manual '{title}'...")
+            semantic_chunks = await self.agentic_chunker.process_text(
+                text=text,
+                max_chunk_size=settings.CHUNK_SIZE,
+                overlap=200,
+                document_structure={"title": title, "total_pages": 1, "sections": []}
+            )
+            logger.info(f"Chunking completado: {len(semantic_chunks)} chunks generados")
+            return await self._upload_chunks(
+                semantic_chunks,
+                title,
+                source_type="manual",
+                source_id=manual_entry_id
+            )
+        except Exception as e:
+            logger.error(f"Error procesando la carga manual {title}: {e}")
+            raise
+
+    async def delete_embeddings(self, source_type: str, source_id: int, vector_store_file_id: str = None):
+        """
+        Elimina del vector store el archivo de un origen (`source_type` "file" o "manual"
+        y el id de su registro). Con el id guardado al subirlo se elimina directamente;
+        los registros sin ese id se buscan por sus atributos, lo que recorre el vector store.
+        """
+        try:
+            if vector_store_file_id:
+                file_ids = [vector_store_file_id]
+            else:
+                file_ids = await llm_limiter.run_sync(
+                    "vector_store",
+                    self.vector_store.find_files,
+                    {"user_id": self.user_id, "source_type": source_type, "source_id": source_id}
+                )
+            for file_id in file_ids:
+                try:
+                    await llm_limiter.run_sync("vector_store", self.vector_store.delete_file, file_id)
+                except openai.NotFoundError:
+                    logger.warning(f"El archivo {file_id} ya no estaba en el vector store")
+            logger.info(f"Se eliminaron {len(file_ids)} archivos del vector store para {source_type} {source_id}")
+            return file_ids
+        except Exception as e:
+            logger.error(f"Error eliminando embeddings de {source_type} {source_id}: {e}")
+            raise
+
+    async def _upload_chunks(self, semantic_chunks: list, file_name: str, source_type: str, source_id: int = None):
+        """
+        Guarda los chunks con sus metadatos en un archivo JSON y lo sube al vector store.
+        Los atributos del archivo (usuario, sección, origen) permiten acotar las búsquedas
+        a archivos o secciones concretas.
+        """
+        safe_file_name = self.sanitize_filename(file_name)
+
+        # Preparar los chunks con metadatos para subir al vector store
+        chunks_with_metadata = []
+        for i, chunk in enumerate(semantic_chunks):
+            chunk_text = chunk.get("content", "")
+            metadata = chunk.get("metadata", {})
+            metadata.update({
+                "user_id": self.user_id,
+                "chat_id": self.chat_id,
+                "archivo_id": self.archivo_id,
+                "source_type": source_type,
+                "source_id": source_id,
+                "upload_section": self.section,
+                "file": file_name,
+                "sanitized_file": safe_file_name,
+                "chunk_number": i,
+                "processed_at": datetime.now().isoformat()
+            })
+            chunks_with_metadata.append({
+                "chunk_text": chunk_text,
+                "metadata": metadata
+            })
+        # Guardar en un archivo JSON temporal
+        temp_json_file = f"/tmp/{safe_file_name}_{int(time.time())}.json"
+        with open(temp_json_file, "w", encoding="utf-8") as f:
+            json.dump(chunks_with_metadata, f)
+        
+        # Atributos del archivo en el vector store (solo valores string/número/bool)
+        attributes = {
+            "user_id": self.user_id,
+            "section": self.section,
+            "source_type": source_type,
+            "file": file_name[:512]
+        }
+        if source_id is not None:
+            attributes["source_id"] = source_id
+        
+        try:
+            # Subir el archivo al vector store
+            # Subida bloqueante (espera el procesamiento): en un hilo, dentro del limitador
+            result = await llm_limiter.run_sync(
+                "vector_store",
+                self.vector_store.upload_file,
+                temp_json_file,
+                attributes=attributes
+            )
+        finally:
+            os.remove(temp_json_file)
+        
+        # Extraer el ID del resultado
+        logger.info(f"Resultado de upload_file: {result}")
+        
+        # Determinar el ID correcto del archivo en el vector store
+        if hasattr(result, 'id'):
+            file_id = result.id
+        elif isinstance(result, dict) and 'id' in result:
+            file_id = result['id']
+        else:
+            # Si no podemos obtener un ID válido, usar un fallback
+            logger.warning(f"No se pudo obtener ID del vector store, generando uno: {result}")
+            import uuid
+            file_id = f"file-{str(uuid.uuid4())}"
+        
+        logger.info(f"Se han subido {len(chunks_with_metadata)} chunks al vector store con ID: {file_id}")
+        return file_id
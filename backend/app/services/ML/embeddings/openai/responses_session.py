@@ -1,10 +1,23 @@
 # responses_session.py
-from openai import OpenAI
 import logging
+from app.core.config import settings
+from app.core.openai_clients import openai_clients
+from app.services.llm_limiter import llm_limiter
 
 logger = logging.getLogger(__name__)
 
-client = OpenAI()  # Se asume que OPENAI_API_KEY está configurado en el entorno
+def _build_payload(message, previous_response_id=None, tools=None, **kwargs):
+    payload = {
+        "model": kwargs.pop("model", None) or settings.CHAT_STRONG_MODEL,
+        "input": message,
+    }
+    if previous_response_id:
+        payload["previous_response_id"] = previous_response_id
+    if tools:
+        payload["tools"] = tools
+    # Se añaden el resto de parámetros (como temperature, max_output_tokens, etc.)
+    payload.update(kwargs)
+    return payload
 
 def send_message(message, previous_response_id=None, tools=None, **kwargs):
     """
@@ -16,21 +29,35 @@ def send_message(message, previous_response_id=None, tools=None, **kwargs):
     :param kwargs: Argumentos adicionales (e.g., temperature, max_output_tokens, top_p, store).
     :return: Objeto de respuesta de la API.
     """
-    payload = {
-        "model": kwargs.pop("model", "gpt-4o"),
-        "input": message,
-    }
-    if previous_response_id:
-        payload["previous_response_id"] = previous_response_id
-    if tools:
-        payload["tools"] = tools
-    # Se añaden el resto de parámetros (como temperature, max_output_tokens, etc.)
-    payload.update(kwargs)
+    payload = _build_payload(message, previous_response_id, tools, **kwargs)
     
     try:
-        response = client.responses.create(**payload)
+        # Respuesta cruda para que el limitador lea los encabezados x-ratelimit-*
+        raw = openai_clients.client.responses.with_raw_response.create(**payload)
+        llm_limiter.observe_headers(raw.headers)
+        response = raw.parse()
         logger.info(f"Mensaje enviado correctamente. Response ID: {response.id}")
         return response
     except Exception as e:
         logger.error(f"Error en send_message: {e}")
         raise
+
+async def stream_message(message, previous_response_id=None, tools=None, **kwargs):
+    """
+    Envía un mensaje utilizando la Responses API en modo streaming.
+    
+    Acepta los mismos parámetros que send_message y retorna el stream de eventos
+    de la API (response.output_text.delta, response.completed, etc.).
+    El llamador es responsable de cerrar el stream con `await stream.close()`.
+    """
+    payload = _build_payload(message, previous_response_id, tools, **kwargs)
+    
+    try:
+        raw = await openai_clients.async_client.responses.with_raw_response.create(stream=True, **payload)
+        llm_limiter.observe_headers(raw.headers)
+        stream = raw.parse()
+        logger.info("Stream de respuesta iniciado correctamente")
+        return stream
+    except Exception as e:
+        logger.error(f"Error en stream_message: {e}")
+        raise
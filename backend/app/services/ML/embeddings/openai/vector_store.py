@@ -1,12 +1,13 @@
 # vector_store.py
-from openai import OpenAI
 import logging
+from app.core.openai_clients import openai_clients
 
 logger = logging.getLogger(__name__)
 
 class OpenAIVectorStore:
     def __init__(self, name: str = "Default Vector Store", vector_store_id: str = None):
-        self.client = OpenAI()  # Se asume que OPENAI_API_KEY está configurado en el entorno
+        # Cliente compartido: crear un vector store no abre un pool de conexiones nuevo
+        self.client = openai_clients.client
         if vector_store_id:
             self.id = vector_store_id
             logger.info(f"Usando vector store existente: {self.id}")
@@ -15,16 +16,20 @@ class OpenAIVectorStore:
             self.id = store.id
             logger.info(f"Vector store creado con id: {self.id}")
 
-    def upload_file(self, file_path: str):
+    def upload_file(self, file_path: str, attributes: dict = None):
         """
         Sube un archivo al vector store y espera a que se procese.
+        Los `attributes` (user_id, section, source_type, source_id...) quedan asociados
+        al archivo y permiten filtrar las búsquedas.
         """
         try:
             with open(file_path, "rb") as f:
-                result = self.client.vector_stores.files.upload_and_poll(
-                    vector_store_id=self.id,
-                    file=f
-                )
+                uploaded = self.client.files.create(file=f, purpose="assistants")
+            result = self.client.vector_stores.files.create_and_poll(
+                vector_store_id=self.id,
+                file_id=uploaded.id,
+                attributes=attributes or None
+            )
             logger.info(f"Archivo subido correctamente al vector store {self.id}")
             return result
         except Exception as e:
@@ -47,6 +52,23 @@ class OpenAIVectorStore:
             logger.error(f"Error en búsqueda: {e}")
             raise
 
+    def find_files(self, attributes: dict) -> list:
+        """
+        Retorna los ids de los archivos del vector store cuyos atributos coinciden
+        con todos los pares de `attributes`. Recorre todos los archivos del vector store:
+        usar solo cuando no se conoce el id del archivo.
+        """
+        try:
+            matches = []
+            for vs_file in self.client.vector_stores.files.list(vector_store_id=self.id, limit=100):
+                file_attributes = getattr(vs_file, "attributes", None) or {}
+                if all(file_attributes.get(k) == v for k, v in attributes.items()):
+                    matches.append(vs_file.id)
+            return matches
+        except Exception as e:
+            logger.error(f"Error buscando archivos por atributos: {e}")
+            raise
+
     def delete_file(self, file_identifier: str):
         """
         Elimina un archivo (y sus embeddings) del vector store.
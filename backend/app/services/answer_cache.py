@@ -0,0 +1,267 @@
+# app/services/answer_cache.py
+
+import base64
+import hashlib
+import json
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from redis.asyncio import Redis
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.services import redis_client
+from app.services.llm_limiter import llm_limiter
+from app.core.openai_clients import openai_clients
+from app.services.noa_config_cache import CompiledNoaConfig
+
+
+class CachedLookup:
+    """Resultado de una búsqueda en la caché de respuestas."""
+
+    def __init__(self, answer: Optional[str], embedding: Optional[np.ndarray], kind: Optional[str] = None):
+        self.answer = answer
+        self.embedding = embedding
+        self.kind = kind  # "exact" | "semantic" | None
+
+    @property
+    def hit(self) -> bool:
+        return self.answer is not None
+
+
+class SemanticAnswerCache:
+    """
+    Caché de respuestas por tenant para preguntas repetidas.
+
+    Las entradas se agrupan en un "scope" formado por el tenant, la versión de su
+    configuración NOA y la versión del corpus. Solo se cachean turnos cuyo file_search
+    no está acotado por usuario, es decir, que buscan en todo el vector store compartido
+    (`corpus_id`); por eso la versión es la de ese vector store y cualquier usuario que
+    suba o elimine archivos la incrementa. Cambiar la configuración cambia su versión.
+    Las entradas antiguas quedan inaccesibles y expiran por TTL.
+
+    Por scope se guardan en Redis un hash (consulta normalizada -> respuesta + embedding)
+    y un sorted set con el último uso de cada entrada para la evicción LRU. La búsqueda
+    primero intenta la coincidencia exacta de la consulta normalizada y, si falla,
+    compara el embedding de la consulta contra una copia local del scope.
+    """
+
+    PREFIX = "answer_cache:"
+    CORPUS_VERSION_PREFIX = "corpus_version:"
+
+    def __init__(
+        self,
+        redis: Redis,
+        corpus_id: str = "default",
+        ttl_seconds: int = 86400,
+        max_entries_per_scope: int = 500,
+        similarity_threshold: float = 0.92,
+        embedding_model: str = "text-embedding-3-small",
+        embedding_dimensions: int = 256,
+        local_refresh_seconds: float = 30.0,
+        max_local_scopes: int = 1000,
+        enabled: bool = True
+    ):
+        self.redis = redis
+        self.corpus_id = corpus_id
+        self.ttl_seconds = ttl_seconds
+        self.max_entries_per_scope = max_entries_per_scope
+        self.similarity_threshold = similarity_threshold
+        self.embedding_model = embedding_model
+        self.embedding_dimensions = embedding_dimensions
+        self.local_refresh_seconds = local_refresh_seconds
+        self.max_local_scopes = max_local_scopes
+        self.enabled = enabled
+        # scope -> (cargado_en, claves, matriz de embeddings normalizados, respuestas)
+        self._local: "OrderedDict[str, Tuple[float, List[str], np.ndarray, List[str]]]" = OrderedDict()
+
+    # ------------------------------------------------------------------
+    # Claves y versiones
+    # ------------------------------------------------------------------
+    @staticmethod
+    def normalize_query(text: str) -> str:
+        """Minúsculas, sin tildes, sin signos de puntuación y con espacios colapsados."""
+        text = unicodedata.normalize("NFKD", text.lower())
+        text = "".join(c for c in text if not unicodedata.combining(c))
+        text = re.sub(r"[^\w\s]", " ", text)
+        return re.sub(r"\s+", " ", text).strip()
+
+    async def corpus_version(self) -> int:
+        return int(await self.redis.get(f"{self.CORPUS_VERSION_PREFIX}{self.corpus_id}") or 0)
+
+    async def bump_corpus_version(self, tenant_id: int) -> None:
+        """
+        Invalida las respuestas cacheadas de todos los tenants (se llama cuando
+        `tenant_id` sube o elimina archivos del vector store compartido).
+        """
+        try:
+            version = await self.redis.incr(f"{self.CORPUS_VERSION_PREFIX}{self.corpus_id}")
+            logger.info(f"Versión del corpus {self.corpus_id} actualizada a {version} (tenant {tenant_id})")
+        except Exception as e:
+            logger.error(f"Error invalidando la caché de respuestas (tenant {tenant_id}): {e}")
+        self._local.clear()
+
+    async def _scope(self, tenant_id: int, config: CompiledNoaConfig) -> str:
+        return f"{tenant_id}:{config.version}:{await self.corpus_version()}"
+
+    def _entries_key(self, scope: str) -> str:
+        return f"{self.PREFIX}{scope}:entries"
+
+    def _lru_key(self, scope: str) -> str:
+        return f"{self.PREFIX}{scope}:lru"
+
+    @staticmethod
+    def _query_hash(normalized: str) -> str:
+        return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+    # ------------------------------------------------------------------
+    # Embeddings
+    # ------------------------------------------------------------------
+    async def _embed(self, text: str) -> np.ndarray:
+        # Embeddings reducidos: suficientes para comparar preguntas cortas y
+        # mantienen pequeño el hash del scope en Redis
+        response = await llm_limiter.run(
+            "embeddings",
+            openai_clients.async_client.embeddings.with_raw_response.create,
+            model=self.embedding_model,
+            input=text,
+            dimensions=self.embedding_dimensions
+        )
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _encode_vector(vector: np.ndarray) -> str:
+        return base64.b64encode(vector.astype(np.float32).tobytes()).decode("ascii")
+
+    @staticmethod
+    def _decode_vector(data: str) -> np.ndarray:
+        return np.frombuffer(base64.b64decode(data), dtype=np.float32)
+
+    async def _load_scope(self, scope: str) -> Tuple[List[str], np.ndarray, List[str]]:
+        """Carga (o reutiliza) la copia local de las entradas de un scope."""
+        cached = self._local.get(scope)
+        if cached and time.monotonic() - cached[0] < self.local_refresh_seconds:
+            self._local.move_to_end(scope)
+            return cached[1], cached[2], cached[3]
+
+        raw: Dict[str, str] = await self.redis.hgetall(self._entries_key(scope))
+        now = time.time()
+        keys, vectors, answers = [], [], []
+        for query_hash, value in raw.items():
+            entry = json.loads(value)
+            if now - entry["ts"] > self.ttl_seconds:
+                continue
+            keys.append(query_hash)
+            vectors.append(self._decode_vector(entry["e"]))
+            answers.append(entry["a"])
+
+        matrix = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+        self._local[scope] = (time.monotonic(), keys, matrix, answers)
+        self._local.move_to_end(scope)
+        while len(self._local) > self.max_local_scopes:
+            self._local.popitem(last=False)
+        return keys, matrix, answers
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+    async def lookup(self, tenant_id: int, config: CompiledNoaConfig, query: str) -> CachedLookup:
+        """
+        Busca una respuesta cacheada para la consulta. Si no hay coincidencia, retorna
+        el embedding calculado (si lo hubo) para reutilizarlo al guardar la respuesta.
+        """
+        if not self.enabled:
+            return CachedLookup(None, None)
+
+        try:
+            scope = await self._scope(tenant_id, config)
+            normalized = self.normalize_query(query)
+            query_hash = self._query_hash(normalized)
+
+            # 1. Coincidencia exacta de la consulta normalizada
+            value = await self.redis.hget(self._entries_key(scope), query_hash)
+            if value:
+                entry = json.loads(value)
+                if time.time() - entry["ts"] <= self.ttl_seconds:
+                    await self.redis.zadd(self._lru_key(scope), {query_hash: time.time()})
+                    return CachedLookup(entry["a"], None, "exact")
+
+            # 2. Coincidencia por similitud de embeddings
+            keys, matrix, answers = await self._load_scope(scope)
+            if not keys:
+                return CachedLookup(None, None)
+
+            embedding = await self._embed(normalized)
+            similarities = matrix @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.similarity_threshold:
+                await self.redis.zadd(self._lru_key(scope), {keys[best]: time.time()})
+                return CachedLookup(answers[best], embedding, "semantic")
+            return CachedLookup(None, embedding)
+
+        except Exception as e:
+            logger.error(f"Error consultando la caché de respuestas: {e}")
+            return CachedLookup(None, None)
+
+    async def store(
+        self,
+        tenant_id: int,
+        config: CompiledNoaConfig,
+        query: str,
+        answer: str,
+        embedding: Optional[np.ndarray] = None
+    ) -> None:
+        """Guarda una respuesta y aplica la evicción LRU del scope."""
+        if not self.enabled or not answer:
+            return
+
+        try:
+            scope = await self._scope(tenant_id, config)
+            normalized = self.normalize_query(query)
+            query_hash = self._query_hash(normalized)
+            if embedding is None:
+                embedding = await self._embed(normalized)
+
+            now = time.time()
+            entries_key = self._entries_key(scope)
+            lru_key = self._lru_key(scope)
+            entry = json.dumps({"a": answer, "e": self._encode_vector(embedding), "ts": now})
+
+            pipeline = self.redis.pipeline()
+            pipeline.hset(entries_key, query_hash, entry)
+            pipeline.zadd(lru_key, {query_hash: now})
+            pipeline.expire(entries_key, self.ttl_seconds)
+            pipeline.expire(lru_key, self.ttl_seconds)
+            # Entradas que exceden el máximo, de la menos a la más recientemente usada
+            pipeline.zrange(lru_key, 0, -(self.max_entries_per_scope + 1))
+            evicted = (await pipeline.execute())[-1]
+
+            if evicted:
+                pipeline = self.redis.pipeline()
+                pipeline.hdel(entries_key, *evicted)
+                pipeline.zrem(lru_key, *evicted)
+                await pipeline.execute()
+
+            # Añadir la entrada a la copia local sin recargar el scope completo
+            cached = self._local.get(scope)
+            if cached and query_hash not in cached[1]:
+                loaded_at, keys, matrix, answers = cached
+                matrix = np.vstack([matrix, embedding]) if matrix.size else embedding[None, :]
+                self._local[scope] = (loaded_at, keys + [query_hash], matrix, answers + [answer])
+        except Exception as e:
+            logger.error(f"Error guardando en la caché de respuestas: {e}")
+
+
+answer_cache = SemanticAnswerCache(
+    redis_client,
+    corpus_id=settings.OPENAI_VECTOR_STORE_ID,
+    ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+    max_entries_per_scope=settings.ANSWER_CACHE_MAX_ENTRIES,
+    similarity_threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    embedding_model=settings.EMBEDDING_MODEL,
+    enabled=settings.ANSWER_CACHE_ENABLED
+)
@@ -1,6 +1,9 @@
+import asyncio
+import time
 from app.core.logger import logger, get_audit_logger
 from redis import Redis
-from typing import Dict, Optional
+from redis.asyncio import Redis as AsyncRedis
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
 import json
 
@@ -9,82 +12,326 @@ audit_logger = get_audit_logger()
 from fastapi import Request
 
 class APIKeyService:
-    def __init__(self, redis_client: Redis):
+    """
+    Contadores de uso por API Key (total, diario y por hora) en Redis.
+
+    `increment_usage` no hace I/O: suma el request a un agregado local por
+    (API Key, hora) y encola el evento de auditoría. Una tarea de fondo vacía el
+    agregado cada `flush_interval` segundos en un único pipeline del cliente Redis
+    asíncrono (INCRBY + EXPIRE por clave) y otra escribe los eventos de
+    auditoría por lotes fuera del event loop. Con `flush_interval` = 0 se vacía en
+    cuanto llega un request, sin ventana de agregación.
+
+    Cada bucket es una clave propia (`daily_usage:{key}:{día}`,
+    `hourly_usage:{key}:{día}T{hora}`), de modo que cualquier ventana se lee con un
+    único MGET. Los buckets horarios se conservan `hourly_retention_days` días.
+    """
+
+    DAILY_TTL = timedelta(days=90)
+    GRANULARITIES = ("hour", "day", "week", "month")
+    DAY_FORMAT = "%Y-%m-%d"
+    HOUR_FORMAT = "%Y-%m-%dT%H"
+
+    def __init__(
+        self,
+        redis_client: AsyncRedis,
+        sync_redis: Optional[Redis] = None,
+        flush_interval: float = 0.25,
+        audit_queue_size: int = 10000,
+        hourly_retention_days: int = 7
+    ):
         self.redis = redis_client
+        self.sync_redis = sync_redis
+        self.flush_interval = flush_interval
+        self.audit_queue_size = audit_queue_size
         self.USAGE_PREFIX = "usage:"
         self.DAILY_USAGE_PREFIX = "daily_usage:"
+        self.HOURLY_USAGE_PREFIX = "hourly_usage:"
+        self.hourly_ttl = timedelta(days=hourly_retention_days)
+        # (api_key, hora) -> requests pendientes de escribir
+        self._pending: Dict[Tuple[str, str], int] = {}
+        self._audit: Optional[asyncio.Queue] = None
+        self._audit_dropped = 0
+        self._flush_requested: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
         
-    def increment_usage(self, api_key: str, request: Request) -> int:
+    def increment_usage(self, api_key: str, request: Request) -> None:
         """
-        Incrementa el contador de uso de una API Key y registra el uso diario
+        Registra un uso de la API Key (contador general y diario) y su evento de auditoría
         """
+        # Las conexiones WebSocket no tienen método HTTP
+        method = getattr(request, "method", "WS")
+        path = request.url.path
+        hour = datetime.now().strftime(self.HOUR_FORMAT)
+        
+        key = (api_key, hour)
+        if not self._tasks:
+            # Sin tareas de fondo (scripts, fuera de la aplicación): un único pipeline síncrono
+            if self.sync_redis is not None:
+                try:
+                    self._write_sync({key: 1})
+                except Exception as e:
+                    logger.error(f"Error incrementing API Key usage: {str(e)}")
+            else:
+                self._pending[key] = self._pending.get(key, 0) + 1
+            self._write_audit([(time.time(), api_key, method, path)])
+            return
+        
+        self._pending[key] = self._pending.get(key, 0) + 1
         try:
-            # Incrementar contador general
-            total_key = f"{self.USAGE_PREFIX}{api_key}"
-            total_usage = self.redis.incr(total_key)
-            
-            # Registrar uso diario
-            today = datetime.now().strftime("%Y-%m-%d")
-            daily_key = f"{self.DAILY_USAGE_PREFIX}{api_key}:{today}"
-            daily_usage = self.redis.incr(daily_key)
-            
-            # Establecer expiración de 90 días para las estadísticas diarias
-            self.redis.expire(daily_key, timedelta(days=90))
-            
-            # Registrar información detallada del request
-            endpoint = f"{request.method} {request.url.path}"
+            self._audit.put_nowait((time.time(), api_key, method, path))
+        except asyncio.QueueFull:
+            self._audit_dropped += 1
+            if self._audit_dropped % 1000 == 1:
+                logger.warning(f"Cola de auditoría llena: {self._audit_dropped} eventos descartados")
+        if self.flush_interval <= 0:
+            self._flush_requested.set()
+    
+    # ------------------------------------------------------------------
+    # Escritura en Redis
+    # ------------------------------------------------------------------
+    def _add_to_pipeline(self, pipeline, counts: Dict[Tuple[str, str], int]) -> None:
+        totals: Dict[str, int] = {}
+        daily: Dict[Tuple[str, str], int] = {}
+        for (api_key, hour), count in counts.items():
+            totals[api_key] = totals.get(api_key, 0) + count
+            day_key = (api_key, hour[:10])
+            daily[day_key] = daily.get(day_key, 0) + count
+            hourly_key = f"{self.HOURLY_USAGE_PREFIX}{api_key}:{hour}"
+            pipeline.incrby(hourly_key, count)
+            pipeline.expire(hourly_key, self.hourly_ttl)
+        for (api_key, day), count in daily.items():
+            daily_key = f"{self.DAILY_USAGE_PREFIX}{api_key}:{day}"
+            pipeline.incrby(daily_key, count)
+            # Expiración de 90 días para las estadísticas diarias
+            pipeline.expire(daily_key, self.DAILY_TTL)
+        for api_key, count in totals.items():
+            pipeline.incrby(f"{self.USAGE_PREFIX}{api_key}", count)
+    
+    def _write_sync(self, counts: Dict[Tuple[str, str], int]) -> None:
+        pipeline = self.sync_redis.pipeline(transaction=False)
+        self._add_to_pipeline(pipeline, counts)
+        pipeline.execute()
+    
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        counts, self._pending = self._pending, {}
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            self._add_to_pipeline(pipeline, counts)
+            await pipeline.execute()
+        except Exception as e:
+            logger.error(f"Error incrementing API Key usage: {str(e)}")
+            # Devolver los conteos al agregado para el próximo intento
+            for key, count in counts.items():
+                self._pending[key] = self._pending.get(key, 0) + count
+    
+    # ------------------------------------------------------------------
+    # Auditoría
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _write_audit(events: List[Tuple[float, str, str, str]]) -> None:
+        for ts, api_key, method, path in events:
             audit_logger.info(
                 f"API Key usage increment - Key: {api_key}, "
-                f"Endpoint: {endpoint}, "
-                f"Method: {request.method}, "
-                f"Path: {request.url.path}, "
-                f"Total: {total_usage}"
+                f"Endpoint: {method} {path}, "
+                f"Method: {method}, "
+                f"Path: {path}, "
+                f"At: {datetime.fromtimestamp(ts).isoformat()}"
             )
-            return total_usage
-            
-        except Exception as e:
-            logger.error(f"Error incrementing API Key usage: {str(e)}")
-            return 0
+    
+    async def _drain_audit(self, batch: Optional[List] = None, max_batch: int = 500) -> None:
+        batch = batch or []
+        while not self._audit.empty() and len(batch) < max_batch:
+            batch.append(self._audit.get_nowait())
+        if batch:
+            await asyncio.to_thread(self._write_audit, batch)
+    
+    # ------------------------------------------------------------------
+    # Ciclo de vida
+    # ------------------------------------------------------------------
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._audit = asyncio.Queue(maxsize=self.audit_queue_size)
+        self._flush_requested = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run_flush()), asyncio.create_task(self._run_audit())]
+        logger.info("Medición de uso de API Keys iniciada")
+    
+    async def stop(self) -> None:
+        """Detiene las tareas de fondo y escribe lo pendiente."""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.flush()
+        if self._audit is not None:
+            while not self._audit.empty():
+                await self._drain_audit()
+    
+    async def _run_flush(self) -> None:
+        while True:
+            try:
+                if self.flush_interval > 0:
+                    await asyncio.sleep(self.flush_interval)
+                else:
+                    await self._flush_requested.wait()
+                    self._flush_requested.clear()
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error en la medición de uso de API Keys: {e}")
+    
+    async def _run_audit(self) -> None:
+        while True:
+            # Esperar el primer evento y escribir el lote acumulado de una vez
+            event = await self._audit.get()
+            try:
+                await self._drain_audit([event])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error escribiendo la auditoría de API Keys: {e}")
             
-    def get_usage_stats(self, api_key: str) -> Dict:
+    # ------------------------------------------------------------------
+    # Estadísticas
+    # ------------------------------------------------------------------
+    def _buckets(self, api_key: str, start: datetime, end: datetime, granularity: str) -> List[Tuple[str, str]]:
         """
-        Obtiene estadísticas de uso de una API Key
+        Claves de Redis que cubren [start, end] y la etiqueta del bucket de salida
+        al que suma cada una. Semanas y meses se agregan a partir de los días.
         """
+        if granularity == "hour":
+            step, prefix, fmt = timedelta(hours=1), self.HOURLY_USAGE_PREFIX, self.HOUR_FORMAT
+            current = start.replace(minute=0, second=0, microsecond=0)
+        else:
+            step, prefix, fmt = timedelta(days=1), self.DAILY_USAGE_PREFIX, self.DAY_FORMAT
+            current = start.replace(hour=0, minute=0, second=0, microsecond=0)
+
+        buckets = []
+        while current <= end:
+            if granularity == "week":
+                label = (current - timedelta(days=current.weekday())).strftime(self.DAY_FORMAT)
+            elif granularity == "month":
+                label = current.strftime("%Y-%m")
+            else:
+                label = current.strftime(fmt)
+            buckets.append((f"{prefix}{api_key}:{current.strftime(fmt)}", label))
+            current += step
+        return buckets
+
+    async def _read_series(
+        self,
+        api_key: str,
+        start: datetime,
+        end: datetime,
+        granularities: List[str]
+    ) -> Tuple[int, Dict[str, Dict[str, int]]]:
+        """
+        Lee el total y las series de varias granularidades con un único MGET.
+        Las claves compartidas (los días de semanas y meses) se piden una sola vez.
+        """
+        buckets = {granularity: self._buckets(api_key, start, end, granularity) for granularity in granularities}
+        positions: Dict[str, int] = {f"{self.USAGE_PREFIX}{api_key}": 0}
+        for granularity_buckets in buckets.values():
+            for key, _ in granularity_buckets:
+                positions.setdefault(key, len(positions))
+        values = await self.redis.mget(list(positions))
+
+        series: Dict[str, Dict[str, int]] = {}
+        for granularity, granularity_buckets in buckets.items():
+            counts = series[granularity] = {}
+            for key, label in granularity_buckets:
+                counts[label] = counts.get(label, 0) + int(values[positions[key]] or 0)
+        return int(values[0] or 0), series
+
+    def _window_stats(
+        self,
+        total: int,
+        series: Dict[str, int],
+        start: datetime,
+        end: datetime,
+        granularity: str
+    ) -> Dict:
+        return {
+            "total_usage": total,
+            "window_usage": sum(series.values()),
+            "granularity": granularity,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "series": series
+        }
+
+    async def get_usage_window(
+        self,
+        api_key: str,
+        start: datetime,
+        end: Optional[datetime] = None,
+        granularity: str = "day"
+    ) -> Dict:
+        """
+        Uso de una API Key en [start, end] agrupado por hora, día, semana o mes.
+        Lee el total y todos los buckets de la ventana con un único MGET.
+        """
+        if granularity not in self.GRANULARITIES:
+            raise ValueError(f"Granularidad no soportada: {granularity}")
+        end = end or datetime.now()
+        total, series = await self._read_series(api_key, start, end, [granularity])
+        return self._window_stats(total, series[granularity], start, end, granularity)
+
+    async def get_usage_stats(self, api_key: str, days: int = 30, granularity: str = "day") -> Dict:
+        """
+        Obtiene estadísticas de uso de una API Key para los últimos `days` días.
+        Siempre incluye `daily_stats` (buckets diarios, del más reciente al más antiguo),
+        también cuando la serie se pide con otra granularidad; todo sale del mismo MGET.
+        """
+        if granularity not in self.GRANULARITIES:
+            raise ValueError(f"Granularidad no soportada: {granularity}")
+        today = datetime.now()
+        start = (today - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
         try:
-            # Obtener uso total
-            total_key = f"{self.USAGE_PREFIX}{api_key}"
-            total_usage = int(self.redis.get(total_key) or 0)
-            
-            # Obtener uso diario de los últimos 30 días
-            daily_stats = {}
-            today = datetime.now()
-            
-            for i in range(30):
-                date = (today - timedelta(days=i)).strftime("%Y-%m-%d")
-                daily_key = f"{self.DAILY_USAGE_PREFIX}{api_key}:{date}"
-                usage = int(self.redis.get(daily_key) or 0)
-                daily_stats[date] = usage
-                
-            return {
-                "total_usage": total_usage,
-                "daily_stats": daily_stats
-            }
+            total, series = await self._read_series(api_key, start, today, list(dict.fromkeys([granularity, "day"])))
+            stats = self._window_stats(total, series[granularity], start, today, granularity)
+            # Formato histórico: del día más reciente al más antiguo
+            stats["daily_stats"] = dict(reversed(list(series["day"].items())))
+            return stats
             
         except Exception as e:
             logger.error(f"Error getting API Key usage stats: {str(e)}")
-            return {"total_usage": 0, "daily_stats": {}}
+            return {
+                "total_usage": 0,
+                "window_usage": 0,
+                "granularity": granularity,
+                "start": start.isoformat(),
+                "end": today.isoformat(),
+                "series": {},
+                "daily_stats": {}
+            }
             
-    def reset_usage(self, api_key: str) -> bool:
+    async def reset_usage(self, api_key: str, batch_size: int = 500) -> bool:
         """
-        Reinicia los contadores de uso de una API Key
+        Reinicia los contadores de uso de una API Key (total, diarios y por hora).
+        Recorre las claves con SCAN y las elimina con UNLINK por lotes, sin bloquear Redis.
         """
         try:
-            pattern = f"{self.USAGE_PREFIX}{api_key}*"
-            keys = self.redis.keys(pattern)
-            if keys:
-                self.redis.delete(*keys)
-            audit_logger.warning(f"API Key usage reset - Key: {api_key}")
+            patterns = [
+                f"{self.DAILY_USAGE_PREFIX}{api_key}:*",
+                f"{self.HOURLY_USAGE_PREFIX}{api_key}:*"
+            ]
+            batch = [f"{self.USAGE_PREFIX}{api_key}"]
+            deleted = 0
+            for pattern in patterns:
+                async for key in self.redis.scan_iter(match=pattern, count=batch_size):
+                    batch.append(key)
+                    if len(batch) >= batch_size:
+                        deleted += await self.redis.unlink(*batch)
+                        batch = []
+            if batch:
+                deleted += await self.redis.unlink(*batch)
+            audit_logger.warning(f"API Key usage reset - Key: {api_key}, Keys: {deleted}")
             return True
         except Exception as e:
             logger.error(f"Error resetting API Key usage: {str(e)}")
-            return False
\ No newline at end of file
+            return False
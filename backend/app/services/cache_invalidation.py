@@ -0,0 +1,104 @@
+# app/services/cache_invalidation.py
+
+import asyncio
+from typing import Callable, Dict, List, Optional, Set
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from app.core.logger import logger
+from app.core.services import redis_client, sync_redis_client
+
+
+class CacheInvalidationBus:
+    """
+    Propaga invalidaciones de cachés locales entre workers mediante Redis pub/sub.
+
+    Cada caché se suscribe a un canal con un handler que recibe el mensaje publicado
+    (normalmente el id de la entidad a invalidar). Los mensajes se procesan en una
+    tarea del event loop iniciada en el arranque de la aplicación.
+    """
+
+    def __init__(self, redis: AsyncRedis, sync_redis: Optional[Redis] = None, poll_timeout: float = 1.0):
+        self.redis = redis
+        self.sync_redis = sync_redis
+        self.poll_timeout = poll_timeout
+        self._handlers: Dict[str, List[Callable[[str], None]]] = {}
+        self._pubsub = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Set[asyncio.Task] = set()
+
+    def subscribe(self, channel: str, handler: Callable[[str], None]) -> None:
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def publish(self, channel: str, message: str) -> None:
+        """
+        Publica sin bloquear: desde el event loop se agenda en el cliente asíncrono;
+        desde un hilo (sin loop) se usa el cliente síncrono.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            if self.sync_redis is None:
+                logger.error(f"Invalidación en {channel} descartada: sin event loop ni cliente síncrono")
+                return
+            try:
+                self.sync_redis.publish(channel, message)
+            except Exception as e:
+                logger.error(f"Error publicando invalidación en {channel}: {e}")
+            return
+        task = loop.create_task(self._publish(channel, message))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _publish(self, channel: str, message: str) -> None:
+        try:
+            await self.redis.publish(channel, message)
+        except Exception as e:
+            logger.error(f"Error publicando invalidación en {channel}: {e}")
+
+    def _dispatch(self, message: Dict) -> None:
+        channel = message["channel"]
+        for handler in self._handlers.get(channel, []):
+            try:
+                handler(message["data"])
+            except Exception as e:
+                logger.error(f"Error procesando invalidación de {channel}: {e}")
+
+    async def start(self) -> None:
+        if self._task is not None or not self._handlers:
+            return
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(*self._handlers)
+        self._task = asyncio.create_task(self._listen())
+        logger.info(f"Escuchando invalidaciones de caché en: {', '.join(self._handlers)}")
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                # Con timeout explícito: el socket_timeout del pool no corta la espera
+                message = await self._pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=self.poll_timeout
+                )
+                if message is not None:
+                    self._dispatch(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # El cliente se reconecta y vuelve a suscribirse en la siguiente lectura
+                logger.error(f"Error escuchando invalidaciones de caché: {e}")
+                await asyncio.sleep(self.poll_timeout)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+
+invalidation_bus = CacheInvalidationBus(redis_client, sync_redis_client)
@@ -0,0 +1,541 @@
+# app/services/chat_batch.py
+
+import asyncio
+import io
+import json
+import time
+import uuid
+from typing import Dict, List, Optional
+import openai
+from fastapi import HTTPException
+from redis.asyncio import Redis
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.services import redis_client
+from app.services.model_router import model_router
+from app.services.llm_limiter import llm_limiter, AdaptiveConcurrencyLimiter, LLMUnavailableError
+from app.core.openai_clients import openai_clients
+from app.services.rate_limiter import chat_rate_limiter, TokenBucketRateLimiter
+from app.services.tokenizer import count_tokens, truncate_to_token_limit
+from app.services.usage_recorder import usage_recorder, UsageRecorder
+
+# Campos del lead incluidos en el prompt, con su etiqueta
+LEAD_FIELDS = (
+    ("name", "Nombre"),
+    ("company_name", "Empresa"),
+    ("sector", "Sector"),
+    ("location", "Ubicación"),
+    ("interested_product", "Producto de interés"),
+    ("lead_type", "Tipo de lead"),
+    ("channel", "Canal"),
+    ("status", "Estado"),
+    ("last_contact", "Último contacto"),
+)
+
+# Actualiza campos del trabajo salvo que haya sido cancelado (desde cualquier worker)
+# o ya no exista. KEYS: hash del trabajo; ARGV: campo, valor, campo, valor...
+# Retorna 1 si escribió.
+SET_STATUS_SCRIPT = """
+local status = redis.call('HGET', KEYS[1], 'status')
+if not status or status == 'cancelled' then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV))
+return 1
+"""
+
+DEFAULT_LEAD_INSTRUCTIONS = (
+    "Redacta un mensaje de seguimiento breve y personalizado para este lead, "
+    "orientado a avanzar en la venta."
+)
+
+
+def render_lead_prompt(lead, instructions: Optional[str] = None) -> str:
+    """Construye el prompt de un ítem del lote a partir de los datos del lead."""
+    lines = [
+        f"- {label}: {getattr(lead, field)}"
+        for field, label in LEAD_FIELDS
+        if getattr(lead, field, None) not in (None, "")
+    ]
+    return f"{instructions or DEFAULT_LEAD_INSTRUCTIONS}\n\nDatos del lead:\n" + "\n".join(lines)
+
+
+def _output_text_from_body(body: Dict) -> str:
+    """Extrae el texto de una respuesta de la Responses API en formato JSON."""
+    parts = []
+    for item in body.get("output", []):
+        if item.get("type") != "message":
+            continue
+        for content in item.get("content", []):
+            if content.get("type") == "output_text":
+                parts.append(content.get("text", ""))
+    return "".join(parts)
+
+
+class ChatBatchService:
+    """
+    Trabajos de chat por lotes (p. ej. seguimiento de cientos de leads).
+
+    Cada trabajo guarda en Redis su estado (hash), sus ítems y sus resultados por
+    ítem, de modo que el progreso sobrevive a reinicios: al reanudar solo se procesan
+    los ítems sin resultado. Un lease con TTL garantiza que un solo worker ejecute
+    cada trabajo; al arrancar, los trabajos activos sin lease se reanudan.
+
+    Modos:
+    - "online": los ítems se envían a la Responses API con concurrencia acotada por
+      trabajo y usando como máximo `max_limiter_share` del limitador LLM compartido,
+      para no dejar sin capacidad a los chats interactivos.
+    - "provider": se envía un único archivo a la Batch API del proveedor (más barata,
+      asíncrona, hasta 24 h) y se consulta su estado periódicamente.
+    """
+
+    PREFIX = "chat_batch:"
+    ACTIVE_KEY = "chat_batch:active"
+
+    def __init__(
+        self,
+        redis: Redis,
+        limiter: AdaptiveConcurrencyLimiter,
+        rate_limiter: TokenBucketRateLimiter,
+        recorder: UsageRecorder,
+        concurrency: int = 4,
+        max_limiter_share: float = 0.5,
+        ttl_seconds: int = 7 * 86400,
+        poll_seconds: float = 60.0,
+        lease_seconds: int = 60,
+        max_output_tokens: int = 1024,
+        item_max_retries: int = 3
+    ):
+        self.redis = redis
+        self.limiter = limiter
+        self.rate_limiter = rate_limiter
+        self.recorder = recorder
+        self.concurrency = concurrency
+        self.max_limiter_share = max_limiter_share
+        self.ttl_seconds = ttl_seconds
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.max_output_tokens = max_output_tokens
+        self.item_max_retries = item_max_retries
+        self.worker_id = uuid.uuid4().hex
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._set_status_script = self.redis.register_script(SET_STATUS_SCRIPT)
+
+    # ------------------------------------------------------------------
+    # Claves
+    # ------------------------------------------------------------------
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.PREFIX}{job_id}"
+
+    def _items_key(self, job_id: str) -> str:
+        return f"{self.PREFIX}{job_id}:items"
+
+    def _results_key(self, job_id: str) -> str:
+        return f"{self.PREFIX}{job_id}:results"
+
+    def _lease_key(self, job_id: str) -> str:
+        return f"{self.PREFIX}{job_id}:lease"
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+    async def create_job(
+        self,
+        user,
+        config,
+        items: List[Dict],
+        mode: str = "online"
+    ) -> str:
+        """
+        Registra un trabajo con sus ítems ya resueltos ({custom_id, prompt, lead_id})
+        y la configuración NOA compilada del usuario. Retorna el id del trabajo.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        job = {
+            "id": job_id,
+            "user_id": user.id,
+            "company_id": user.company_id or "",
+            "api_key": user.api_key,
+            "mode": mode,
+            "status": "queued",
+            "total": len(items),
+            "succeeded": 0,
+            "failed": 0,
+            "system_prompt": config.system_prompt,
+            "temperature": config.temperature,
+            "model": model_router.model_for_tenant(config.model),
+            "provider_batch_id": "",
+            "created_at": now,
+            "updated_at": now,
+        }
+        pipeline = self.redis.pipeline()
+        pipeline.hset(self._job_key(job_id), mapping=job)
+        pipeline.hset(self._items_key(job_id), mapping={
+            str(index): json.dumps(item, ensure_ascii=False) for index, item in enumerate(items)
+        })
+        for key in (self._job_key(job_id), self._items_key(job_id)):
+            pipeline.expire(key, self.ttl_seconds)
+        pipeline.sadd(self.ACTIVE_KEY, job_id)
+        await pipeline.execute()
+        logger.info(f"Trabajo de chat por lotes {job_id} creado ({len(items)} ítems, modo {mode})")
+        return job_id
+
+    async def get_job(self, job_id: str, user_id: int) -> Optional[Dict]:
+        job = await self.redis.hgetall(self._job_key(job_id))
+        if not job or int(job["user_id"]) != user_id:
+            return None
+        return {
+            "job_id": job_id,
+            "mode": job["mode"],
+            "status": job["status"],
+            "total": int(job["total"]),
+            "succeeded": int(job["succeeded"]),
+            "failed": int(job["failed"]),
+            "pending": int(job["total"]) - int(job["succeeded"]) - int(job["failed"]),
+            "provider_batch_id": job.get("provider_batch_id") or None,
+            "created_at": float(job["created_at"]),
+            "updated_at": float(job["updated_at"]),
+        }
+
+    async def get_results(self, job_id: str, offset: int = 0, limit: int = 100) -> List[Dict]:
+        total = int(await self.redis.hget(self._job_key(job_id), "total") or 0)
+        indexes = [str(i) for i in range(offset, min(total, offset + limit))]
+        if not indexes:
+            return []
+        pipeline = self.redis.pipeline(transaction=False)
+        pipeline.hmget(self._items_key(job_id), indexes)
+        pipeline.hmget(self._results_key(job_id), indexes)
+        items, results = await pipeline.execute()
+        output = []
+        for index, item, result in zip(indexes, items, results):
+            item = json.loads(item) if item else {}
+            entry = {"index": int(index), "custom_id": item.get("custom_id"), "lead_id": item.get("lead_id")}
+            entry.update(json.loads(result) if result else {"status": "pending"})
+            output.append(entry)
+        return output
+
+    async def start(self, job_id: str, retry_failed: bool = False) -> bool:
+        """Lanza (o reanuda) la ejecución del trabajo si ningún worker la tiene tomada."""
+        if job_id in self._tasks:
+            return True
+        if not await self.redis.set(self._lease_key(job_id), self.worker_id, nx=True, ex=self.lease_seconds):
+            return False
+        await self.redis.sadd(self.ACTIVE_KEY, job_id)
+        task = asyncio.create_task(self._run(job_id, retry_failed))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+        return True
+
+    async def cancel(self, job_id: str) -> None:
+        """
+        Marca el trabajo como cancelado; ningún worker vuelve a cambiar ese estado.
+        La tarea local se detiene de inmediato y la de otro worker en su próxima
+        comprobación. Un lote ya enviado a la Batch API también se cancela allí.
+        """
+        await self.redis.hset(self._job_key(job_id), mapping={"status": "cancelled", "updated_at": time.time()})
+        await self.redis.srem(self.ACTIVE_KEY, job_id)
+        task = self._tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+        batch_id = await self.redis.hget(self._job_key(job_id), "provider_batch_id")
+        if batch_id:
+            await self._cancel_provider_batch(job_id, batch_id)
+
+    async def resume_pending(self) -> None:
+        """Reanuda los trabajos activos cuyo worker ya no renueva el lease (p. ej. tras un reinicio)."""
+        try:
+            for job_id in await self.redis.smembers(self.ACTIVE_KEY):
+                if not await self.redis.exists(self._job_key(job_id)):
+                    await self.redis.srem(self.ACTIVE_KEY, job_id)
+                    continue
+                if await self.start(job_id):
+                    logger.info(f"Trabajo de chat por lotes {job_id} reanudado")
+        except Exception as e:
+            logger.error(f"Error reanudando trabajos de chat por lotes: {e}")
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        # Cada tarea libera su lease al cancelarse; el trabajo sigue activo y otro
+        # worker (o el próximo arranque) lo reanuda desde los ítems sin resultado
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ------------------------------------------------------------------
+    # Ejecución
+    # ------------------------------------------------------------------
+    async def _set_status(self, job_id: str, status: str, **fields) -> bool:
+        """Actualiza el estado del trabajo si no fue cancelado. Retorna si lo actualizó."""
+        args = []
+        for name, value in {"status": status, "updated_at": time.time(), **fields}.items():
+            args.extend((name, value))
+        return bool(await self._set_status_script(keys=[self._job_key(job_id)], args=args))
+
+    async def _is_cancelled(self, job_id: str) -> bool:
+        return await self.redis.hget(self._job_key(job_id), "status") == "cancelled"
+
+    async def _keep_lease(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await self.redis.expire(self._lease_key(job_id), self.lease_seconds)
+
+    async def _run(self, job_id: str, retry_failed: bool) -> None:
+        lease = asyncio.create_task(self._keep_lease(job_id))
+        try:
+            job = await self.redis.hgetall(self._job_key(job_id))
+            if not job or job["status"] == "cancelled":
+                return
+            if job["mode"] == "provider":
+                await self._run_provider(job_id, job)
+            else:
+                await self._run_online(job_id, job, retry_failed)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error ejecutando el trabajo de chat por lotes {job_id}: {e}")
+            await self._set_status(job_id, "failed", error=str(e))
+            await self.redis.srem(self.ACTIVE_KEY, job_id)
+        finally:
+            lease.cancel()
+            await self.redis.delete(self._lease_key(job_id))
+
+    async def _pending_items(self, job_id: str, retry_failed: bool) -> Dict[str, Dict]:
+        pipeline = self.redis.pipeline(transaction=False)
+        pipeline.hgetall(self._items_key(job_id))
+        pipeline.hgetall(self._results_key(job_id))
+        items, results = await pipeline.execute()
+        pending = {}
+        for index, item in items.items():
+            result = json.loads(results[index]) if index in results else None
+            if result is None or (retry_failed and result["status"] == "error"):
+                pending[index] = json.loads(item)
+        return pending
+
+    async def _save_result(self, job_id: str, index: str, result: Dict, previous: Optional[Dict] = None) -> None:
+        pipeline = self.redis.pipeline()
+        pipeline.hset(self._results_key(job_id), index, json.dumps(result, ensure_ascii=False))
+        pipeline.expire(self._results_key(job_id), self.ttl_seconds)
+        if previous is not None and previous["status"] == "error":
+            pipeline.hincrby(self._job_key(job_id), "failed", -1)
+        pipeline.hincrby(self._job_key(job_id), "succeeded" if result["status"] == "ok" else "failed", 1)
+        pipeline.hset(self._job_key(job_id), "updated_at", time.time())
+        await pipeline.execute()
+
+    async def _finish(self, job_id: str) -> None:
+        job = await self.redis.hgetall(self._job_key(job_id))
+        if job.get("status") == "cancelled":
+            return
+        status = "completed" if int(job["failed"]) == 0 else "completed_with_errors"
+        await self._set_status(job_id, status)
+        await self.redis.srem(self.ACTIVE_KEY, job_id)
+        logger.info(
+            f"Trabajo de chat por lotes {job_id} terminado: "
+            f"{job['succeeded']} correctos, {job['failed']} con error"
+        )
+
+    def _request_body(self, job: Dict, prompt: str) -> Dict:
+        return {
+            "model": job["model"],
+            "input": [
+                {"role": "system", "content": job["system_prompt"]},
+                {"role": "user", "content": truncate_to_token_limit(prompt, 2000)},
+            ],
+            "tools": [{
+                "type": "file_search",
+                "vector_store_ids": [settings.OPENAI_VECTOR_STORE_ID],
+                "max_num_results": 3
+            }],
+            "temperature": float(job["temperature"]),
+            "max_output_tokens": self.max_output_tokens,
+            "store": False,
+        }
+
+    async def _run_online(self, job_id: str, job: Dict, retry_failed: bool) -> None:
+        await self._set_status(job_id, "running")
+        previous_results = await self.redis.hgetall(self._results_key(job_id))
+        pending = await self._pending_items(job_id, retry_failed)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def process(index: str, item: Dict):
+            async with semaphore:
+                # Cancelado desde otro worker: dejar los ítems restantes sin procesar
+                if await self._is_cancelled(job_id):
+                    return
+                result = await self._process_item(job, item)
+                previous = json.loads(previous_results[index]) if index in previous_results else None
+                await self._save_result(job_id, index, result, previous)
+
+        await asyncio.gather(*(process(index, item) for index, item in pending.items()))
+        await self._finish(job_id)
+
+    async def _acquire_budget(self, user_id: int, company_id: Optional[int], tokens: int) -> None:
+        """
+        Los lotes respetan el presupuesto de tokens del usuario y su empresa: ante el 429
+        del rate limiter propio se espera lo indicado en Retry-After, sin límite de
+        intentos, en vez de fallar el ítem.
+        """
+        while True:
+            try:
+                await self.rate_limiter.acquire(user_id, company_id, tokens)
+                return
+            except HTTPException as e:
+                await asyncio.sleep(float((e.headers or {}).get("Retry-After", 1)))
+
+    async def _process_item(self, job: Dict, item: Dict) -> Dict:
+        body = self._request_body(job, item["prompt"])
+        user_id = int(job["user_id"])
+        company_id = int(job["company_id"]) if job["company_id"] else None
+        estimated = count_tokens(job["system_prompt"]) + count_tokens(item["prompt"]) + self.max_output_tokens
+
+        # Solo los errores de OpenAI consumen reintentos; la espera por presupuesto no
+        for attempt in range(self.item_max_retries + 1):
+            await self._acquire_budget(user_id, company_id, estimated)
+            try:
+                slot = await self.limiter.acquire("batch", timeout=300, max_share=self.max_limiter_share)
+                try:
+                    raw = await openai_clients.async_client.responses.with_raw_response.create(**body)
+                except BaseException as e:
+                    slot.failure(e)
+                    raise
+                slot.success()
+                self.limiter.observe_headers(raw.headers)
+                response = raw.parse()
+            except (openai.RateLimitError, LLMUnavailableError) as e:
+                # Sin llamada exitosa no hubo consumo: devolver el estimado antes de reintentar
+                await self.rate_limiter.refund(user_id, company_id, estimated)
+                if attempt >= self.item_max_retries:
+                    return {"status": "error", "error": str(e)}
+                await asyncio.sleep(getattr(e, "retry_after", 2 ** attempt))
+                continue
+            except Exception as e:
+                await self.rate_limiter.refund(user_id, company_id, estimated)
+                return {"status": "error", "error": str(e)}
+
+            usage = response.usage
+            await self.rate_limiter.refund(
+                user_id, company_id, estimated - usage.input_tokens - usage.output_tokens
+            )
+            self.recorder.record(
+                user_id=user_id,
+                api_key=job["api_key"],
+                model=job["model"],
+                input_tokens=usage.input_tokens,
+                output_tokens=usage.output_tokens,
+                endpoint="/api/v1/chat/batch"
+            )
+            return {
+                "status": "ok",
+                "response": response.output_text,
+                "usage": {"input_tokens": usage.input_tokens, "output_tokens": usage.output_tokens}
+            }
+        return {"status": "error", "error": "Se agotaron los reintentos"}
+
+    async def _run_provider(self, job_id: str, job: Dict) -> None:
+        batch_id = job.get("provider_batch_id")
+        if not batch_id:
+            pending = await self._pending_items(job_id, retry_failed=False)
+            lines = [
+                json.dumps({
+                    "custom_id": f"item-{index}",
+                    "method": "POST",
+                    "url": "/v1/responses",
+                    "body": self._request_body(job, item["prompt"])
+                }, ensure_ascii=False)
+                for index, item in pending.items()
+            ]
+            payload = io.BytesIO("\n".join(lines).encode("utf-8"))
+            payload.name = f"chat_batch_{job_id}.jsonl"
+            uploaded = await self.limiter.run_sync(
+                "batch", openai_clients.client.files.create, file=payload, purpose="batch"
+            )
+            batch = await self.limiter.run_sync(
+                "batch",
+                openai_clients.client.batches.create,
+                input_file_id=uploaded.id,
+                endpoint="/v1/responses",
+                completion_window="24h",
+                metadata={"chat_batch_job": job_id}
+            )
+            batch_id = batch.id
+            # El id se guarda aunque el trabajo se haya cancelado mientras se enviaba,
+            # para poder cancelar también el lote del proveedor
+            await self.redis.hset(self._job_key(job_id), "provider_batch_id", batch_id)
+            if not await self._set_status(job_id, "submitted"):
+                await self._cancel_provider_batch(job_id, batch_id)
+                return
+            logger.info(f"Trabajo de chat por lotes {job_id} enviado a la Batch API ({batch_id})")
+
+        # Consultar el estado hasta que el proveedor termine o se cancele el trabajo
+        while True:
+            if await self._is_cancelled(job_id):
+                await self._cancel_provider_batch(job_id, batch_id)
+                return
+            batch = await self.limiter.run_sync("batch", openai_clients.client.batches.retrieve, batch_id)
+            if batch.status in ("completed", "failed", "expired", "cancelled"):
+                break
+            await asyncio.sleep(self.poll_seconds)
+
+        # Al reanudar (lease perdido, reinicio o /resume) los ítems ya guardados no se
+        # vuelven a contar ni a registrar como uso
+        saved = set(await self.redis.hkeys(self._results_key(job_id)))
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = await self.limiter.run_sync("batch", openai_clients.client.files.content, file_id)
+            for line in content.text.splitlines():
+                if not line.strip():
+                    continue
+                line = json.loads(line)
+                index = line["custom_id"].split("-", 1)[1]
+                if index not in saved:
+                    saved.add(index)
+                    await self._save_provider_result(job_id, job, index, line)
+
+        # Ítems sin resultado (lote fallido o expirado)
+        for index in await self._pending_items(job_id, retry_failed=False):
+            await self._save_result(job_id, index, {"status": "error", "error": f"Batch API: {batch.status}"})
+        await self._finish(job_id)
+
+    async def _cancel_provider_batch(self, job_id: str, batch_id: str) -> None:
+        try:
+            await self.limiter.run_sync("batch", openai_clients.client.batches.cancel, batch_id)
+            logger.info(f"Lote {batch_id} del trabajo de chat por lotes {job_id} cancelado en la Batch API")
+        except Exception as e:
+            # Lote ya terminado o cancelado por otro worker
+            logger.warning(f"No se pudo cancelar el lote {batch_id} del trabajo {job_id}: {e}")
+
+    async def _save_provider_result(self, job_id: str, job: Dict, index: str, line: Dict) -> None:
+        response = line.get("response") or {}
+        body = response.get("body") or {}
+        if line.get("error") or response.get("status_code") != 200:
+            error = line.get("error") or body.get("error") or {"status_code": response.get("status_code")}
+            await self._save_result(job_id, index, {"status": "error", "error": json.dumps(error, ensure_ascii=False)})
+            return
+        usage = body.get("usage") or {}
+        input_tokens, output_tokens = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+        self.recorder.record(
+            user_id=int(job["user_id"]),
+            api_key=job["api_key"],
+            model=job["model"],
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            endpoint="/api/v1/chat/batch"
+        )
+        await self._save_result(job_id, index, {
+            "status": "ok",
+            "response": _output_text_from_body(body),
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens}
+        })
+
+
+chat_batch_service = ChatBatchService(
+    redis_client,
+    llm_limiter,
+    chat_rate_limiter,
+    usage_recorder,
+    concurrency=settings.BATCH_CONCURRENCY,
+    max_limiter_share=settings.BATCH_MAX_LIMITER_SHARE,
+    ttl_seconds=settings.BATCH_TTL_SECONDS,
+    poll_seconds=settings.BATCH_POLL_SECONDS
+)
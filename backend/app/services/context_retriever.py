@@ -0,0 +1,218 @@
+# app/services/context_retriever.py
+
+import hashlib
+import json
+import re
+import time
+import unicodedata
+from typing import Dict, List, Optional, Set, Tuple
+from app.core.config import settings
+from app.core.logger import logger
+from app.services.llm_limiter import llm_limiter, AdaptiveConcurrencyLimiter
+from app.services.ML.embeddings.openai.vector_store import OpenAIVectorStore
+from app.services.tokenizer import count_tokens, truncate_to_token_limit
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_CHUNK_START = '{"chunk_text"'
+
+
+def _terms(text: str) -> Set[str]:
+    """Términos normalizados (minúsculas, sin tildes) de más de 2 caracteres."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return {word for word in _WORD_RE.findall(text) if len(word) > 2}
+
+
+class RetrievedChunk:
+    """Fragmento recuperado del vector store con los metadatos del chunker."""
+
+    def __init__(self, text: str, score: float, file: str, metadata: Optional[Dict] = None):
+        metadata = metadata or {}
+        self.text = text.strip()
+        self.score = score
+        self.file = metadata.get("file") or file
+        self.title = metadata.get("chunk_title") or ""
+        self.key_terms: List[str] = metadata.get("key_terms") or []
+        self.section = metadata.get("section") or metadata.get("upload_section") or ""
+        self.terms = _terms(self.text)
+        self.rank = score
+
+    @property
+    def fingerprint(self) -> str:
+        return hashlib.sha1(" ".join(self.text.lower().split()).encode("utf-8")).hexdigest()
+
+    def header(self) -> str:
+        parts = [part for part in (self.title, self.file) if part]
+        if self.section:
+            parts.append(f"sección {self.section}")
+        return " · ".join(parts)
+
+
+class ContextRetriever:
+    """
+    Recuperación gestionada por la aplicación, alternativa a la herramienta hospedada
+    `file_search`.
+
+    Consulta el vector store con los mismos filtros de atributos que usa el chat,
+    separa los chunks que el procesador guardó como JSON (texto + metadatos del
+    AgenticChunker), los ordena por puntaje del vector store más una bonificación
+    por coincidencias con `key_terms` y el título del chunk, elimina duplicados y
+    empaqueta los mejores en un presupuesto fijo de tokens. Así el costo de entrada
+    y la latencia de cada turno quedan acotados y son predecibles.
+    """
+
+    def __init__(
+        self,
+        limiter: AdaptiveConcurrencyLimiter,
+        vector_store_id: str,
+        max_candidates: int = 12,
+        token_budget: int = 1200,
+        min_score: float = 0.3,
+        key_term_bonus: float = 0.05,
+        title_bonus: float = 0.03,
+        max_bonus: float = 0.15,
+        near_duplicate_threshold: float = 0.85,
+        min_tail_tokens: int = 80
+    ):
+        self.limiter = limiter
+        self.vector_store_id = vector_store_id
+        self.max_candidates = max_candidates
+        self.token_budget = token_budget
+        self.min_score = min_score
+        self.key_term_bonus = key_term_bonus
+        self.title_bonus = title_bonus
+        self.max_bonus = max_bonus
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.min_tail_tokens = min_tail_tokens
+        self._vector_store: Optional[OpenAIVectorStore] = None
+
+    @property
+    def vector_store(self) -> OpenAIVectorStore:
+        if self._vector_store is None:
+            self._vector_store = OpenAIVectorStore(vector_store_id=self.vector_store_id)
+        return self._vector_store
+
+    # ------------------------------------------------------------------
+    # Parseo de resultados
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _split_chunks(text: str) -> List[Tuple[str, Dict]]:
+        """
+        Los archivos subidos son listas JSON de {"chunk_text", "metadata"}; el vector
+        store los fragmenta sin respetar esa estructura. Se extraen los objetos
+        completos del fragmento y, si no hay ninguno, se usa el texto tal cual.
+        """
+        decoder = json.JSONDecoder()
+        chunks = []
+        position = text.find(_CHUNK_START)
+        while position != -1:
+            try:
+                obj, end = decoder.raw_decode(text, position)
+                if isinstance(obj, dict) and obj.get("chunk_text"):
+                    chunks.append((obj["chunk_text"], obj.get("metadata") or {}))
+                position = text.find(_CHUNK_START, end)
+            except ValueError:
+                # Objeto cortado por el borde del fragmento
+                position = text.find(_CHUNK_START, position + 1)
+        if not chunks and _CHUNK_START not in text:
+            chunks.append((text, {}))
+        return chunks
+
+    def _candidates(self, results) -> List[RetrievedChunk]:
+        candidates = []
+        for result in getattr(results, "data", results) or []:
+            score = float(getattr(result, "score", 0.0) or 0.0)
+            if score < self.min_score:
+                continue
+            filename = getattr(result, "filename", "") or ""
+            attributes = getattr(result, "attributes", None) or {}
+            for content in getattr(result, "content", []) or []:
+                text = getattr(content, "text", "") or ""
+                for chunk_text, metadata in self._split_chunks(text):
+                    metadata = {"file": attributes.get("file"), **metadata}
+                    candidates.append(RetrievedChunk(chunk_text, score, filename, metadata))
+        return candidates
+
+    # ------------------------------------------------------------------
+    # Ranking, deduplicación y empaquetado
+    # ------------------------------------------------------------------
+    def _rank(self, query: str, candidates: List[RetrievedChunk]) -> List[RetrievedChunk]:
+        query_terms = _terms(query)
+        for chunk in candidates:
+            key_terms: Set[str] = set()
+            for term in chunk.key_terms:
+                key_terms |= _terms(str(term))
+            bonus = self.key_term_bonus * len(query_terms & key_terms)
+            bonus += self.title_bonus * len(query_terms & _terms(chunk.title))
+            chunk.rank = chunk.score + min(bonus, self.max_bonus)
+        return sorted(candidates, key=lambda chunk: chunk.rank, reverse=True)
+
+    def _is_near_duplicate(self, chunk: RetrievedChunk, selected: List[RetrievedChunk]) -> bool:
+        for other in selected:
+            union = chunk.terms | other.terms
+            if union and len(chunk.terms & other.terms) / len(union) >= self.near_duplicate_threshold:
+                return True
+        return False
+
+    def pack(self, query: str, candidates: List[RetrievedChunk]) -> Tuple[List[RetrievedChunk], int]:
+        """Selecciona los mejores chunks sin duplicados dentro del presupuesto de tokens."""
+        selected: List[RetrievedChunk] = []
+        seen: Set[str] = set()
+        used = 0
+        for chunk in self._rank(query, candidates):
+            if chunk.fingerprint in seen or self._is_near_duplicate(chunk, selected):
+                continue
+            tokens = count_tokens(chunk.text)
+            remaining = self.token_budget - used
+            if tokens > remaining:
+                # Incluir el inicio del chunk si queda espacio útil; luego detenerse
+                if remaining >= self.min_tail_tokens:
+                    chunk.text = truncate_to_token_limit(chunk.text, remaining)
+                    selected.append(chunk)
+                    used += count_tokens(chunk.text)
+                break
+            seen.add(chunk.fingerprint)
+            selected.append(chunk)
+            used += tokens
+        return selected, used
+
+    @staticmethod
+    def format_context(chunks: List[RetrievedChunk]) -> str:
+        blocks = [
+            f"[{index}] {chunk.header()}\n{chunk.text}" if chunk.header() else f"[{index}]\n{chunk.text}"
+            for index, chunk in enumerate(chunks, start=1)
+        ]
+        return "Información recuperada de los documentos de la empresa:\n\n" + "\n\n".join(blocks)
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+    async def retrieve(self, query: str, filters: Optional[Dict] = None) -> Tuple[Optional[str], int]:
+        """
+        Retorna el mensaje de contexto empaquetado (o None si no hubo resultados
+        relevantes) y sus tokens.
+        """
+        started = time.monotonic()
+        kwargs = {"max_num_results": self.max_candidates, "rewrite_query": False}
+        if filters:
+            kwargs["filters"] = filters
+        results = await self.limiter.run_sync("retrieval", self.vector_store.search, query, **kwargs)
+
+        chunks, tokens = self.pack(query, self._candidates(results))
+        logger.debug(
+            f"Recuperación gestionada: {len(chunks)} chunks, {tokens} tokens "
+            f"en {(time.monotonic() - started) * 1000:.0f} ms"
+        )
+        if not chunks:
+            return None, 0
+        context = self.format_context(chunks)
+        return context, count_tokens(context)
+
+
+context_retriever = ContextRetriever(
+    llm_limiter,
+    settings.OPENAI_VECTOR_STORE_ID,
+    max_candidates=settings.CHAT_RETRIEVAL_CANDIDATES,
+    token_budget=settings.CHAT_RETRIEVAL_TOKEN_BUDGET,
+    min_score=settings.CHAT_RETRIEVAL_MIN_SCORE
+)
@@ -0,0 +1,172 @@
+# app/services/conversation_store.py
+
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+from redis.asyncio import Redis
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.services import redis_client
+
+# Reinicia la conversación si alcanzó el máximo de mensajes (0 = sin máximo), incrementa
+# el contador y renueva el TTL en una sola operación atómica.
+# Retorna {reiniciada, hash completo, turnos recientes}.
+START_TURN_SCRIPT = """
+local key = KEYS[1]
+local turns_key = KEYS[2]
+local max_messages = tonumber(ARGV[1])
+local ttl = tonumber(ARGV[2])
+local now = ARGV[3]
+
+local reset = 0
+local count = tonumber(redis.call('HGET', key, 'message_count') or '0')
+if max_messages > 0 and count >= max_messages then
+    reset = 1
+    redis.call('HDEL', key, 'response_id')
+    redis.call('HSET', key, 'message_count', 0, 'last_reset', now)
+end
+if redis.call('HEXISTS', key, 'last_reset') == 0 then
+    redis.call('HSET', key, 'last_reset', now)
+end
+redis.call('HINCRBY', key, 'message_count', 1)
+redis.call('EXPIRE', key, ttl)
+redis.call('EXPIRE', turns_key, ttl)
+return {reset, redis.call('HGETALL', key), redis.call('LRANGE', turns_key, 0, -1)}
+"""
+
+
+class ConversationTracker:
+    """Estado de la conversación de un usuario."""
+
+    def __init__(
+        self,
+        response_id: Optional[str] = None,
+        message_count: int = 0,
+        last_reset: Optional[float] = None,
+        summary: str = "",
+        turns: Optional[List[Dict[str, str]]] = None
+    ):
+        self.response_id: Optional[str] = response_id
+        self.message_count: int = message_count
+        self.last_reset: float = last_reset if last_reset is not None else time.time()
+        # Modo de compactación: resumen de los turnos antiguos + últimos turnos completos
+        self.summary: str = summary
+        self.turns: List[Dict[str, str]] = turns or []
+
+    @property
+    def has_context(self) -> bool:
+        return bool(self.response_id or self.summary or self.turns)
+
+    @classmethod
+    def from_hash(cls, data: Dict[str, str], turns: Optional[List[str]] = None) -> "ConversationTracker":
+        return cls(
+            response_id=data.get("response_id") or None,
+            message_count=int(data.get("message_count", 0)),
+            last_reset=float(data["last_reset"]) if data.get("last_reset") else None,
+            summary=data.get("summary", ""),
+            turns=[json.loads(turn) for turn in turns or []]
+        )
+
+
+class ConversationStore:
+    """
+    Estado de conversación compartido entre workers.
+
+    Cada conversación vive en un hash de Redis (`chat_conversation:{user_id}`) con TTL
+    deslizante: cada escritura renueva la expiración, así que las conversaciones
+    inactivas desaparecen solas. Los turnos recientes del modo de compactación se
+    guardan en una lista aparte (`chat_conversation:{user_id}:turns`). No hay copia en
+    proceso: cada turno lee y actualiza el estado en Redis con una sola operación
+    atómica (`start_turn`), así todos los workers ven el mismo estado.
+    """
+
+    KEY_PREFIX = "chat_conversation:"
+
+    def __init__(
+        self,
+        redis: Redis,
+        ttl_seconds: int = 3600,
+        max_messages: int = 10
+    ):
+        self.redis = redis
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self._start_turn = self.redis.register_script(START_TURN_SCRIPT)
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.KEY_PREFIX}{user_id}"
+
+    def _turns_key(self, user_id: int) -> str:
+        return f"{self.KEY_PREFIX}{user_id}:turns"
+
+    async def get(self, user_id: int) -> ConversationTracker:
+        """Obtiene el estado de la conversación (hash y turnos recientes en una sola ida a Redis)."""
+        pipeline = self.redis.pipeline()
+        pipeline.hgetall(self._key(user_id))
+        pipeline.lrange(self._turns_key(user_id), 0, -1)
+        data, turns = await pipeline.execute()
+        return ConversationTracker.from_hash(data, turns) if data or turns else ConversationTracker()
+
+    async def start_turn(self, user_id: int, reset_after_max: bool = True) -> Tuple[ConversationTracker, bool]:
+        """
+        Registra un nuevo mensaje en la conversación de forma atómica.
+        Retorna el estado actualizado y si la conversación fue reiniciada
+        por alcanzar el máximo de mensajes (solo si `reset_after_max`).
+        """
+        was_reset, raw, turns = await self._start_turn(
+            keys=[self._key(user_id), self._turns_key(user_id)],
+            args=[self.max_messages if reset_after_max else 0, self.ttl_seconds, time.time()]
+        )
+        conversation = ConversationTracker.from_hash(dict(zip(raw[::2], raw[1::2])), turns)
+        return conversation, bool(was_reset)
+
+    async def update(self, user_id: int, **fields) -> None:
+        """Actualiza campos del estado y renueva el TTL."""
+        key = self._key(user_id)
+        pipeline = self.redis.pipeline()
+        to_set = {k: v for k, v in fields.items() if v is not None}
+        to_delete = [k for k, v in fields.items() if v is None]
+        if to_set:
+            pipeline.hset(key, mapping=to_set)
+        if to_delete:
+            pipeline.hdel(key, *to_delete)
+        pipeline.expire(key, self.ttl_seconds)
+        await pipeline.execute()
+
+    async def append_turn(self, user_id: int, user_message: str, assistant_message: str) -> int:
+        """Añade un turno completo a la lista de turnos recientes. Retorna su largo."""
+        turn = {"user": user_message, "assistant": assistant_message}
+        turns_key = self._turns_key(user_id)
+        pipeline = self.redis.pipeline()
+        pipeline.rpush(turns_key, json.dumps(turn, ensure_ascii=False))
+        pipeline.expire(turns_key, self.ttl_seconds)
+        pipeline.expire(self._key(user_id), self.ttl_seconds)
+        return (await pipeline.execute())[0]
+
+    async def compact(self, user_id: int, summary: str, folded_turns: int) -> None:
+        """
+        Reemplaza el resumen y descarta los `folded_turns` turnos más antiguos,
+        que ya quedaron incorporados en él.
+        """
+        key = self._key(user_id)
+        turns_key = self._turns_key(user_id)
+        pipeline = self.redis.pipeline()
+        pipeline.hset(key, "summary", summary)
+        pipeline.ltrim(turns_key, folded_turns, -1)
+        pipeline.expire(key, self.ttl_seconds)
+        pipeline.expire(turns_key, self.ttl_seconds)
+        await pipeline.execute()
+
+    async def reset_history(self, user_id: int) -> None:
+        """Descarta el historial (response_id) y reinicia el contador."""
+        await self.update(user_id, response_id=None, message_count=0)
+
+    async def reset(self, user_id: int) -> None:
+        """Elimina completamente el estado de la conversación."""
+        await self.redis.delete(self._key(user_id), self._turns_key(user_id))
+
+
+conversation_store = ConversationStore(
+    redis_client,
+    ttl_seconds=settings.CHAT_CONVERSATION_TTL_SECONDS
+)
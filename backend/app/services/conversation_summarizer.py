@@ -0,0 +1,146 @@
+# app/services/conversation_summarizer.py
+
+from typing import Dict, List, Tuple
+from app.core.config import settings
+from app.core.logger import logger
+from app.database.models.user import User
+from app.services.conversation_store import conversation_store, ConversationStore, ConversationTracker
+from app.services.llm_limiter import llm_limiter
+from app.core.openai_clients import openai_clients
+from app.services.tokenizer import count_tokens, truncate_to_token_limit
+from app.services.usage_recorder import usage_recorder, UsageRecorder
+
+SUMMARY_INSTRUCTIONS = (
+    "Eres un asistente que mantiene el resumen de una conversación entre un cliente y un "
+    "asistente de ventas. Actualiza el resumen existente incorporando los nuevos turnos. "
+    "Conserva datos concretos (nombres, productos, precios, cantidades, fechas, compromisos "
+    "y preguntas pendientes) y omite saludos y relleno. Responde solo con el resumen, en español."
+)
+
+
+class ConversationSummarizer:
+    """
+    Compactación de contexto para conversaciones largas.
+
+    En lugar de encadenar `previous_response_id` (cuyo historial crece en cada turno)
+    o reiniciar la conversación, cada solicitud envía un resumen de los turnos
+    antiguos más los últimos `keep_last_turns` turnos completos, todo dentro de un
+    presupuesto fijo de tokens. Cuando se acumulan más turnos de los que se conservan,
+    los sobrantes se incorporan al resumen con un modelo económico, en segundo plano
+    y después de haber respondido al usuario.
+    """
+
+    LOCK_PREFIX = "chat_summary_lock:"
+
+    def __init__(
+        self,
+        store: ConversationStore,
+        recorder: UsageRecorder,
+        model: str = "gpt-4o-mini",
+        keep_last_turns: int = 4,
+        context_token_budget: int = 1500,
+        summary_max_tokens: int = 400,
+        turn_max_tokens: int = 300
+    ):
+        self.store = store
+        self.recorder = recorder
+        self.model = model
+        self.keep_last_turns = keep_last_turns
+        self.context_token_budget = context_token_budget
+        self.summary_max_tokens = summary_max_tokens
+        self.turn_max_tokens = turn_max_tokens
+
+    def build_context(self, conversation: ConversationTracker) -> Tuple[List[Dict[str, str]], int]:
+        """
+        Construye los mensajes de contexto (resumen + turnos recientes) sin superar
+        el presupuesto de tokens. Retorna los mensajes y sus tokens.
+        """
+        messages: List[Dict[str, str]] = []
+        used = 0
+
+        if conversation.summary:
+            summary = truncate_to_token_limit(conversation.summary, self.summary_max_tokens)
+            messages.append({
+                "role": "system",
+                "content": f"Resumen de la conversación hasta ahora:\n{summary}"
+            })
+            used += count_tokens(summary)
+
+        # Los turnos más recientes tienen prioridad: se recorren del último al primero
+        recent: List[Dict[str, str]] = []
+        for turn in reversed(conversation.turns[-self.keep_last_turns:]):
+            user_text = truncate_to_token_limit(turn["user"], self.turn_max_tokens)
+            assistant_text = truncate_to_token_limit(turn["assistant"], self.turn_max_tokens)
+            turn_tokens = count_tokens(user_text) + count_tokens(assistant_text)
+            if used + turn_tokens > self.context_token_budget:
+                break
+            recent[:0] = [
+                {"role": "user", "content": user_text},
+                {"role": "assistant", "content": assistant_text}
+            ]
+            used += turn_tokens
+
+        return messages + recent, used
+
+    async def record_turn(self, user: User, user_message: str, answer: str) -> None:
+        """Guarda el turno y compacta la conversación si superó los turnos conservados."""
+        try:
+            length = await self.store.append_turn(user.id, user_message, answer)
+            if length > self.keep_last_turns:
+                await self._compact(user)
+        except Exception as e:
+            logger.error(f"Error actualizando el resumen de la conversación del usuario {user.id}: {e}")
+
+    async def _compact(self, user: User) -> None:
+        lock_key = f"{self.LOCK_PREFIX}{user.id}"
+        # Un solo worker compacta cada conversación a la vez
+        if not await self.store.redis.set(lock_key, "1", nx=True, ex=60):
+            return
+        try:
+            conversation = await self.store.get(user.id)
+            current_summary = conversation.summary
+            folded = conversation.turns[:-self.keep_last_turns]
+            if not folded:
+                return
+
+            transcript = "\n".join(
+                f"Cliente: {turn['user']}\nAsistente: {turn['assistant']}" for turn in folded
+            )
+            response = await llm_limiter.run(
+                "summary",
+                openai_clients.async_client.responses.with_raw_response.create,
+                model=self.model,
+                instructions=SUMMARY_INSTRUCTIONS,
+                input=(
+                    f"Resumen actual:\n{current_summary or '(vacío)'}\n\n"
+                    f"Nuevos turnos:\n{transcript}"
+                ),
+                max_output_tokens=self.summary_max_tokens,
+                temperature=0.2,
+                store=False
+            )
+            summary = truncate_to_token_limit(response.output_text.strip(), self.summary_max_tokens)
+            await self.store.compact(user.id, summary, len(folded))
+
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                self.recorder.record(
+                    user_id=user.id,
+                    api_key=user.api_key,
+                    model=self.model,
+                    input_tokens=usage.input_tokens,
+                    output_tokens=usage.output_tokens,
+                    endpoint="/api/v1/chat/summary"
+                )
+            logger.info(f"Conversación del usuario {user.id} compactada ({len(folded)} turnos resumidos)")
+        finally:
+            await self.store.redis.delete(lock_key)
+
+
+conversation_summarizer = ConversationSummarizer(
+    conversation_store,
+    usage_recorder,
+    model=settings.CHAT_SUMMARY_MODEL,
+    keep_last_turns=settings.CHAT_CONTEXT_KEEP_TURNS,
+    context_token_budget=settings.CHAT_CONTEXT_TOKEN_BUDGET
+)
@@ -29,6 +29,28 @@ class GPTTokenTracker:
                     "output": 1.33     # 2/1.5 = factor de conversión relativo al input
                 }
             },
+            "gpt-4o": {
+                "display_name": "N.O.A",
+                "costs": {
+                    "input": 0.0025,   # $0.0025 por 1K tokens
+                    "output": 0.01,    # $0.01 por 1K tokens
+                },
+                "zaap_multiplier": {
+                    "input": 1.67,     # 0.0025/0.0015
+                    "output": 6.67     # 0.01/0.0015
+                }
+            },
+            "gpt-4o-mini": {
+                "display_name": "N.O.A MINI",
+                "costs": {
+                    "input": 0.00015,  # $0.00015 por 1K tokens
+                    "output": 0.0006,  # $0.0006 por 1K tokens
+                },
+                "zaap_multiplier": {
+                    "input": 0.1,      # 0.00015/0.0015
+                    "output": 0.4      # 0.0006/0.0015
+                }
+            },
             "gpt-4": {
                 "display_name": "M.A.T.E.O",
                 "costs": {
@@ -77,77 +99,66 @@ class GPTTokenTracker:
         endpoint: str
     ) -> Dict:
         """
-        Trackea el uso de tokens de GPT y guarda en Redis y Base de datos.
+        Trackea el uso de tokens de GPT.
+        El registro se encola en el UsageRecorder, que lo persiste en Redis y en la
+        base de datos por lotes; `db` se mantiene por compatibilidad.
         """
+        from app.services.usage_recorder import usage_recorder
+
         try:
-            api_key = user.api_key
-            today = datetime.now().strftime("%Y-%m-%d")
-            
-            # Calcular costos y Zaaps
-            cost = self.calculate_cost(model, input_tokens, output_tokens)
-            zaaps = self.calculate_zaaps(model, input_tokens, output_tokens)
-            total_tokens = input_tokens + output_tokens
-            
-            # Guardar en la base de datos
-            db_usage = TokenUsage(
+            return usage_recorder.record(
                 user_id=user.id,
+                api_key=user.api_key,
                 model=model,
                 input_tokens=input_tokens,
                 output_tokens=output_tokens,
-                total_tokens=total_tokens,
-                endpoint=endpoint,
-                cost=cost,
-                input_zaaps=zaaps["input_zaaps"],
-                output_zaaps=zaaps["output_zaaps"],
-                total_zaaps=zaaps["total_zaaps"]
-            )
-            db.add(db_usage)
-            db.commit()
-            db.refresh(db_usage)
-            
-            # Keys para Redis
-            total_key = f"{self.GPT_USAGE_PREFIX}{api_key}"
-            daily_key = f"{self.DAILY_GPT_PREFIX}{api_key}:{today}"
-            model_key = f"{self.MODEL_PREFIX}{api_key}:{model}"
-            
-            # Pipeline de Redis
-            pipeline = self.redis.pipeline()
-            
-            # Actualizar contadores
-            for key in [total_key, daily_key, model_key]:
-                pipeline.hincrby(key, "input_tokens", input_tokens)
-                pipeline.hincrby(key, "output_tokens", output_tokens)
-                pipeline.hincrby(key, "total_tokens", total_tokens)
-                pipeline.hincrby(key, "input_zaaps", int(zaaps["input_zaaps"]))
-                pipeline.hincrby(key, "output_zaaps", int(zaaps["output_zaaps"]))
-                pipeline.hincrby(key, "total_zaaps", int(zaaps["total_zaaps"]))
-                
-            pipeline.hincrby(model_key, "requests", 1)
-            pipeline.expire(daily_key, timedelta(days=7))
-            pipeline.execute()
-            
-            usage_data = {
-                "input_tokens": input_tokens,
-                "output_tokens": output_tokens,
-                "total_tokens": total_tokens,
-                "model": self.MODELS[model]["display_name"],
-                "model_key": model,
-                "cost": cost,
-                "zaaps": zaaps,
-                "endpoint": endpoint
-            }
-            
-            audit_logger.info(
-                f"GPT usage tracked - User: {user.email}, Model: {model}, "
-                f"Tokens: {total_tokens}, Zaaps: {zaaps['total_zaaps']}, Cost: ${cost:.4f}"
+                endpoint=endpoint
             )
-            
-            return usage_data
-            
         except Exception as e:
             logger.error(f"Error tracking GPT usage: {str(e)}")
             raise e
 
+    def build_usage_row(
+        self,
+        user_id: int,
+        model: str,
+        input_tokens: int,
+        output_tokens: int,
+        endpoint: str
+    ) -> Dict:
+        """Construye la fila de token_usage con costos y Zaaps calculados."""
+        cost = self.calculate_cost(model, input_tokens, output_tokens)
+        zaaps = self.calculate_zaaps(model, input_tokens, output_tokens)
+        return {
+            "user_id": user_id,
+            "model": model,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "endpoint": endpoint,
+            "cost": cost,
+            "input_zaaps": zaaps["input_zaaps"],
+            "output_zaaps": zaaps["output_zaaps"],
+            "total_zaaps": zaaps["total_zaaps"]
+        }
+
+    def add_counters_to_pipeline(self, pipeline, api_key: str, model: str, day: str, totals: Dict) -> None:
+        """
+        Añade a un pipeline de Redis los incrementos de los contadores agregados
+        (total, diario y por modelo) de una API Key.
+        """
+        total_key = f"{self.GPT_USAGE_PREFIX}{api_key}"
+        daily_key = f"{self.DAILY_GPT_PREFIX}{api_key}:{day}"
+        model_key = f"{self.MODEL_PREFIX}{api_key}:{model}"
+
+        for key in [total_key, daily_key, model_key]:
+            for field in ("input_tokens", "output_tokens", "total_tokens",
+                          "input_zaaps", "output_zaaps", "total_zaaps"):
+                pipeline.hincrby(key, field, int(totals[field]))
+
+        pipeline.hincrby(model_key, "requests", totals["requests"])
+        pipeline.expire(daily_key, timedelta(days=7))
+
     def get_user_usage_stats(self, db: Session, user: User) -> Dict:
         """
         Obtiene estadísticas completas de uso para un usuario.
@@ -0,0 +1,392 @@
+# app/services/llm_limiter.py
+
+import asyncio
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+import openai
+from app.core.config import settings
+from app.core.logger import logger
+
+
+class LLMUnavailableError(Exception):
+    """El proveedor LLM no está disponible por ahora; reintentar tras `retry_after` segundos."""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """El circuit breaker está abierto: se rechaza la llamada sin contactar al proveedor."""
+
+
+class LimiterTimeoutError(LLMUnavailableError):
+    """No se obtuvo un cupo de concurrencia dentro del tiempo máximo de espera."""
+
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _parse_duration(value: Optional[str]) -> float:
+    """Convierte duraciones como "20ms", "1s" o "6m0s" (x-ratelimit-reset-*) a segundos."""
+    if not value:
+        return 0.0
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in _DURATION_RE.findall(value))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker por tasa de errores en una ventana deslizante.
+
+    CLOSED: las llamadas pasan y se registra su resultado. Si en la ventana hay al
+    menos `min_requests` llamadas y la proporción de errores supera `error_threshold`,
+    pasa a OPEN y rechaza todo durante `open_seconds`. Después, HALF_OPEN deja pasar
+    una llamada de prueba: si tiene éxito se cierra, si falla vuelve a abrirse.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        error_threshold: float = 0.5,
+        min_requests: int = 20,
+        window_seconds: float = 30.0,
+        open_seconds: float = 15.0
+    ):
+        self.error_threshold = error_threshold
+        self.min_requests = min_requests
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """Lanza CircuitOpenError si la llamada no debe realizarse."""
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self._opened_at + self.open_seconds - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError("Circuito abierto hacia el proveedor LLM", retry_after=remaining)
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+                logger.info("Circuit breaker LLM en HALF_OPEN: enviando llamada de prueba")
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    raise CircuitOpenError("Circuito LLM en prueba", retry_after=1.0)
+                self._probe_in_flight = True
+
+    def cancel_probe(self) -> None:
+        """Libera la llamada de prueba reservada por `before_call` que no llegó a enviarse."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record(self, failed: bool) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.HALF_OPEN:
+                self._probe_in_flight = False
+                if failed:
+                    self._open(now)
+                else:
+                    self.state = self.CLOSED
+                    self._outcomes.clear()
+                    logger.info("Circuit breaker LLM cerrado: el proveedor respondió correctamente")
+                return
+            if self.state == self.OPEN:
+                return
+
+            self._outcomes.append((now, failed))
+            while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+                self._outcomes.popleft()
+            total = len(self._outcomes)
+            if total >= self.min_requests:
+                errors = sum(1 for _, f in self._outcomes if f)
+                if errors / total >= self.error_threshold:
+                    self._open(now)
+
+    def _open(self, now: float) -> None:
+        self.state = self.OPEN
+        self._opened_at = now
+        self._outcomes.clear()
+        logger.warning(f"Circuit breaker LLM abierto durante {self.open_seconds}s por tasa de errores")
+
+
+class LimiterSlot:
+    """Cupo de concurrencia obtenido con `AdaptiveConcurrencyLimiter.acquire`."""
+
+    def __init__(self, limiter: "AdaptiveConcurrencyLimiter", operation: str):
+        self.limiter = limiter
+        self.operation = operation
+        self.started_at = time.monotonic()
+        self._recorded = False
+        self._released = False
+
+    def success(self, release: bool = True) -> None:
+        """Registra una llamada exitosa (su latencia alimenta el ajuste de concurrencia)."""
+        if not self._recorded:
+            self._recorded = True
+            self.limiter._on_success(self.operation, time.monotonic() - self.started_at)
+        if release:
+            self.release()
+
+    def failure(self, exc: BaseException, release: bool = True) -> None:
+        if not self._recorded:
+            self._recorded = True
+            self.limiter._on_error(exc)
+        if release:
+            self.release()
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            if not self._recorded:
+                self.limiter.breaker.cancel_probe()
+            self.limiter._release(self)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limitador de concurrencia compartido por todo el tráfico saliente hacia OpenAI
+    (chat, resúmenes, embeddings, chunking y vector store).
+
+    El límite se ajusta con AIMD: crece en 1/límite por cada llamada exitosa con
+    latencia normal y se reduce multiplicativamente cuando la latencia reciente de
+    una operación supera `latency_tolerance` veces su línea base, cuando el proveedor
+    responde 429 o cuando los encabezados `x-ratelimit-remaining-*` indican que queda
+    poco cupo. Si el cupo se agota, las nuevas llamadas esperan al `x-ratelimit-reset-*`.
+    Las llamadas que no obtienen cupo en `queue_timeout` segundos fallan con
+    LimiterTimeoutError, y el circuit breaker rechaza de inmediato mientras el
+    proveedor está fallando.
+    """
+
+    def __init__(
+        self,
+        breaker: CircuitBreaker,
+        initial_limit: int = 16,
+        min_limit: int = 2,
+        max_limit: int = 128,
+        queue_timeout: float = 30.0,
+        latency_tolerance: float = 2.0,
+        decrease_factor: float = 0.7,
+        rate_limit_factor: float = 0.5,
+        decrease_cooldown: float = 1.0,
+        low_remaining_ratio: float = 0.05,
+        enabled: bool = True
+    ):
+        self.breaker = breaker
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_timeout = queue_timeout
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.rate_limit_factor = rate_limit_factor
+        self.decrease_cooldown = decrease_cooldown
+        self.low_remaining_ratio = low_remaining_ratio
+        self.enabled = enabled
+        self.in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        # operación -> (latencia base (EWMA lenta), latencia reciente (EWMA rápida), muestras)
+        self._latency: Dict[str, Tuple[float, float, int]] = {}
+        self._lock = threading.Lock()
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._stats = {"acquired": 0, "rejected": 0, "timeouts": 0, "rate_limited": 0, "errors": 0}
+
+    # ------------------------------------------------------------------
+    # Cupos
+    # ------------------------------------------------------------------
+    async def acquire(
+        self,
+        operation: str = "default",
+        timeout: Optional[float] = None,
+        max_share: float = 1.0
+    ) -> LimiterSlot:
+        """
+        Espera un cupo de concurrencia; falla de inmediato si el circuito está abierto.
+        `max_share` < 1 limita a ese tráfico (p. ej. lotes) a una fracción del límite,
+        dejando el resto libre para las solicitudes interactivas.
+        """
+        if not self.enabled:
+            return LimiterSlot(self, operation)
+
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self._stats["rejected"] += 1
+            raise
+
+        timeout = self.queue_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                now = time.monotonic()
+                paused = self._paused_until - now
+                if paused <= 0 and self.in_flight < max(1, int(self.limit * max_share)):
+                    self.in_flight += 1
+                    self._stats["acquired"] += 1
+                    return LimiterSlot(self, operation)
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise LimiterTimeoutError(
+                        "Sin capacidad disponible hacia el proveedor LLM",
+                        retry_after=max(paused, 1.0)
+                    )
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append(waiter)
+                try:
+                    await asyncio.wait_for(waiter, timeout=min(remaining, paused) if paused > 0 else remaining)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+        except BaseException:
+            # La llamada de prueba del breaker (si lo era) no llegó a realizarse
+            self.breaker.cancel_probe()
+            raise
+
+    def _release(self, slot: LimiterSlot) -> None:
+        if not self.enabled:
+            return
+        self.in_flight = max(0, self.in_flight - 1)
+        # Despertar a los que esperan: cada uno vuelve a comprobar el límite (que depende
+        # de su `max_share`), así un lote que no puede pasar no retiene a uno interactivo
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    # ------------------------------------------------------------------
+    # Ajuste del límite
+    # ------------------------------------------------------------------
+    def _decrease(self, factor: float, reason: str) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease < self.decrease_cooldown:
+                return
+            self._last_decrease = now
+            previous = self.limit
+            self.limit = max(float(self.min_limit), self.limit * factor)
+        logger.warning(f"Concurrencia LLM reducida de {previous:.1f} a {self.limit:.1f} ({reason})")
+
+    def _on_success(self, operation: str, latency: float) -> None:
+        self.breaker.record(False)
+        with self._lock:
+            baseline, recent, samples = self._latency.get(operation, (latency, latency, 0))
+            baseline = baseline * 0.99 + latency * 0.01
+            recent = recent * 0.8 + latency * 0.2
+            self._latency[operation] = (baseline, recent, samples + 1)
+            congested = samples >= 20 and recent > baseline * self.latency_tolerance
+            if not congested:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+        if congested:
+            self._decrease(self.decrease_factor, f"latencia de {operation} {recent:.2f}s vs base {baseline:.2f}s")
+
+    def _on_error(self, exc: BaseException) -> None:
+        response = getattr(exc, "response", None)
+        if response is not None:
+            self.observe_headers(response.headers)
+
+        if isinstance(exc, openai.RateLimitError):
+            # El proveedor está limitando: menos concurrencia, pero no es una falla del servicio
+            self._stats["rate_limited"] += 1
+            self.breaker.record(False)
+            self._decrease(self.rate_limit_factor, "429 del proveedor")
+        elif isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)):
+            self._stats["errors"] += 1
+            self.breaker.record(True)
+            self._decrease(self.decrease_factor, type(exc).__name__)
+        else:
+            # Errores del cliente (400, 404...): el proveedor respondió con normalidad
+            self.breaker.record(False)
+
+    def observe_headers(self, headers) -> None:
+        """Ajusta el límite según los encabezados x-ratelimit-* de una respuesta."""
+        if not self.enabled or headers is None:
+            return
+        try:
+            for kind in ("requests", "tokens"):
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if limit is None or remaining is None:
+                    continue
+                limit, remaining = int(limit), int(remaining)
+                if limit <= 0:
+                    continue
+                if remaining <= 0:
+                    reset = _parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                    with self._lock:
+                        self._paused_until = max(self._paused_until, time.monotonic() + reset)
+                    self._decrease(self.rate_limit_factor, f"cupo de {kind} agotado")
+                elif remaining / limit < self.low_remaining_ratio:
+                    self._decrease(self.decrease_factor, f"quedan {remaining}/{limit} {kind}")
+        except (TypeError, ValueError) as e:
+            logger.debug(f"Encabezados x-ratelimit no válidos: {e}")
+
+    # ------------------------------------------------------------------
+    # Ejecución
+    # ------------------------------------------------------------------
+    def _unwrap(self, result: Any) -> Any:
+        # Respuestas de `with_raw_response`: leer los encabezados y retornar el objeto parseado
+        if hasattr(result, "headers") and hasattr(result, "parse"):
+            self.observe_headers(result.headers)
+            return result.parse()
+        return result
+
+    async def run(self, operation: str, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Ejecuta una corrutina del cliente OpenAI dentro de un cupo del limitador."""
+        slot = await self.acquire(operation)
+        try:
+            result = self._unwrap(await fn(*args, **kwargs))
+        except BaseException as e:
+            slot.failure(e)
+            raise
+        slot.success()
+        return result
+
+    async def run_sync(self, operation: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Ejecuta una llamada bloqueante del cliente OpenAI en un hilo, dentro de un cupo."""
+        slot = await self.acquire(operation)
+        try:
+            result = self._unwrap(await asyncio.to_thread(fn, *args, **kwargs))
+        except BaseException as e:
+            slot.failure(e)
+            raise
+        slot.success()
+        return result
+
+    def stats(self) -> Dict:
+        return {
+            **self._stats,
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "circuit": self.breaker.state,
+            "paused_for": max(0.0, round(self._paused_until - time.monotonic(), 2))
+        }
+
+
+llm_limiter = AdaptiveConcurrencyLimiter(
+    CircuitBreaker(
+        error_threshold=settings.LLM_BREAKER_ERROR_THRESHOLD,
+        min_requests=settings.LLM_BREAKER_MIN_REQUESTS,
+        window_seconds=settings.LLM_BREAKER_WINDOW_SECONDS,
+        open_seconds=settings.LLM_BREAKER_OPEN_SECONDS
+    ),
+    initial_limit=settings.LLM_CONCURRENCY_INITIAL,
+    min_limit=settings.LLM_CONCURRENCY_MIN,
+    max_limit=settings.LLM_CONCURRENCY_MAX,
+    queue_timeout=settings.LLM_QUEUE_TIMEOUT_SECONDS,
+    latency_tolerance=settings.LLM_LATENCY_TOLERANCE,
+    enabled=settings.LLM_LIMITER_ENABLED
+)
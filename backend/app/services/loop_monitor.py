@@ -0,0 +1,62 @@
+# app/services/loop_monitor.py
+
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+from app.core.logger import logger
+
+
+class EventLoopLagMonitor:
+    """
+    Mide el retraso del event loop: una tarea duerme `interval` segundos y registra
+    cuánto tarda de más en despertar. Un retraso alto indica código bloqueante en el
+    loop (I/O síncrono, CPU) que frena a todas las solicitudes del worker.
+    """
+
+    def __init__(self, interval: float = 0.1, max_samples: int = 600, warn_threshold: float = 0.5):
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self._samples: Deque[float] = deque(maxlen=max_samples)
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            self._samples.append(lag)
+            if lag > self.warn_threshold:
+                logger.warning(f"Event loop bloqueado durante {lag * 1000:.0f} ms")
+
+    def stats(self) -> Dict:
+        """Percentiles del retraso (ms) sobre las últimas muestras."""
+        if not self._samples:
+            return {"samples": 0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        ordered = sorted(self._samples)
+
+        def percentile(p: float) -> float:
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2)
+
+        return {
+            "samples": len(ordered),
+            "p50_ms": percentile(0.50),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(ordered[-1] * 1000, 2)
+        }
+
+
+loop_lag_monitor = EventLoopLagMonitor()
@@ -0,0 +1,196 @@
+# app/services/model_router.py
+
+import re
+import threading
+import unicodedata
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.core.logger import logger
+from app.services.tokenizer import count_tokens
+
+FAST = "fast"
+STRONG = "strong"
+
+# Tiers permitidos según NoaConfig.model. "gpt4" (valor por defecto histórico) y
+# "auto" habilitan el enrutamiento; un modelo concreto fija el tier.
+ALLOWED_TIERS: Dict[str, Tuple[str, ...]] = {
+    "gpt4": (FAST, STRONG),
+    "auto": (FAST, STRONG),
+    "gpt-4o": (STRONG,),
+    "gpt-4o-mini": (FAST,)
+}
+
+_SMALLTALK_RE = re.compile(
+    r"^(hola|buen[oa]s?( dias| tardes| noches)?|hey|saludos|gracias|muchas gracias|ok|okay|vale|"
+    r"perfecto|genial|listo|entendido|de acuerdo|chao|adios|hasta luego)\b"
+)
+# Intenciones que requieren razonamiento: comparar, explicar, calcular, planificar
+_COMPLEX_RE = re.compile(
+    r"\b(compar\w*|diferencia\w*|explic\w*|por que|analiz\w*|calcul\w*|estrategia\w*|"
+    r"recomiend\w*|recomendaci\w*|paso a paso|ventajas|desventajas|resum\w*|redact\w*|"
+    r"propuesta|objecion\w*|negoci\w*|contrato\w*)\b"
+)
+# Preguntas sobre la información de la empresa (requieren file_search)
+_RETRIEVAL_RE = re.compile(
+    r"\b(precio\w*|cuesta|costo\w*|tarifa\w*|plan(es)?|producto\w*|servicio\w*|stock|"
+    r"envio\w*|garantia\w*|catalogo|ficha|especificacion\w*|politica\w*|documento\w*)\b"
+)
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower().strip())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+class RouteDecision:
+    """Resultado del enrutamiento de un mensaje."""
+
+    def __init__(self, tier: str, model: str, reason: str):
+        self.tier = tier
+        self.model = model
+        self.reason = reason
+
+    def to_dict(self) -> Dict:
+        return {"tier": self.tier, "model": self.model, "reason": self.reason}
+
+
+class ModelRouter:
+    """
+    Enrutamiento de cada mensaje a un tier rápido o fuerte.
+
+    La clasificación usa heurísticas locales sin llamadas externas: largo del mensaje
+    en tokens, palabras clave de intención compleja, necesidad de buscar en los
+    documentos de la empresa y selección explícita de archivos. Saludos y preguntas
+    cortas van al tier rápido; las preguntas difíciles siempre al fuerte, dentro de
+    los tiers que permite la configuración NOA del tenant.
+
+    Registra la latencia por modelo (total y hasta el primer token en streaming). Si
+    `strong_latency_budget_ms` > 0 y la mediana reciente del tier fuerte lo supera,
+    los mensajes que solo son largos (sin intención compleja) se degradan al tier
+    rápido; las preguntas difíciles nunca se degradan.
+    """
+
+    def __init__(
+        self,
+        fast_model: str,
+        strong_model: str,
+        enabled: bool = True,
+        fast_max_tokens: int = 40,
+        long_message_tokens: int = 120,
+        strong_latency_budget_ms: float = 0,
+        window: int = 200
+    ):
+        self.models = {FAST: fast_model, STRONG: strong_model}
+        self.enabled = enabled
+        self.fast_max_tokens = fast_max_tokens
+        self.long_message_tokens = long_message_tokens
+        self.strong_latency_budget_ms = strong_latency_budget_ms
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, Deque[float]] = {FAST: deque(maxlen=window), STRONG: deque(maxlen=window)}
+        self._first_token: Dict[str, Deque[float]] = {FAST: deque(maxlen=window), STRONG: deque(maxlen=window)}
+        self._decisions: Dict[str, int] = {}
+
+    # ------------------------------------------------------------------
+    # Clasificación
+    # ------------------------------------------------------------------
+    def classify(self, message: str, scoped: bool = False) -> Tuple[str, str]:
+        """Retorna (tier, motivo) para el mensaje, sin considerar al tenant."""
+        text = _normalize(message)
+        tokens = count_tokens(message)
+
+        if tokens <= 12 and _SMALLTALK_RE.match(text) and not _RETRIEVAL_RE.search(text):
+            return FAST, "smalltalk"
+        if _COMPLEX_RE.search(text):
+            return STRONG, "complex_intent"
+        if text.count("?") >= 2:
+            return STRONG, "multi_question"
+        if scoped:
+            return STRONG, "scoped_retrieval"
+        if tokens > self.long_message_tokens:
+            return STRONG, "long"
+        if _RETRIEVAL_RE.search(text) and tokens > self.fast_max_tokens:
+            return STRONG, "retrieval"
+        if tokens <= self.fast_max_tokens:
+            return FAST, "short"
+        return STRONG, "default"
+
+    def route(self, message: str, tenant_model: Optional[str], scoped: bool = False) -> RouteDecision:
+        """Elige el modelo del turno dentro de los tiers permitidos para el tenant."""
+        allowed = ALLOWED_TIERS.get(tenant_model or "", (STRONG,))
+        if not self.enabled:
+            tier, reason = (STRONG if STRONG in allowed else FAST), "disabled"
+        else:
+            tier, reason = self.classify(message, scoped)
+            if tier == STRONG and reason == "long" and self._strong_over_budget():
+                tier, reason = FAST, "long_degraded"
+            if tier not in allowed:
+                tier, reason = allowed[0], f"{reason}_pinned"
+
+        decision = RouteDecision(tier, self.models[tier], reason)
+        with self._lock:
+            key = f"{tier}:{reason}"
+            self._decisions[key] = self._decisions.get(key, 0) + 1
+        return decision
+
+    def model_for_tenant(self, tenant_model: Optional[str]) -> str:
+        """
+        Modelo para trabajos sin mensaje que clasificar (p. ej. lotes): el tier fuerte
+        si la configuración del tenant lo permite; si la fija al rápido, ese.
+        Valores desconocidos usan el tier fuerte, como en `route`.
+        """
+        allowed = ALLOWED_TIERS.get(tenant_model or "", (STRONG,))
+        return self.models[STRONG if STRONG in allowed else allowed[0]]
+
+    # ------------------------------------------------------------------
+    # Latencias
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _percentile(values: List[float], fraction: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 1)
+
+    def _strong_over_budget(self) -> bool:
+        if self.strong_latency_budget_ms <= 0:
+            return False
+        with self._lock:
+            median = self._percentile(list(self._latencies[STRONG]), 0.5)
+        return median is not None and median > self.strong_latency_budget_ms
+
+    def record(self, decision: RouteDecision, latency_ms: float, first_token_ms: Optional[float] = None):
+        """Registra la latencia de un turno respondido por el modelo elegido."""
+        with self._lock:
+            self._latencies[decision.tier].append(latency_ms)
+            if first_token_ms is not None:
+                self._first_token[decision.tier].append(first_token_ms)
+        logger.debug(
+            f"Ruta {decision.tier} ({decision.model}, {decision.reason}): {latency_ms:.0f} ms"
+            + (f", primer token {first_token_ms:.0f} ms" if first_token_ms is not None else "")
+        )
+
+    def stats(self) -> Dict:
+        with self._lock:
+            tiers = {}
+            for tier, model in self.models.items():
+                latencies = list(self._latencies[tier])
+                first_token = list(self._first_token[tier])
+                tiers[tier] = {
+                    "model": model,
+                    "samples": len(latencies),
+                    "p50_ms": self._percentile(latencies, 0.5),
+                    "p95_ms": self._percentile(latencies, 0.95),
+                    "first_token_p50_ms": self._percentile(first_token, 0.5)
+                }
+            return {"enabled": self.enabled, "tiers": tiers, "decisions": dict(self._decisions)}
+
+
+model_router = ModelRouter(
+    settings.CHAT_FAST_MODEL,
+    settings.CHAT_STRONG_MODEL,
+    enabled=settings.CHAT_ROUTING_ENABLED,
+    fast_max_tokens=settings.CHAT_ROUTING_FAST_MAX_TOKENS,
+    long_message_tokens=settings.CHAT_ROUTING_LONG_TOKENS,
+    strong_latency_budget_ms=settings.CHAT_ROUTING_STRONG_LATENCY_BUDGET_MS
+)
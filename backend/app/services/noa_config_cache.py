@@ -0,0 +1,213 @@
+# app/services/noa_config_cache.py
+
+import asyncio
+import hashlib
+import json
+import time
+from typing import Dict, Optional, Tuple
+from redis import Redis as SyncRedis
+from redis.asyncio import Redis
+from sqlalchemy.orm import Session
+from app.core.logger import logger
+from app.core.services import redis_client, sync_redis_client
+from app.database.models.noa_config import NoaConfig
+from app.database.models.user import User
+from app.services.cache_invalidation import invalidation_bus, CacheInvalidationBus
+from app.services.tokenizer import count_tokens, truncate_to_token_limit
+
+# Valores por defecto cuando el usuario no tiene configuración guardada
+DEFAULT_CONFIG = {
+    "prompt": "",
+    "model": "gpt4",
+    "temperature": 0.7,
+    "personality": "professional",
+    "objective": "sales"
+}
+
+# Guarda la configuración compilada solo si la generación del usuario no cambió desde
+# que se leyó (ninguna invalidación ocurrió durante la carga desde la base).
+# KEYS: configuración, generación; ARGV: generación leída, valor, ttl. Retorna 1 si guardó.
+SET_IF_GENERATION_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', tonumber(ARGV[3]))
+return 1
+"""
+
+
+class CompiledNoaConfig:
+    """Configuración NOA con el prompt de sistema ya construido y truncado."""
+
+    def __init__(
+        self,
+        prompt: str,
+        model: str,
+        temperature: float,
+        personality: str,
+        objective: str,
+        system_prompt: str,
+        system_prompt_tokens: int,
+        version: str
+    ):
+        self.prompt = prompt
+        self.model = model
+        self.temperature = temperature
+        self.personality = personality
+        self.objective = objective
+        self.system_prompt = system_prompt
+        self.system_prompt_tokens = system_prompt_tokens
+        self.version = version
+
+    def to_dict(self) -> Dict:
+        return dict(self.__dict__)
+
+
+class NoaConfigCache:
+    """
+    Caché de configuraciones NOA compiladas, en proceso y en Redis.
+
+    Guarda el prompt de sistema ya truncado y su número de tokens, de modo que un
+    turno de chat no consulta Postgres ni pasa por el tokenizer. `save_noa_config`
+    invalida la entrada en Redis y avisa al resto de workers por pub/sub.
+
+    Cada invalidación incrementa una generación por usuario; una carga desde la base
+    solo se guarda si la generación no cambió mientras se cargaba, para que una
+    invalidación concurrente no quede tapada por la configuración anterior.
+    """
+
+    PREFIX = "noa_config:"
+    CHANNEL = "noa_config:invalidate"
+
+    def __init__(
+        self,
+        redis: Redis,
+        bus: CacheInvalidationBus,
+        sync_redis: Optional[SyncRedis] = None,
+        ttl_seconds: int = 86400,
+        local_ttl_seconds: float = 300.0,
+        max_system_tokens: int = 1500
+    ):
+        self.redis = redis
+        self.bus = bus
+        self.sync_redis = sync_redis
+        self.ttl_seconds = ttl_seconds
+        self.local_ttl_seconds = local_ttl_seconds
+        self.max_system_tokens = max_system_tokens
+        self._local: Dict[int, Tuple[float, CompiledNoaConfig]] = {}
+        # Invalidaciones vistas por este worker (para no repoblar la caché local con una carga previa)
+        self._invalidations = 0
+        self._set_if_generation = self.redis.register_script(SET_IF_GENERATION_SCRIPT)
+        self.bus.subscribe(self.CHANNEL, self._on_invalidate)
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.PREFIX}{user_id}"
+
+    def _generation_key(self, user_id: int) -> str:
+        return f"{self.PREFIX}{user_id}:generation"
+
+    def _compile(self, fields: Dict) -> CompiledNoaConfig:
+        system_prompt_full = (
+            f"Instrucción: {fields['prompt']}\n"
+            f"Personalidad: {fields['personality']}\n"
+            f"Objetivo: {fields['objective']}\n"
+            "Utiliza el siguiente contexto cuando sea necesario para responder de forma precisa."
+        )
+        # Limitar el sistema a un máximo de tokens para dejar espacio para otras partes
+        system_prompt = truncate_to_token_limit(system_prompt_full, self.max_system_tokens)
+        raw = "|".join(str(fields[name]) for name in (
+            "prompt", "model", "temperature", "personality", "objective"
+        ))
+        return CompiledNoaConfig(
+            system_prompt=system_prompt,
+            system_prompt_tokens=count_tokens(system_prompt),
+            version=hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12],
+            **fields
+        )
+
+    def _load_from_db(self, db: Session, user_id: int) -> CompiledNoaConfig:
+        config_db = db.query(NoaConfig).filter_by(user_id=user_id).first()
+        if not config_db:
+            return self._compile(dict(DEFAULT_CONFIG))
+        return self._compile({
+            "prompt": config_db.prompt,
+            "model": config_db.model,
+            "temperature": config_db.temperature,
+            "personality": config_db.personality,
+            "objective": config_db.objective
+        })
+
+    async def get(self, db: Session, user: User) -> CompiledNoaConfig:
+        """Obtiene la configuración compilada: caché local -> Redis -> base de datos."""
+        cached = self._local.get(user.id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        invalidations = self._invalidations
+        config: Optional[CompiledNoaConfig] = None
+        generation: Optional[str] = None
+        try:
+            data, generation = await self.redis.mget([self._key(user.id), self._generation_key(user.id)])
+            generation = generation or "0"
+            if data:
+                config = CompiledNoaConfig(**json.loads(data))
+        except Exception as e:
+            logger.error(f"Error leyendo configuración NOA de Redis: {e}")
+
+        cacheable = True
+        if config is None:
+            # Consulta síncrona de SQLAlchemy y tokenizer: fuera del event loop
+            config = await asyncio.to_thread(self._load_from_db, db, user.id)
+            if generation is not None:
+                try:
+                    cacheable = bool(await self._set_if_generation(
+                        keys=[self._key(user.id), self._generation_key(user.id)],
+                        args=[generation, json.dumps(config.to_dict()), self.ttl_seconds]
+                    ))
+                except Exception as e:
+                    logger.error(f"Error guardando configuración NOA en Redis: {e}")
+
+        # Si hubo una invalidación durante la lectura, la configuración puede ser la anterior:
+        # se usa para este turno pero no se cachea
+        if cacheable and invalidations == self._invalidations:
+            self._local[user.id] = (time.monotonic() + self.local_ttl_seconds, config)
+        return config
+
+    async def invalidate(self, user_id: int) -> None:
+        """Elimina la configuración cacheada del usuario en todos los workers."""
+        self._forget(user_id)
+        try:
+            pipeline = self.redis.pipeline()
+            self._invalidate_pipeline(pipeline, user_id)
+            await pipeline.execute()
+        except Exception as e:
+            logger.error(f"Error invalidando configuración NOA en Redis: {e}")
+        self.bus.publish(self.CHANNEL, str(user_id))
+
+    def invalidate_sync(self, user_id: int) -> None:
+        """Como `invalidate`, para endpoints síncronos que corren en el threadpool."""
+        self._forget(user_id)
+        try:
+            pipeline = self.sync_redis.pipeline()
+            self._invalidate_pipeline(pipeline, user_id)
+            pipeline.execute()
+        except Exception as e:
+            logger.error(f"Error invalidando configuración NOA en Redis: {e}")
+        # Sin event loop en el hilo: el bus publica con el cliente síncrono
+        self.bus.publish(self.CHANNEL, str(user_id))
+
+    def _invalidate_pipeline(self, pipeline, user_id: int) -> None:
+        generation_key = self._generation_key(user_id)
+        pipeline.incr(generation_key)
+        pipeline.expire(generation_key, self.ttl_seconds)
+        pipeline.delete(self._key(user_id))
+
+    def _forget(self, user_id: int) -> None:
+        self._invalidations += 1
+        self._local.pop(user_id, None)
+
+    def _on_invalidate(self, message: str) -> None:
+        self._forget(int(message))
+
+
+noa_config_cache = NoaConfigCache(redis_client, invalidation_bus, sync_redis_client)
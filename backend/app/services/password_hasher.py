@@ -0,0 +1,102 @@
+# app/services/password_hasher.py
+
+import asyncio
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+from fastapi import HTTPException, status
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.security import pwd_context
+
+
+class PasswordHasher:
+    """
+    Hash y verificación de contraseñas (bcrypt) fuera del event loop.
+
+    Cada operación consume 100-300 ms de CPU, así que corre en un pool de hilos propio
+    de `max_workers` hilos (bcrypt libera el GIL). Se admiten como máximo
+    `max_workers + max_queue` operaciones a la vez; por encima de eso se responde 503
+    con Retry-After de inmediato en lugar de encolar sin límite, de modo que una
+    ráfaga de logins no degrada al resto de endpoints.
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue: int = 32):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+        self._rehashed = 0
+
+    def _reserve(self) -> None:
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                rejected = self._rejected
+            else:
+                self._in_flight += 1
+                return
+        if rejected % 100 == 1:
+            logger.warning(f"Pool de hash de contraseñas saturado: {rejected} operaciones rechazadas")
+        # Tiempo aproximado hasta que se vacíe la cola actual (~0.25 s por operación)
+        retry_after = max(1, math.ceil(self.max_queue * 0.25 / self.max_workers))
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="El servicio de autenticación está saturado. Intente de nuevo en unos momentos.",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    def _release(self, _future=None) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    async def _run(self, func, *args):
+        self._reserve()
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._release()
+            raise
+        # El cupo se libera al terminar el hilo, aunque la solicitud se cancele antes
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(pwd_context.verify, password, hashed_password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verifica la contraseña y, si el hash usa un costo inferior a BCRYPT_ROUNDS,
+        retorna también el hash recalculado para guardarlo (los hashes con más rondas se
+        conservan). Retorna (válida, nuevo hash o None).
+        """
+        valid, new_hash = await self._run(pwd_context.verify_and_update, password, hashed_password)
+        if new_hash is not None:
+            with self._lock:
+                self._rehashed += 1
+        return valid, new_hash
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "rejected": self._rejected,
+                "rehashed": self._rehashed
+            }
+
+
+password_hasher = PasswordHasher(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    max_queue=settings.PASSWORD_HASH_MAX_QUEUE
+)
@@ -0,0 +1,131 @@
+# app/services/principal_cache.py
+
+import hashlib
+import threading
+import time
+from typing import Dict, Optional, Set, Tuple
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached
+from app.core.config import settings
+from app.core.logger import logger
+from app.database.models.company import Company
+from app.database.models.user import User
+from app.services.cache_invalidation import invalidation_bus, CacheInvalidationBus
+
+
+def _columns(obj) -> Dict:
+    return {attr.key: getattr(obj, attr.key) for attr in inspect(type(obj)).column_attrs}
+
+
+class PrincipalCache:
+    """
+    Caché en proceso del usuario autenticado, indexada por el hash del token.
+
+    Un acierto evita decodificar el JWT, consultar el usuario en Postgres y leer la
+    sesión en Redis. Las entradas duran como máximo `ttl_seconds` (y nunca más que el
+    token) y se invalidan en todos los workers por pub/sub al cerrar sesión, actualizar
+    el usuario o desactivarlo (cualquier UPDATE sobre users).
+
+    Se guardan los valores de las columnas, no la instancia ORM: cada acierto construye
+    una copia desacoplada de la sesión (con su empresa ya cargada), de modo que las
+    solicitudes concurrentes no comparten estado mutable. Los endpoints que modifican
+    al usuario deben cargarlo en su propia sesión.
+    """
+
+    CHANNEL = "principal:invalidate"
+
+    def __init__(self, bus: CacheInvalidationBus, ttl_seconds: float = 60.0, max_entries: int = 10000):
+        self.bus = bus
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # hash del token -> (expiración, columnas del usuario, columnas de la empresa)
+        self._entries: Dict[str, Tuple[float, Dict, Optional[Dict]]] = {}
+        self._by_user: Dict[int, Set[str]] = {}
+        self.bus.subscribe(self.CHANNEL, self._on_invalidate)
+
+    @staticmethod
+    def _token_key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _snapshot(user_fields: Dict, company_fields: Optional[Dict]) -> User:
+        company = Company(**company_fields) if company_fields else None
+        user = User(**user_fields, company=company)
+        if company is not None:
+            make_transient_to_detached(company)
+        make_transient_to_detached(user)
+        return user
+
+    def get(self, token: str) -> Optional[User]:
+        key = self._token_key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._drop(key, entry[1]["id"])
+                return None
+        return self._snapshot(entry[1], entry[2])
+
+    def put(self, token: str, user: User, token_exp: Optional[float] = None) -> None:
+        ttl = self.ttl_seconds
+        if token_exp is not None:
+            ttl = min(ttl, token_exp - time.time())
+        if ttl <= 0:
+            return
+        user_fields = _columns(user)
+        company_fields = _columns(user.company) if user.company is not None else None
+        key = self._token_key(token)
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._evict()
+            self._entries[key] = (time.monotonic() + ttl, user_fields, company_fields)
+            self._by_user.setdefault(user.id, set()).add(key)
+
+    def _drop(self, key: str, user_id: int) -> None:
+        self._entries.pop(key, None)
+        keys = self._by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user_id]
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        for key, entry in list(self._entries.items()):
+            if entry[0] <= now:
+                self._drop(key, entry[1]["id"])
+        # Si sigue lleno, descartar las entradas más antiguas (orden de inserción)
+        while len(self._entries) >= self.max_entries:
+            key, entry = next(iter(self._entries.items()))
+            self._drop(key, entry[1]["id"])
+
+    def _invalidate_local(self, user_id: int) -> None:
+        with self._lock:
+            for key in self._by_user.pop(user_id, set()):
+                self._entries.pop(key, None)
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Descarta todas las entradas del usuario en todos los workers."""
+        self._invalidate_local(user_id)
+        self.bus.publish(self.CHANNEL, str(user_id))
+
+    def _on_invalidate(self, message: str) -> None:
+        self._invalidate_local(int(message))
+
+
+principal_cache = PrincipalCache(
+    invalidation_bus,
+    ttl_seconds=settings.PRINCIPAL_CACHE_TTL_SECONDS,
+    max_entries=settings.PRINCIPAL_CACHE_MAX_ENTRIES
+)
+
+
+@event.listens_for(User, "after_update")
+def _invalidate_updated_user(mapper, connection, target: User) -> None:
+    # Perfil actualizado, desactivación o cambio de API Key: el snapshot cacheado queda obsoleto
+    try:
+        principal_cache.invalidate_user(target.id)
+    except Exception as e:
+        logger.error(f"Error invalidando la caché de usuario {target.id}: {e}")
@@ -0,0 +1,180 @@
+# app/services/rate_limiter.py
+
+import math
+from typing import List, Optional, Tuple
+from fastapi import HTTPException, status
+from redis.asyncio import Redis
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.services import redis_client
+
+# Token bucket multi-nivel. Recarga todos los buckets según el tiempo del servidor Redis
+# y solo descuenta el costo si TODOS tienen saldo suficiente. Si alguno no alcanza,
+# no descuenta nada y retorna el tiempo de espera necesario.
+# KEYS: buckets; ARGV: costo, luego pares (capacidad, tokens por segundo) por bucket.
+ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local cost = tonumber(ARGV[1])
+local levels = {}
+local max_wait = 0
+
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = tonumber(ARGV[2 * i + 1])
+    local data = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(data[1]) or capacity
+    local ts = tonumber(data[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    -- Una solicitud más grande que la capacidad pasa con el bucket lleno (queda en deuda)
+    local needed = math.min(cost, capacity)
+    if tokens < needed then
+        local wait = (needed - tokens) / rate
+        if wait > max_wait then
+            max_wait = wait
+        end
+    end
+end
+
+if max_wait > 0 then
+    return {0, tostring(max_wait)}
+end
+
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = tonumber(ARGV[2 * i + 1])
+    redis.call('HSET', KEYS[i], 'tokens', tostring(levels[i] - cost), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[i], math.ceil(capacity / rate) + 1)
+end
+return {1, '0'}
+"""
+
+# Ajusta los buckets con la diferencia entre el costo estimado y el real. Una cantidad
+# positiva devuelve tokens (sin superar la capacidad); una negativa cobra el exceso y
+# puede dejar el bucket en deuda, que se paga con la recarga antes del próximo acquire.
+# Un bucket ya expirado está lleno: el exceso se descuenta desde la capacidad.
+# KEYS: buckets; ARGV: cantidad, luego pares (capacidad, tokens por segundo) por bucket.
+REFUND_SCRIPT = """
+local amount = tonumber(ARGV[1])
+local now = nil
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = tonumber(ARGV[2 * i + 1])
+    local tokens = tonumber(redis.call('HGET', KEYS[i], 'tokens'))
+    if tokens then
+        tokens = math.min(capacity, tokens + amount)
+        redis.call('HSET', KEYS[i], 'tokens', tostring(tokens))
+    elseif amount < 0 then
+        if not now then
+            local t = redis.call('TIME')
+            now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+        end
+        tokens = capacity + amount
+        redis.call('HSET', KEYS[i], 'tokens', tostring(tokens), 'ts', tostring(now))
+    end
+    if tokens and amount < 0 then
+        -- Conservar el bucket hasta que la deuda se haya recargado
+        local ttl = math.ceil((capacity - tokens) / rate) + 1
+        if redis.call('TTL', KEYS[i]) < ttl then
+            redis.call('EXPIRE', KEYS[i], ttl)
+        end
+    end
+end
+return 1
+"""
+
+
+class TokenBucketRateLimiter:
+    """
+    Rate limiter distribuido basado en token buckets almacenados en Redis.
+
+    Los tokens del bucket son tokens LLM estimados (no solicitudes), y cada solicitud
+    se valida contra tres buckets a la vez: usuario, empresa y global. La capacidad
+    de cada bucket equivale a un minuto de su límite (TPM), que se recarga de forma continua.
+    """
+
+    PREFIX = "ratelimit:llm:"
+
+    def __init__(
+        self,
+        redis: Redis,
+        user_tpm: int,
+        company_tpm: int,
+        global_tpm: int,
+        enabled: bool = True
+    ):
+        self.redis = redis
+        self.user_tpm = user_tpm
+        self.company_tpm = company_tpm
+        self.global_tpm = global_tpm
+        self.enabled = enabled
+        self._acquire = self.redis.register_script(ACQUIRE_SCRIPT)
+        self._refund = self.redis.register_script(REFUND_SCRIPT)
+
+    def _buckets(self, user_id: int, company_id: Optional[int]) -> List[Tuple[str, int]]:
+        buckets = [(f"{self.PREFIX}user:{user_id}", self.user_tpm)]
+        if company_id is not None:
+            buckets.append((f"{self.PREFIX}company:{company_id}", self.company_tpm))
+        buckets.append((f"{self.PREFIX}global", self.global_tpm))
+        return buckets
+
+    async def acquire(self, user_id: int, company_id: Optional[int], tokens: int) -> None:
+        """
+        Descuenta `tokens` de los buckets del usuario, su empresa y el global.
+        Lanza HTTPException 429 con Retry-After si alguno no tiene saldo suficiente.
+        """
+        if not self.enabled:
+            return
+
+        buckets = self._buckets(user_id, company_id)
+        args = [tokens]
+        for _, tpm in buckets:
+            args.extend([tpm, tpm / 60.0])
+
+        try:
+            allowed, wait = await self._acquire(keys=[key for key, _ in buckets], args=args)
+        except Exception as e:
+            # Si Redis no está disponible preferimos no bloquear el chat
+            logger.error(f"Error consultando el rate limiter: {e}")
+            return
+
+        if not int(allowed):
+            retry_after = max(1, math.ceil(float(wait)))
+            logger.warning(
+                f"Rate limit excedido - Usuario: {user_id}, Empresa: {company_id}, "
+                f"Tokens estimados: {tokens}, Retry-After: {retry_after}s"
+            )
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Se ha excedido el límite de uso. Por favor, intente de nuevo en unos momentos.",
+                headers={"Retry-After": str(retry_after)}
+            )
+
+    async def refund(self, user_id: int, company_id: Optional[int], tokens: int) -> None:
+        """
+        Ajusta los buckets una vez conocido el uso real: `tokens` es el estimado menos
+        el uso. Si es positivo se devuelve lo estimado de más; si es negativo (p. ej. por
+        los fragmentos de file_search o el historial de `previous_response_id`, que no
+        entran en la estimación) se cobra el exceso.
+        """
+        if not self.enabled or tokens == 0:
+            return
+
+        buckets = self._buckets(user_id, company_id)
+        args = [tokens]
+        for _, tpm in buckets:
+            args.extend([tpm, tpm / 60.0])
+        try:
+            await self._refund(keys=[key for key, _ in buckets], args=args)
+        except Exception as e:
+            logger.error(f"Error devolviendo tokens al rate limiter: {e}")
+
+
+chat_rate_limiter = TokenBucketRateLimiter(
+    redis_client,
+    user_tpm=settings.RATE_LIMIT_USER_TPM,
+    company_tpm=settings.RATE_LIMIT_COMPANY_TPM,
+    global_tpm=settings.RATE_LIMIT_GLOBAL_TPM,
+    enabled=settings.RATE_LIMIT_ENABLED
+)
@@ -0,0 +1,190 @@
+# app/services/request_coalescer.py
+
+import asyncio
+import hashlib
+import json
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from redis.asyncio import Redis
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.services import redis_client
+
+
+class CoalescingConflictError(Exception):
+    """La clave de coalescencia ya se usó con una solicitud distinta."""
+
+
+class _LeaderCancelled(Exception):
+    """La ejecución compartida se canceló antes de producir un resultado."""
+
+
+class RequestCoalescer:
+    """
+    Single-flight para solicitudes idénticas en curso.
+
+    Las solicitudes con la misma clave (usuario + hash del mensaje, o usuario +
+    Idempotency-Key) comparten una única ejecución. Dentro del mismo worker los
+    duplicados esperan el mismo future; entre workers, el primero toma un lock en
+    Redis y los demás esperan a que publique el resultado. El resultado se conserva
+    durante una ventana corta para que los reintentos del frontend reciban la misma
+    respuesta sin una nueva llamada al modelo.
+
+    Si la clave no deriva del contenido (Idempotency-Key), el llamador pasa la huella
+    de la solicitud; se guarda junto al resultado y un duplicado con otra huella
+    recibe `CoalescingConflictError` en lugar de la respuesta anterior.
+    """
+
+    PREFIX = "chat_inflight:"
+
+    def __init__(
+        self,
+        redis: Redis,
+        window_seconds: int = 10,
+        lock_ttl_seconds: int = 120,
+        poll_interval: float = 0.1,
+        enabled: bool = True
+    ):
+        self.redis = redis
+        self.window_seconds = window_seconds
+        self.lock_ttl_seconds = lock_ttl_seconds
+        self.poll_interval = poll_interval
+        self.enabled = enabled
+        self._inflight: Dict[str, Tuple[asyncio.Future, Optional[str]]] = {}
+
+    @staticmethod
+    def make_key(user_id: int, fingerprint: str) -> str:
+        digest = hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:32]
+        return f"{user_id}:{digest}"
+
+    def _lock_key(self, key: str) -> str:
+        return f"{self.PREFIX}{key}:lock"
+
+    def _result_key(self, key: str) -> str:
+        return f"{self.PREFIX}{key}:result"
+
+    @staticmethod
+    def _check_fingerprint(key: str, expected: Optional[str], actual: Optional[str]) -> None:
+        if expected != actual:
+            raise CoalescingConflictError(f"La clave {key} ya se usó con otra solicitud")
+
+    async def _get_result(self, key: str, fingerprint: Optional[str]) -> Optional[Dict]:
+        try:
+            data = await self.redis.get(self._result_key(key))
+            stored = json.loads(data) if data else None
+        except Exception as e:
+            logger.error(f"Error leyendo resultado coalescido {key}: {e}")
+            return None
+        if stored is None:
+            return None
+        self._check_fingerprint(key, stored.get("fingerprint"), fingerprint)
+        return stored["result"]
+
+    async def run(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[Dict]],
+        result_ttl_seconds: Optional[int] = None,
+        fingerprint: Optional[str] = None
+    ) -> Dict:
+        """
+        Ejecuta `factory` una sola vez por clave y retorna su resultado (un dict
+        serializable en JSON) a todas las solicitudes duplicadas. Si la ejecución
+        compartida se cancela (el cliente del líder se desconectó), los duplicados
+        locales que la esperaban la reintentan en lugar de propagar la cancelación.
+        """
+        if not self.enabled:
+            return await factory()
+
+        # 1. Duplicado en este mismo worker: esperar la ejecución en curso
+        while key in self._inflight:
+            inflight, inflight_fingerprint = self._inflight[key]
+            self._check_fingerprint(key, inflight_fingerprint, fingerprint)
+            logger.info(f"Solicitud duplicada coalescida localmente ({key})")
+            try:
+                return await asyncio.shield(inflight)
+            except _LeaderCancelled:
+                logger.info(f"Ejecución coalescida cancelada, reintentando ({key})")
+
+        # Registrar la ejecución antes de la primera espera para que los duplicados
+        # locales que lleguen mientras tanto la compartan
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (future, fingerprint)
+        try:
+            # 2. Resultado reciente de otra ejecución (reintento dentro de la ventana)
+            result = await self._get_result(key, fingerprint)
+            if result is not None:
+                logger.info(f"Solicitud duplicada servida desde la ventana de coalescencia ({key})")
+            else:
+                result = await self._run_leader_or_wait(
+                    key, factory, result_ttl_seconds or self.window_seconds, fingerprint
+                )
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            # Los duplicados no deben heredar la cancelación del líder
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Evitar el aviso de "exception was never retrieved" si nadie más esperaba
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _run_leader_or_wait(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[Dict]],
+        result_ttl_seconds: int,
+        fingerprint: Optional[str]
+    ) -> Dict:
+        lock_key = self._lock_key(key)
+        try:
+            acquired = await self.redis.set(lock_key, "1", nx=True, ex=self.lock_ttl_seconds)
+        except Exception as e:
+            # Sin Redis no hay coalescencia entre workers, pero la solicitud continúa
+            logger.error(f"Error tomando el lock de coalescencia {key}: {e}")
+            return await factory()
+
+        if not acquired:
+            # Otro worker ejecuta la misma solicitud: esperar su resultado
+            deadline = time.monotonic() + self.lock_ttl_seconds
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.poll_interval)
+                result = await self._get_result(key, fingerprint)
+                if result is not None:
+                    logger.info(f"Solicitud duplicada coalescida con otro worker ({key})")
+                    return result
+                try:
+                    if not await self.redis.exists(lock_key):
+                        break
+                except Exception:
+                    break
+            # El otro worker falló sin publicar resultado: ejecutar aquí
+            return await factory()
+
+        try:
+            result = await factory()
+            try:
+                await self.redis.setex(self._result_key(key), result_ttl_seconds, json.dumps({
+                    "fingerprint": fingerprint,
+                    "result": result
+                }))
+            except Exception as e:
+                logger.error(f"Error guardando resultado coalescido {key}: {e}")
+            return result
+        finally:
+            try:
+                await self.redis.delete(lock_key)
+            except Exception as e:
+                logger.error(f"Error liberando el lock de coalescencia {key}: {e}")
+
+
+request_coalescer = RequestCoalescer(
+    redis_client,
+    window_seconds=settings.CHAT_COALESCE_WINDOW_SECONDS,
+    enabled=settings.CHAT_COALESCE_ENABLED
+)
@@ -0,0 +1,61 @@
+# app/services/retrieval_filters.py
+
+from typing import Dict, List, Optional
+
+
+def _eq(key: str, value) -> Dict:
+    return {"type": "eq", "key": key, "value": value}
+
+
+def _any_of(key: str, values: List) -> Dict:
+    """Filtro "key IN values" expresado como un `or` de igualdades."""
+    if len(values) == 1:
+        return _eq(key, values[0])
+    return {"type": "or", "filters": [_eq(key, value) for value in values]}
+
+
+def build_file_search_filters(
+    user_id: int,
+    file_ids: Optional[List[int]] = None,
+    manual_entry_ids: Optional[List[int]] = None,
+    sections: Optional[List[str]] = None
+) -> Optional[Dict]:
+    """
+    Construye los filtros de atributos para la herramienta `file_search` a partir de
+    los archivos, cargas manuales y secciones seleccionados en la solicitud.
+
+    Los atributos (user_id, section, source_type, source_id) se registran al subir
+    cada archivo al vector store. Los archivos subidos antes de registrar atributos no
+    los tienen, así que solo se filtra cuando la solicitud acota la búsqueda; sin
+    selección se retorna None y se busca en todo el vector store, como hasta ahora.
+    """
+    file_ids = sorted(set(file_ids or []))
+    manual_entry_ids = sorted(set(manual_entry_ids or []))
+    sections = sorted(set(sections or []))
+
+    if not (file_ids or manual_entry_ids or sections):
+        return None
+
+    filters: List[Dict] = [_eq("user_id", user_id)]
+
+    # Archivos y cargas manuales seleccionados: cualquiera de ellos
+    sources: List[Dict] = []
+    if file_ids:
+        sources.append({
+            "type": "and",
+            "filters": [_eq("source_type", "file"), _any_of("source_id", file_ids)]
+        })
+    if manual_entry_ids:
+        sources.append({
+            "type": "and",
+            "filters": [_eq("source_type", "manual"), _any_of("source_id", manual_entry_ids)]
+        })
+    if len(sources) == 1:
+        filters.append(sources[0])
+    elif sources:
+        filters.append({"type": "or", "filters": sources})
+
+    if sections:
+        filters.append(_any_of("section", sections))
+
+    return {"type": "and", "filters": filters}
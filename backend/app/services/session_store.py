@@ -0,0 +1,179 @@
+# app/services/session_store.py
+
+import secrets
+import time
+from typing import Dict, List, Optional
+from redis.asyncio import Redis
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.services import redis_client
+from app.services.principal_cache import principal_cache, PrincipalCache
+
+# Crea la sesión y la registra en el índice del usuario (ZSET por fecha de creación).
+# Si el usuario supera el máximo de sesiones se eliminan las más antiguas.
+# KEYS: hash de la sesión, índice del usuario; ARGV: sid, user_id, ahora, ttl, máximo, prefijo.
+# Retorna los sids desalojados.
+CREATE_SCRIPT = """
+local session_key = KEYS[1]
+local index_key = KEYS[2]
+local sid = ARGV[1]
+local now = ARGV[3]
+local ttl = tonumber(ARGV[4])
+local max_sessions = tonumber(ARGV[5])
+
+redis.call('HSET', session_key, 'user_id', ARGV[2], 'created_at', now, 'last_seen', now)
+redis.call('EXPIRE', session_key, ttl)
+redis.call('ZADD', index_key, now, sid)
+
+local evicted = {}
+local extra = redis.call('ZCARD', index_key) - max_sessions
+if max_sessions > 0 and extra > 0 then
+    evicted = redis.call('ZRANGE', index_key, 0, extra - 1)
+    for _, old in ipairs(evicted) do
+        redis.call('DEL', ARGV[6] .. old)
+    end
+    redis.call('ZREMRANGEBYRANK', index_key, 0, extra - 1)
+end
+redis.call('EXPIRE', index_key, ttl)
+return evicted
+"""
+
+# Valida que la sesión exista y pertenezca al usuario; si es así renueva su TTL
+# (expiración deslizante) y el del índice. KEYS: hash, índice; ARGV: user_id, ahora, ttl.
+TOUCH_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'user_id') ~= ARGV[1] then
+    return 0
+end
+local ttl = tonumber(ARGV[3])
+redis.call('HSET', KEYS[1], 'last_seen', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ttl)
+if redis.call('TTL', KEYS[2]) < ttl then
+    redis.call('EXPIRE', KEYS[2], ttl)
+end
+return 1
+"""
+
+
+class SessionStore:
+    """
+    Sesiones de login en Redis, identificadas por el claim `sid` del JWT.
+
+    Cada sesión es un hash pequeño (`session:{sid}`: user_id, created_at, last_seen)
+    con expiración deslizante: cada validación renueva el TTL a `idle_ttl_seconds`,
+    sin superar la expiración del token. El índice `user_sessions:{user_id}` (ZSET
+    por fecha de creación) permite varias sesiones simultáneas por usuario, limitar
+    su número y revocarlas todas de una vez.
+
+    La validación solo ocurre cuando la caché de principales no tiene el token, así
+    que la renovación del TTL queda acotada a una por token cada
+    PRINCIPAL_CACHE_TTL_SECONDS por worker. Las revocaciones invalidan esa caché en
+    todos los workers.
+    """
+
+    SESSION_PREFIX = "session:"
+    INDEX_PREFIX = "user_sessions:"
+
+    def __init__(
+        self,
+        redis: Redis,
+        principals: PrincipalCache,
+        idle_ttl_seconds: int = 8 * 3600,
+        max_sessions_per_user: int = 10
+    ):
+        self.redis = redis
+        self.principals = principals
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_sessions_per_user = max_sessions_per_user
+        self._create = self.redis.register_script(CREATE_SCRIPT)
+        self._touch = self.redis.register_script(TOUCH_SCRIPT)
+
+    def _key(self, sid: str) -> str:
+        return f"{self.SESSION_PREFIX}{sid}"
+
+    def _index_key(self, user_id: int) -> str:
+        return f"{self.INDEX_PREFIX}{user_id}"
+
+    def _ttl(self, token_exp: Optional[float]) -> int:
+        if token_exp is None:
+            return self.idle_ttl_seconds
+        return max(1, min(self.idle_ttl_seconds, int(token_exp - time.time())))
+
+    async def create(self, user_id: int, token_exp: Optional[float] = None) -> str:
+        """Registra una nueva sesión del usuario y retorna su id (claim `sid`)."""
+        sid = secrets.token_urlsafe(24)
+        evicted = await self._create(
+            keys=[self._key(sid), self._index_key(user_id)],
+            args=[
+                sid, user_id, time.time(), self._ttl(token_exp),
+                self.max_sessions_per_user, self.SESSION_PREFIX
+            ]
+        )
+        if evicted:
+            logger.info(f"Usuario {user_id}: {len(evicted)} sesiones antiguas cerradas por límite de sesiones")
+            self.principals.invalidate_user(user_id)
+        return sid
+
+    async def validate(self, sid: Optional[str], user_id: int, token_exp: Optional[float] = None) -> bool:
+        """Comprueba que la sesión siga activa y renueva su expiración."""
+        if not sid:
+            return False
+        try:
+            return bool(await self._touch(
+                keys=[self._key(sid), self._index_key(user_id)],
+                args=[user_id, time.time(), self._ttl(token_exp)]
+            ))
+        except Exception as e:
+            logger.error(f"Error validando la sesión {sid[:8]}… del usuario {user_id}: {e}")
+            return False
+
+    async def list(self, user_id: int) -> List[Dict]:
+        """Sesiones activas del usuario, de la más reciente a la más antigua."""
+        sids = await self.redis.zrevrange(self._index_key(user_id), 0, -1)
+        if not sids:
+            return []
+        pipeline = self.redis.pipeline(transaction=False)
+        for sid in sids:
+            pipeline.hmget(self._key(sid), "created_at", "last_seen")
+        sessions, expired = [], []
+        for sid, (created_at, last_seen) in zip(sids, await pipeline.execute()):
+            if created_at is None:
+                expired.append(sid)
+                continue
+            sessions.append({
+                "session_id": sid,
+                "created_at": float(created_at),
+                "last_seen": float(last_seen)
+            })
+        if expired:
+            # Sesiones que expiraron por inactividad: limpiar el índice
+            await self.redis.zrem(self._index_key(user_id), *expired)
+        return sessions
+
+    async def revoke(self, user_id: int, sid: str) -> bool:
+        """Cierra una sesión. Retorna si existía."""
+        pipeline = self.redis.pipeline()
+        pipeline.delete(self._key(sid))
+        pipeline.zrem(self._index_key(user_id), sid)
+        deleted, _ = await pipeline.execute()
+        self.principals.invalidate_user(user_id)
+        return bool(deleted)
+
+    async def revoke_all(self, user_id: int, keep_sid: Optional[str] = None) -> int:
+        """Cierra todas las sesiones del usuario (salvo `keep_sid`). Retorna cuántas cerró."""
+        index_key = self._index_key(user_id)
+        sids = [sid for sid in await self.redis.zrange(index_key, 0, -1) if sid != keep_sid]
+        if sids:
+            pipeline = self.redis.pipeline()
+            pipeline.unlink(*[self._key(sid) for sid in sids])
+            pipeline.zrem(index_key, *sids)
+            await pipeline.execute()
+        self.principals.invalidate_user(user_id)
+        return len(sids)
+
+
+session_store = SessionStore(
+    redis_client,
+    principal_cache,
+    idle_ttl_seconds=settings.SESSION_IDLE_TTL_SECONDS,
+    max_sessions_per_user=settings.SESSION_MAX_PER_USER
+)
@@ -0,0 +1,140 @@
+# app/services/tokenizer.py
+
+import threading
+import time
+from typing import Dict, List, Optional
+import tiktoken
+from loguru import logger
+
+DEFAULT_MODEL = "gpt-4o"
+
+# Un token BPE siempre cubre al menos un byte UTF-8 y un carácter ocupa como
+# máximo 4 bytes, así que len(text) * 4 es una cota superior barata del número de tokens.
+MAX_BYTES_PER_CHAR = 4
+
+# Tamaño (en caracteres por token de presupuesto) de la primera ventana
+# que se codifica al truncar textos largos
+TRUNCATE_WINDOW_CHARS_PER_TOKEN = 6
+
+# Espera antes de reintentar la carga de un encoder que falló (p. ej. sin red para
+# descargar el BPE); mientras tanto se usa la estimación por palabras
+ENCODER_RETRY_SECONDS = 60.0
+
+
+# Encoders cargados y, para los que fallaron, el momento a partir del cual reintentar
+_encoders: Dict[str, tiktoken.Encoding] = {}
+_retry_at: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def _load_encoder(model: str) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def get_encoder(model: str = DEFAULT_MODEL) -> Optional[tiktoken.Encoding]:
+    """
+    Retorna el encoder de tiktoken para el modelo, cacheado a nivel de proceso.
+    Retorna None si tiktoken no puede resolver el encoder; solo se cachean las cargas
+    exitosas y, tras un fallo, se reintenta pasados ENCODER_RETRY_SECONDS.
+    """
+    encoder = _encoders.get(model)
+    if encoder is not None:
+        return encoder
+    if time.monotonic() < _retry_at.get(model, 0.0):
+        return None
+    with _lock:
+        encoder = _encoders.get(model)
+        if encoder is not None:
+            return encoder
+        try:
+            encoder = _load_encoder(model)
+        except Exception as e:
+            _retry_at[model] = time.monotonic() + ENCODER_RETRY_SECONDS
+            logger.error(f"No se pudo cargar el encoder de tiktoken para {model}: {e}")
+            return None
+        _encoders[model] = encoder
+        _retry_at.pop(model, None)
+        return encoder
+
+
+def token_upper_bound(text: str) -> int:
+    """Cota superior del número de tokens de un texto sin codificarlo."""
+    return len(text) * MAX_BYTES_PER_CHAR
+
+
+def _estimate_tokens(text: str) -> int:
+    # Estimación aproximada si tiktoken falla
+    return int(len(text.split()) * 1.3)
+
+
+def count_tokens(text: str, model: str = DEFAULT_MODEL) -> int:
+    """Cuenta los tokens de un texto usando el encoder cacheado."""
+    if not text:
+        return 0
+    encoder = get_encoder(model)
+    if encoder is None:
+        return _estimate_tokens(text)
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def count_tokens_batch(texts: List[str], model: str = DEFAULT_MODEL) -> List[int]:
+    """
+    Cuenta los tokens de varios textos en una sola llamada.
+    tiktoken codifica el lote en paralelo fuera del GIL.
+    """
+    if not texts:
+        return []
+    encoder = get_encoder(model)
+    if encoder is None:
+        return [_estimate_tokens(text) for text in texts]
+    encoded = encoder.encode_batch(list(texts), disallowed_special=())
+    return [len(tokens) for tokens in encoded]
+
+
+def truncate_to_token_limit(text: str, max_tokens: int, model: str = DEFAULT_MODEL) -> str:
+    """
+    Trunca un texto a un número máximo de tokens.
+
+    Los textos cuya cota superior cabe en el presupuesto se devuelven sin codificar.
+    Los textos largos se codifican por ventanas crecientes de prefijo, deteniéndose
+    en cuanto se supera el presupuesto, en lugar de codificar el texto completo.
+    """
+    if max_tokens <= 0:
+        return ""
+    if not text:
+        return text
+
+    # Pre-chequeo barato: imposible que supere el límite
+    if token_upper_bound(text) <= max_tokens:
+        return text
+
+    encoder = get_encoder(model)
+    if encoder is None:
+        # Estimación muy aproximada si falla
+        words = text.split()
+        estimated_words = int(max_tokens / 1.3)
+        if len(words) <= estimated_words:
+            return text
+        return " ".join(words[:estimated_words]) + " [texto truncado...]"
+
+    window = max_tokens * TRUNCATE_WINDOW_CHARS_PER_TOKEN
+    while True:
+        if window >= len(text):
+            tokens = encoder.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text
+            return encoder.decode(tokens[:max_tokens])
+
+        # Cortar la ventana en un espacio para no partir una palabra a la mitad,
+        # lo que alteraría la tokenización del último fragmento
+        cut = text.rfind(" ", 0, window)
+        if cut <= 0:
+            cut = window
+        tokens = encoder.encode(text[:cut], disallowed_special=())
+        if len(tokens) > max_tokens:
+            return encoder.decode(tokens[:max_tokens])
+        window *= 2
+
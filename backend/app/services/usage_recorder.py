@@ -0,0 +1,164 @@
+# app/services/usage_recorder.py
+
+import asyncio
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+from redis import Redis
+from sqlalchemy import insert
+from app.core.config import settings
+from app.core.logger import logger, get_audit_logger
+from app.core.services import sync_redis_client
+from app.database.models.session import SessionLocal
+from app.database.models.token_usage import TokenUsage
+from app.services.gpt_tracker import GPTTokenTracker
+
+audit_logger = get_audit_logger()
+
+
+class UsageRecorder:
+    """
+    Registro write-behind del uso de tokens.
+
+    `record` solo calcula costos y encola el registro en memoria, sin I/O. Una tarea
+    de fondo vacía el buffer cuando alcanza `flush_size` registros o cada
+    `flush_interval` segundos: un único INSERT multi-fila en token_usage y un único
+    pipeline de Redis con los contadores ya agregados por API Key, modelo y día.
+    El buffer está acotado; si se llena se descartan los registros más antiguos.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        tracker: GPTTokenTracker,
+        max_buffer: int = 10000,
+        flush_size: int = 200,
+        flush_interval: float = 2.0
+    ):
+        self.redis = redis
+        self.tracker = tracker
+        self.max_buffer = max_buffer
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        # Cada elemento: (api_key, día, fila de token_usage)
+        self._buffer: Deque[Tuple[str, str, Dict]] = deque()
+        self._dropped = 0
+        self._flush_requested: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def record(
+        self,
+        user_id: int,
+        api_key: str,
+        model: str,
+        input_tokens: int,
+        output_tokens: int,
+        endpoint: str
+    ) -> Dict:
+        """Encola un registro de uso con los tokens reportados por el proveedor."""
+        row = self.tracker.build_usage_row(user_id, model, input_tokens, output_tokens, endpoint)
+
+        if len(self._buffer) >= self.max_buffer:
+            self._buffer.popleft()
+            self._dropped += 1
+            if self._dropped % 100 == 1:
+                logger.warning(f"Buffer de uso lleno: {self._dropped} registros descartados")
+
+        self._buffer.append((api_key, datetime.now().strftime("%Y-%m-%d"), row))
+        if len(self._buffer) >= self.flush_size and self._flush_requested is not None:
+            self._flush_requested.set()
+        return row
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._flush_requested = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info("UsageRecorder iniciado")
+
+    async def stop(self) -> None:
+        """Detiene la tarea de fondo y vacía lo que quede en el buffer."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        logger.info("UsageRecorder detenido, buffer vaciado")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error vaciando el buffer de uso: {e}")
+
+    async def flush(self) -> None:
+        if not self._buffer:
+            return
+        batch = [self._buffer.popleft() for _ in range(min(len(self._buffer), self.max_buffer))]
+        try:
+            # La escritura es bloqueante (SQLAlchemy/Redis síncronos): fuera del event loop
+            await asyncio.to_thread(self._write, batch)
+        except Exception as e:
+            logger.error(f"Error persistiendo {len(batch)} registros de uso: {e}")
+            # Reencolar para el próximo intento sin superar el límite del buffer
+            room = self.max_buffer - len(self._buffer)
+            self._buffer.extendleft(reversed(batch[:room]))
+
+    def _write(self, batch: List[Tuple[str, str, Dict]]) -> None:
+        rows = [row for _, _, row in batch]
+
+        db = SessionLocal()
+        try:
+            db.execute(insert(TokenUsage), rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        # Agregar por (api_key, modelo, día) antes de tocar Redis
+        totals: Dict[Tuple[str, str, str], Dict] = {}
+        for api_key, day, row in batch:
+            agg = totals.setdefault((api_key, row["model"], day), {
+                "input_tokens": 0, "output_tokens": 0, "total_tokens": 0,
+                "input_zaaps": 0.0, "output_zaaps": 0.0, "total_zaaps": 0.0,
+                "requests": 0
+            })
+            for field in ("input_tokens", "output_tokens", "total_tokens",
+                          "input_zaaps", "output_zaaps", "total_zaaps"):
+                agg[field] += row[field]
+            agg["requests"] += 1
+
+        # Las filas ya están en la base de datos: un fallo de Redis no debe reencolarlas
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            for (api_key, model, day), agg in totals.items():
+                self.tracker.add_counters_to_pipeline(pipeline, api_key, model, day, agg)
+            pipeline.execute()
+        except Exception as e:
+            logger.error(f"Error actualizando contadores de uso en Redis: {e}")
+
+        audit_logger.info(
+            f"GPT usage flushed - Registros: {len(rows)}, "
+            f"Tokens: {sum(r['total_tokens'] for r in rows)}, "
+            f"Cost: ${sum(r['cost'] for r in rows):.4f}"
+        )
+
+
+usage_recorder = UsageRecorder(
+    sync_redis_client,
+    GPTTokenTracker(sync_redis_client),
+    max_buffer=settings.USAGE_BUFFER_MAX,
+    flush_size=settings.USAGE_FLUSH_SIZE,
+    flush_interval=settings.USAGE_FLUSH_INTERVAL_SECONDS
+)
@@ -4,26 +4,16 @@ from typing import Optional, Dict, Tuple
 from app.database.models.user import User, LicenseTypeSQLA
 from app.database.models.company import Company
 from app.schemas.user import UserCreate, LicenseTypeEnum
-from app.core.security import get_password_hash, generate_api_key
-import redis
+from app.core.security import generate_api_key
+from app.services.password_hasher import password_hasher
 from app.core.config import settings
-import json
-from loguru import logger
+from app.core.services import redis_client
+from app.core.logger import logger
 from app.services.email import FastapiMailService
 import random
 import string
 from datetime import datetime, timedelta
 
-redis_client = redis.Redis(
-    host=settings.REDIS_HOST,
-    port=settings.REDIS_PORT,
-    db=settings.REDIS_DB,
-    password=settings.REDIS_PASSWORD,
-    decode_responses=True 
-)
-
-logger.add("logs/user_service.log", rotation="500 MB")
-
 class UserService:
     @staticmethod
     async def create_user(db: Session, user_data: UserCreate) -> User:
@@ -42,6 +32,9 @@ class UserService:
                 if not password:
                     raise HTTPException(status_code=400, detail="No password provided")
 
+            # bcrypt corre en el pool acotado (503 si está saturado), antes de tocar la base
+            hashed_password = await password_hasher.hash(password)
+
             # Buscamos o creamos la empresa según su nombre
             company = db.query(Company).filter(Company.name == user_data.company).first()
             if not company:
@@ -59,7 +52,7 @@ class UserService:
 
             db_user = User(
                 email=user_data.email,
-                hashed_password=get_password_hash(password),
+                hashed_password=hashed_password,
                 full_name=user_data.full_name,
                 country=user_data.country,
                 division=user_data.division,
@@ -83,6 +76,9 @@ class UserService:
 
             return db_user
 
+        except HTTPException:
+            db.rollback()
+            raise
         except Exception as e:
             db.rollback()
             logger.error(f"Error creating user: {str(e)}")
@@ -133,7 +129,7 @@ class UserService:
                 
                 # Almacenar la contraseña en texto plano en Redis para que el admin pueda acceder a ella
                 redis_key = f"pilot_password:{user_data['email']}"
-                redis_client.setex(
+                await redis_client.setex(
                     redis_key,
                     60 * 60 * 24 * 7,  # 7 días en segundos
                     generated_password
@@ -162,33 +158,11 @@ class UserService:
                 raise HTTPException(status_code=500, detail=f"Error en registro de usuario piloto: {str(e)}")
     
     @staticmethod
-    def get_user_password(email: str) -> Optional[str]:
+    async def get_user_password(email: str) -> Optional[str]:
         """Recupera la contraseña del usuario piloto almacenada"""
         key = f"pilot_password:{email}"
-        return redis_client.get(key)
+        return await redis_client.get(key)
 
     @staticmethod
     def get_user_by_email(db: Session, email: str) -> Optional[User]:
         return db.query(User).filter(User.email == email).first()
-
-    @staticmethod
-    def store_user_session(user_id: int, session_data: Dict, expires: int = 86400) -> None:
-        key = f"user_session:{user_id}"
-        try:
-            redis_client.setex(key, expires, json.dumps(session_data))
-        except Exception as e:
-            logger.error(f"Error storing session in Redis: {str(e)}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Error al almacenar la sesión"
-            )
-
-    @staticmethod
-    def get_user_session(user_id: int) -> Optional[Dict]:
-        key = f"user_session:{user_id}"
-        try:
-            data = redis_client.get(key)
-            return json.loads(data) if data else None
-        except Exception as e:
-            logger.error(f"Error retrieving session from Redis: {str(e)}")
-            return None
\ No newline at end of file
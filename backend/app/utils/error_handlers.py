@@ -5,7 +5,8 @@ from starlette.responses import JSONResponse
 async def http_error_handler(request: Request, exc: HTTPException):
     return JSONResponse(
         status_code=exc.status_code,
-        content={"detail": exc.detail}
+        content={"detail": exc.detail},
+        headers=getattr(exc, "headers", None)
     )
 
 class CustomException(Exception):
@@ -0,0 +1,201 @@
+# loadtest/mock_openai.py
+"""
+API de OpenAI simulada para pruebas de carga.
+
+Implementa los endpoints que usa el backend (Responses API con y sin streaming,
+embeddings y chat completions) con latencia, errores 5xx y 429 configurables, y
+devuelve encabezados x-ratelimit-* coherentes con un presupuesto de solicitudes
+por minuto. Se configura con variables de entorno:
+
+    MOCK_LATENCY_MS        latencia media hasta la respuesta/primer byte (300)
+    MOCK_JITTER_MS         variación uniforme de la latencia (100)
+    MOCK_STREAM_CHUNKS     deltas emitidos por respuesta en streaming (20)
+    MOCK_CHUNK_DELAY_MS    pausa entre deltas (20)
+    MOCK_ERROR_RATE        proporción de respuestas 500 (0.0)
+    MOCK_RATE_LIMIT_RATE   proporción de respuestas 429 aleatorias (0.0)
+    MOCK_RPM               solicitudes por minuto antes de responder 429 (100000)
+    MOCK_OUTPUT_TOKENS     tokens de salida reportados en usage (120)
+
+Uso:
+    uvicorn loadtest.mock_openai:app --port 9100
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+LATENCY_MS = float(os.getenv("MOCK_LATENCY_MS", "300"))
+JITTER_MS = float(os.getenv("MOCK_JITTER_MS", "100"))
+STREAM_CHUNKS = int(os.getenv("MOCK_STREAM_CHUNKS", "20"))
+CHUNK_DELAY_MS = float(os.getenv("MOCK_CHUNK_DELAY_MS", "20"))
+ERROR_RATE = float(os.getenv("MOCK_ERROR_RATE", "0"))
+RATE_LIMIT_RATE = float(os.getenv("MOCK_RATE_LIMIT_RATE", "0"))
+RPM = int(os.getenv("MOCK_RPM", "100000"))
+OUTPUT_TOKENS = int(os.getenv("MOCK_OUTPUT_TOKENS", "120"))
+
+ANSWER = (
+    "Gracias por tu consulta. Según la información disponible, el producto cuenta con "
+    "envío a todo el país, garantía de un año y soporte técnico incluido. "
+    "¿Te gustaría que te envíe una cotización?"
+)
+
+app = FastAPI(title="Mock OpenAI")
+
+# Ventana fija de un minuto para el presupuesto de solicitudes
+_window = {"started": time.monotonic(), "count": 0}
+
+
+def _rate_limit_headers() -> dict:
+    now = time.monotonic()
+    if now - _window["started"] >= 60:
+        _window["started"], _window["count"] = now, 0
+    _window["count"] += 1
+    reset = max(0.0, 60 - (now - _window["started"]))
+    return {
+        "x-ratelimit-limit-requests": str(RPM),
+        "x-ratelimit-remaining-requests": str(max(0, RPM - _window["count"])),
+        "x-ratelimit-reset-requests": f"{reset:.3f}s",
+        "x-request-id": f"req_{uuid.uuid4().hex}"
+    }
+
+
+async def _simulate(request_kind: str):
+    """Aplica latencia y, según la configuración, retorna una respuesta de error."""
+    headers = _rate_limit_headers()
+    await asyncio.sleep(max(0.0, LATENCY_MS + random.uniform(-JITTER_MS, JITTER_MS)) / 1000)
+
+    if int(headers["x-ratelimit-remaining-requests"]) <= 0 or random.random() < RATE_LIMIT_RATE:
+        return headers, JSONResponse(
+            status_code=429,
+            headers={**headers, "retry-after": "1"},
+            content={"error": {
+                "message": f"Rate limit reached for requests ({request_kind}). Please try again in 1.000s.",
+                "type": "requests",
+                "code": "rate_limit_exceeded",
+                "param": None
+            }}
+        )
+    if random.random() < ERROR_RATE:
+        return headers, JSONResponse(
+            status_code=500,
+            headers=headers,
+            content={"error": {"message": "Mock server error", "type": "server_error", "code": None, "param": None}}
+        )
+    return headers, None
+
+
+def _response_object(body: dict, text: str) -> dict:
+    input_tokens = len(json.dumps(body.get("input", ""))) // 4
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "status": "completed",
+        "model": body.get("model", "gpt-4o"),
+        "output": [{
+            "type": "message",
+            "id": f"msg_{uuid.uuid4().hex}",
+            "role": "assistant",
+            "status": "completed",
+            "content": [{"type": "output_text", "text": text, "annotations": []}]
+        }],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": body.get("tools", []),
+        "temperature": body.get("temperature"),
+        "top_p": body.get("top_p"),
+        "max_output_tokens": body.get("max_output_tokens"),
+        "previous_response_id": body.get("previous_response_id"),
+        "error": None,
+        "incomplete_details": None,
+        "instructions": body.get("instructions"),
+        "metadata": {},
+        "usage": {
+            "input_tokens": input_tokens,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": OUTPUT_TOKENS,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": input_tokens + OUTPUT_TOKENS
+        }
+    }
+
+
+def _sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+@app.post("/v1/responses")
+async def create_response(request: Request):
+    body = await request.json()
+    headers, error = await _simulate("responses")
+    if error is not None:
+        return error
+
+    if not body.get("stream"):
+        return JSONResponse(_response_object(body, ANSWER), headers=headers)
+
+    async def events():
+        response = _response_object(body, ANSWER)
+        item_id = response["output"][0]["id"]
+        sequence = 0
+        yield _sse({"type": "response.created", "sequence_number": sequence,
+                    "response": {**response, "status": "in_progress", "output": []}})
+        words = ANSWER.split(" ")
+        size = max(1, len(words) // STREAM_CHUNKS)
+        for start in range(0, len(words), size):
+            sequence += 1
+            delta = " ".join(words[start:start + size]) + " "
+            yield _sse({"type": "response.output_text.delta", "sequence_number": sequence,
+                        "item_id": item_id, "output_index": 0, "content_index": 0, "delta": delta})
+            await asyncio.sleep(CHUNK_DELAY_MS / 1000)
+        yield _sse({"type": "response.completed", "sequence_number": sequence + 1, "response": response})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+
+@app.post("/v1/embeddings")
+async def create_embeddings(request: Request):
+    body = await request.json()
+    headers, error = await _simulate("embeddings")
+    if error is not None:
+        return error
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    dimensions = body.get("dimensions") or 1536
+    data = []
+    for index, text in enumerate(inputs):
+        # Vector determinista por texto: la misma pregunta produce el mismo embedding
+        rng = random.Random(hash(str(text)))
+        data.append({"object": "embedding", "index": index,
+                     "embedding": [rng.uniform(-1, 1) for _ in range(dimensions)]})
+    tokens = sum(len(str(text)) // 4 for text in inputs)
+    return JSONResponse({
+        "object": "list",
+        "data": data,
+        "model": body.get("model", "text-embedding-3-small"),
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+    }, headers=headers)
+
+
+@app.post("/v1/chat/completions")
+async def create_chat_completion(request: Request):
+    body = await request.json()
+    headers, error = await _simulate("chat.completions")
+    if error is not None:
+        return error
+    return JSONResponse({
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-3.5-turbo"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "[]"},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 2, "total_tokens": 102}
+    }, headers=headers)
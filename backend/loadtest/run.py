@@ -0,0 +1,330 @@
+# loadtest/run.py
+"""
+Prueba de carga del chat contra la API de OpenAI simulada.
+
+Levanta `loadtest.mock_openai` y la aplicación (uvicorn app.main:app) apuntando
+OPENAI_BASE_URL al mock, registra e inicia sesión con un conjunto de cuentas de
+prueba y simula usuarios concurrentes que conversan con /api/v1/chat. Reporta
+latencia p50/p95/p99, throughput, errores por código y el retraso del event loop
+de la aplicación (muestreado desde /status).
+
+Requiere Postgres y Redis accesibles con la configuración del .env (por ejemplo,
+`docker-compose up -d postgres redis`).
+
+Uso (desde backend/):
+    python -m loadtest.run --scenario smoke
+    python -m loadtest.run --scenario steady --update-baseline
+    python -m loadtest.run --scenario steady --check     # código de salida 1 si hay regresión
+    python -m loadtest.run --scenario smoke --base-url http://localhost:8000  # app ya levantada
+
+`make loadtest-baseline` regenera loadtest/baselines.json (se versiona junto al
+cambio que la motiva) y `make loadtest-check` compara todos los escenarios con ella.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+BASELINE_FILE = Path(__file__).resolve().parent / "baselines.json"
+
+# users: usuarios simulados; accounts: cuentas reales entre las que se reparten
+SCENARIOS: Dict[str, Dict] = {
+    "smoke": {
+        "users": 50, "accounts": 10, "duration": 30, "ramp_up": 5, "think_time": 1.0,
+        "endpoint": "/api/v1/chat/", "mock": {"MOCK_LATENCY_MS": "300"}
+    },
+    "steady": {
+        "users": 1000, "accounts": 100, "duration": 120, "ramp_up": 30, "think_time": 2.0,
+        "endpoint": "/api/v1/chat/", "mock": {"MOCK_LATENCY_MS": "800", "MOCK_JITTER_MS": "300"}
+    },
+    "stream": {
+        "users": 500, "accounts": 50, "duration": 120, "ramp_up": 20, "think_time": 2.0,
+        "endpoint": "/api/v1/chat/stream", "mock": {"MOCK_LATENCY_MS": "400", "MOCK_CHUNK_DELAY_MS": "30"}
+    },
+    "degraded": {
+        "users": 500, "accounts": 50, "duration": 90, "ramp_up": 10, "think_time": 1.0,
+        "endpoint": "/api/v1/chat/",
+        "mock": {"MOCK_LATENCY_MS": "1500", "MOCK_JITTER_MS": "1000",
+                 "MOCK_ERROR_RATE": "0.05", "MOCK_RATE_LIMIT_RATE": "0.10"}
+    },
+}
+
+# Las cuentas de prueba comparten presupuesto de tokens: se desactiva el rate limiting
+# por usuario para medir la capacidad del worker y no el límite configurado
+APP_ENV = {
+    "RATE_LIMIT_ENABLED": "false",
+    "OPENAI_API_KEY": "sk-loadtest",
+}
+
+MESSAGES = [
+    "¿Qué productos tienen disponibles?",
+    "¿Cuál es el precio del plan anual?",
+    "¿Hacen envíos a regiones?",
+    "¿Qué garantía tiene el producto?",
+    "Quiero una cotización para 20 unidades",
+    "¿Tienen soporte técnico los fines de semana?",
+]
+
+# Tolerancias para --check respecto de la línea base
+LATENCY_TOLERANCE = 1.25     # p50/p95/p99 hasta +25%
+THROUGHPUT_TOLERANCE = 0.80  # throughput hasta -20%
+ERROR_RATE_SLACK = 0.02      # tasa de errores hasta +2 puntos
+LOOP_LAG_TOLERANCE = 1.50    # p99 del retraso del event loop hasta +50%
+
+
+# ----------------------------------------------------------------------
+# Procesos
+# ----------------------------------------------------------------------
+def start_process(args: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", *args],
+        cwd=BACKEND_DIR,
+        env={**os.environ, **env},
+    )
+
+
+async def wait_ready(url: str, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url, timeout=2)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"{url} no respondió en {timeout:.0f}s")
+
+
+# ----------------------------------------------------------------------
+# Cuentas de prueba
+# ----------------------------------------------------------------------
+async def login_accounts(client: httpx.AsyncClient, count: int) -> List[str]:
+    """Registra (si no existen) e inicia sesión con las cuentas de prueba; retorna sus tokens."""
+    semaphore = asyncio.Semaphore(20)
+
+    async def login(index: int) -> str:
+        email = f"loadtest+{index}@example.com"
+        password = "LoadTest-123"
+        async with semaphore:
+            await client.post("/api/v1/users/register", json={
+                "email": email, "full_name": f"Load Test {index}", "country": "CL",
+                "division": "QA", "company": "LoadTest", "license_type": "LEADER",
+                "phone": "000000000", "password": password, "password_confirm": password
+            })
+            response = await client.post("/api/v1/users/token", data={"username": email, "password": password})
+            response.raise_for_status()
+            return response.json()["access_token"]
+
+    return await asyncio.gather(*(login(i) for i in range(count)))
+
+
+# ----------------------------------------------------------------------
+# Usuarios simulados
+# ----------------------------------------------------------------------
+class Results:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.statuses: Counter = Counter()
+        self.loop_lag_p99: List[float] = []
+        self.loop_lag_max = 0.0
+
+
+async def send_chat(client: httpx.AsyncClient, endpoint: str, token: str, message: str) -> int:
+    headers = {"Authorization": f"Bearer {token}"}
+    payload = {"message": message}
+    if not endpoint.endswith("/stream"):
+        return (await client.post(endpoint, json=payload, headers=headers)).status_code
+
+    # En streaming la solicitud termina al recibir el evento `done` (o `error`)
+    async with client.stream("POST", endpoint, json=payload, headers=headers) as response:
+        if response.status_code != 200:
+            return response.status_code
+        async for line in response.aiter_lines():
+            if line.startswith("event: error"):
+                return 599
+            if line.startswith("event: done"):
+                break
+    return 200
+
+
+async def virtual_user(
+    client: httpx.AsyncClient,
+    scenario: Dict,
+    token: str,
+    start_delay: float,
+    deadline: float,
+    results: Results
+) -> None:
+    await asyncio.sleep(start_delay)
+    while time.monotonic() < deadline:
+        # Mensajes únicos: se mide el camino completo y no la caché de respuestas
+        message = f"{random.choice(MESSAGES)} (#{random.randrange(10**9)})"
+        started = time.monotonic()
+        try:
+            status = await send_chat(client, scenario["endpoint"], token, message)
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        elapsed = time.monotonic() - started
+        results.statuses[status] += 1
+        if status == 200:
+            results.latencies.append(elapsed)
+        await asyncio.sleep(random.expovariate(1 / scenario["think_time"]))
+
+
+async def sample_loop_lag(client: httpx.AsyncClient, deadline: float, results: Results) -> None:
+    while time.monotonic() < deadline:
+        try:
+            event_loop = (await client.get("/status", timeout=5)).json().get("event_loop", {})
+            results.loop_lag_p99.append(event_loop.get("p99_ms", 0.0))
+            results.loop_lag_max = max(results.loop_lag_max, event_loop.get("max_ms", 0.0))
+        except (httpx.HTTPError, ValueError):
+            pass
+        await asyncio.sleep(1.0)
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+async def run_scenario(name: str, base_url: str) -> Dict:
+    scenario = SCENARIOS[name]
+    limits = httpx.Limits(max_connections=scenario["users"] + 10, max_keepalive_connections=scenario["users"])
+    timeout = httpx.Timeout(120.0, connect=10.0)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        tokens = await login_accounts(client, scenario["accounts"])
+        results = Results()
+        started = time.monotonic()
+        deadline = started + scenario["ramp_up"] + scenario["duration"]
+        tasks = [
+            virtual_user(
+                client, scenario, tokens[i % len(tokens)],
+                scenario["ramp_up"] * i / scenario["users"], deadline, results
+            )
+            for i in range(scenario["users"])
+        ]
+        await asyncio.gather(sample_loop_lag(client, deadline, results), *tasks)
+        elapsed = time.monotonic() - started
+
+    total = sum(results.statuses.values())
+    errors = total - results.statuses.get(200, 0)
+    return {
+        "scenario": name,
+        "users": scenario["users"],
+        "requests": total,
+        "throughput_rps": round(results.statuses.get(200, 0) / elapsed, 2),
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "statuses": {str(k): v for k, v in results.statuses.items()},
+        "latency_ms": {
+            "p50": round(percentile(results.latencies, 0.50) * 1000, 1),
+            "p95": round(percentile(results.latencies, 0.95) * 1000, 1),
+            "p99": round(percentile(results.latencies, 0.99) * 1000, 1),
+        },
+        # Mediana de los p99 reportados por /status durante la prueba
+        "loop_lag_ms": {
+            "p99": round(percentile(results.loop_lag_p99, 0.50), 2),
+            "max": results.loop_lag_max,
+        },
+    }
+
+
+# ----------------------------------------------------------------------
+# Líneas base
+# ----------------------------------------------------------------------
+def load_baselines() -> Dict:
+    if BASELINE_FILE.exists():
+        return json.loads(BASELINE_FILE.read_text(encoding="utf-8"))
+    return {}
+
+
+def check_against_baseline(report: Dict, baseline: Dict) -> List[str]:
+    """Retorna la lista de regresiones respecto de la línea base."""
+    failures = []
+    for key in ("p50", "p95", "p99"):
+        limit = baseline["latency_ms"][key] * LATENCY_TOLERANCE
+        if report["latency_ms"][key] > limit:
+            failures.append(f"latencia {key}: {report['latency_ms'][key]} ms > {limit:.1f} ms")
+    min_throughput = baseline["throughput_rps"] * THROUGHPUT_TOLERANCE
+    if report["throughput_rps"] < min_throughput:
+        failures.append(f"throughput: {report['throughput_rps']} rps < {min_throughput:.2f} rps")
+    max_error_rate = baseline["error_rate"] + ERROR_RATE_SLACK
+    if report["error_rate"] > max_error_rate:
+        failures.append(f"tasa de errores: {report['error_rate']} > {max_error_rate:.4f}")
+    # El retraso base puede ser ~0 ms: se permite al menos 10 ms
+    max_lag = max(baseline["loop_lag_ms"]["p99"] * LOOP_LAG_TOLERANCE, 10.0)
+    if report["loop_lag_ms"]["p99"] > max_lag:
+        failures.append(f"retraso del event loop p99: {report['loop_lag_ms']['p99']} ms > {max_lag:.1f} ms")
+    return failures
+
+
+async def main(args: argparse.Namespace) -> int:
+    scenario = SCENARIOS[args.scenario]
+    processes: List[subprocess.Popen] = []
+    base_url: Optional[str] = args.base_url
+    try:
+        if base_url is None:
+            processes.append(start_process(
+                ["uvicorn", "loadtest.mock_openai:app", "--port", str(args.mock_port), "--log-level", "warning"],
+                scenario["mock"]
+            ))
+            await wait_ready(f"http://127.0.0.1:{args.mock_port}/docs")
+            processes.append(start_process(
+                ["uvicorn", "app.main:app", "--port", str(args.app_port),
+                 "--workers", str(args.workers), "--log-level", "warning"],
+                {**APP_ENV, "OPENAI_BASE_URL": f"http://127.0.0.1:{args.mock_port}/v1"}
+            ))
+            base_url = f"http://127.0.0.1:{args.app_port}"
+            await wait_ready(f"{base_url}/health")
+
+        report = await run_scenario(args.scenario, base_url)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.report:
+        Path(args.report).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    baselines = load_baselines()
+    if args.update_baseline:
+        baselines[args.scenario] = report
+        BASELINE_FILE.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        print(f"Línea base de '{args.scenario}' actualizada en {BASELINE_FILE}")
+
+    if args.check:
+        if args.scenario not in baselines:
+            print(f"No hay línea base para '{args.scenario}'; ejecutar con --update-baseline")
+            return 1
+        failures = check_against_baseline(report, baselines[args.scenario])
+        for failure in failures:
+            print(f"REGRESIÓN {failure}")
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga del chat de NOA")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="smoke")
+    parser.add_argument("--base-url", help="Usar una aplicación ya levantada (no inicia el mock ni la app)")
+    parser.add_argument("--app-port", type=int, default=8765)
+    parser.add_argument("--mock-port", type=int, default=9100)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--report", help="Guardar el reporte JSON en esta ruta")
+    parser.add_argument("--check", action="store_true", help="Comparar con la línea base guardada")
+    parser.add_argument("--update-baseline", action="store_true", help="Guardar el resultado como línea base")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,78 @@
+# tests/conftest.py
+
+import os
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Configuración mínima para importar la aplicación sin .env (no se abre ninguna conexión)
+for name, value in {
+    "POSTGRES_USER": "test",
+    "POSTGRES_PASSWORD": "test",
+    "POSTGRES_DB": "test",
+    "OPENAI_API_KEY": "sk-test",
+    "MAIL_USERNAME": "test",
+    "MAIL_PASSWORD": "test",
+    "MAIL_FROM": "test@example.com",
+}.items():
+    os.environ.setdefault(name, value)
+
+
+@pytest.fixture
+def chat_app(monkeypatch):
+    """
+    Router de chat con los servicios respaldados por Redis y la base reemplazados
+    por dobles en memoria. `send_message` registra sus argumentos en `calls`.
+    """
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.api.endpoints import chat
+    from app.api.endpoints.users import get_current_user
+    from app.database.models.session import get_db
+    from app.services.answer_cache import CachedLookup
+    from app.services.conversation_store import ConversationTracker
+
+    config = SimpleNamespace(system_prompt="Eres NOA", system_prompt_tokens=3, model="gpt4", temperature=0.7)
+    user = SimpleNamespace(id=1, company_id=1, api_key="key-test", email="user@example.com")
+
+    monkeypatch.setattr(chat.settings, "CHAT_CONTEXT_MODE", "legacy")
+    monkeypatch.setattr(chat.settings, "CHAT_RETRIEVAL_MODE", "file_search")
+    monkeypatch.setattr(chat.noa_config_cache, "get", AsyncMock(return_value=config))
+    monkeypatch.setattr(chat.chat_rate_limiter, "acquire", AsyncMock())
+    monkeypatch.setattr(chat.chat_rate_limiter, "refund", AsyncMock())
+    monkeypatch.setattr(chat.conversation_store, "start_turn", AsyncMock(return_value=(ConversationTracker(), False)))
+    monkeypatch.setattr(chat.conversation_store, "update", AsyncMock())
+    monkeypatch.setattr(chat.conversation_store, "reset_history", AsyncMock())
+    monkeypatch.setattr(chat.answer_cache, "lookup", AsyncMock(return_value=CachedLookup(None, None)))
+    monkeypatch.setattr(chat.answer_cache, "store", AsyncMock())
+    monkeypatch.setattr(chat.usage_recorder, "record", MagicMock())
+
+    async def run_directly(key, factory, **kwargs):
+        return await factory()
+    monkeypatch.setattr(chat.request_coalescer, "run", run_directly)
+
+    calls = []
+    state = SimpleNamespace(calls=calls, error=None, user=user, config=config, chat=chat)
+
+    def fake_send_message(**kwargs):
+        calls.append(kwargs)
+        if state.error is not None:
+            raise state.error
+        return SimpleNamespace(
+            id="resp_test",
+            output_text="Hola, ¿en qué puedo ayudarte?",
+            usage=SimpleNamespace(input_tokens=40, output_tokens=10)
+        )
+    monkeypatch.setattr(chat, "send_message", fake_send_message)
+
+    app = FastAPI()
+    app.include_router(chat.router, prefix="/api/v1/chat")
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[get_db] = lambda: None
+    state.client = TestClient(app)
+    return state
@@ -0,0 +1,29 @@
+# tests/test_answer_cache.py
+
+import asyncio
+from types import SimpleNamespace
+
+from app.services.answer_cache import SemanticAnswerCache
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def incr(self, key):
+        self.values[key] = int(self.values.get(key, 0)) + 1
+        return self.values[key]
+
+
+def test_uploads_by_any_tenant_invalidate_the_shared_corpus_scope():
+    cache = SemanticAnswerCache(FakeRedis(), corpus_id="vs_test")
+    config = SimpleNamespace(version="v1")
+
+    before = asyncio.run(cache._scope(1, config))
+    # Otro tenant sube un archivo al vector store compartido
+    asyncio.run(cache.bump_corpus_version(2))
+
+    assert asyncio.run(cache._scope(1, config)) != before
@@ -0,0 +1,65 @@
+# tests/test_api_key_stats.py
+
+import asyncio
+from datetime import datetime, timedelta
+
+from app.services.api_key import APIKeyService
+
+STATS_KEYS = {"total_usage", "window_usage", "granularity", "start", "end", "series", "daily_stats"}
+
+
+class FakeRedis:
+    def __init__(self, values=None, error=None):
+        self.values = values or {}
+        self.error = error
+        self.mget_calls = []
+
+    async def mget(self, keys):
+        self.mget_calls.append(keys)
+        if self.error is not None:
+            raise self.error
+        return [self.values.get(key) for key in keys]
+
+
+def _day(offset: int) -> str:
+    return (datetime.now() - timedelta(days=offset)).strftime(APIKeyService.DAY_FORMAT)
+
+
+def test_usage_stats_include_daily_buckets_for_every_granularity():
+    redis = FakeRedis({
+        "usage:key": "9",
+        f"daily_usage:key:{_day(0)}": "4",
+        f"daily_usage:key:{_day(1)}": "5",
+    })
+    service = APIKeyService(redis)
+
+    for granularity in ("day", "week", "month", "hour"):
+        stats = asyncio.run(service.get_usage_stats("key", days=2, granularity=granularity))
+        assert set(stats) == STATS_KEYS
+        assert stats["granularity"] == granularity
+        assert list(stats["daily_stats"].items()) == [(_day(0), 4), (_day(1), 5)]
+        assert stats["total_usage"] == 9
+
+
+def test_usage_stats_read_every_key_once_in_a_single_mget():
+    redis = FakeRedis()
+    service = APIKeyService(redis)
+
+    for granularity in ("day", "week", "hour"):
+        redis.mget_calls.clear()
+        asyncio.run(service.get_usage_stats("key", days=2, granularity=granularity))
+        assert len(redis.mget_calls) == 1
+        keys = redis.mget_calls[0]
+        assert len(keys) == len(set(keys))
+        assert keys.count("usage:key") == 1
+        assert f"daily_usage:key:{_day(1)}" in keys
+
+
+def test_usage_stats_fallback_keeps_the_same_keys():
+    service = APIKeyService(FakeRedis(error=ConnectionError("redis caído")))
+
+    stats = asyncio.run(service.get_usage_stats("key", days=7, granularity="week"))
+
+    assert set(stats) == STATS_KEYS
+    assert stats["total_usage"] == 0
+    assert stats["series"] == {} and stats["daily_stats"] == {}
@@ -0,0 +1,138 @@
+# tests/test_chat_batch.py
+
+import asyncio
+import json
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from app.services import chat_batch
+from app.services.chat_batch import ChatBatchService
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        return [await getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+class FakeRedis:
+    """Hashes y sets en memoria con las operaciones que usa ChatBatchService."""
+
+    def __init__(self):
+        self.hashes = {}
+        self.sets = {}
+
+    def register_script(self, script):
+        async def set_status(keys, args):
+            job = self.hashes.get(keys[0])
+            if not job or job.get("status") == "cancelled":
+                return 0
+            job.update({args[i]: str(args[i + 1]) for i in range(0, len(args), 2)})
+            return 1
+        assert "cancelled" in script
+        return set_status
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def hset(self, key, field=None, value=None, mapping=None):
+        values = dict(mapping or {})
+        if field is not None:
+            values[field] = value
+        self.hashes.setdefault(key, {}).update({k: str(v) for k, v in values.items()})
+
+    async def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    async def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    async def hkeys(self, key):
+        return list(self.hashes.get(key, {}))
+
+    async def hincrby(self, key, field, amount):
+        job = self.hashes.setdefault(key, {})
+        job[field] = str(int(job.get(field, 0)) + amount)
+
+    async def expire(self, key, seconds):
+        return True
+
+    async def sadd(self, key, member):
+        self.sets.setdefault(key, set()).add(member)
+
+    async def srem(self, key, member):
+        self.sets.get(key, set()).discard(member)
+
+
+def _output_line(index, text):
+    return json.dumps({
+        "custom_id": f"item-{index}",
+        "response": {
+            "status_code": 200,
+            "body": {
+                "output": [{"type": "message", "content": [{"type": "output_text", "text": text}]}],
+                "usage": {"input_tokens": 10, "output_tokens": 5}
+            }
+        }
+    })
+
+
+def _service(monkeypatch, batch_status="completed"):
+    client = SimpleNamespace(
+        batches=SimpleNamespace(
+            retrieve=MagicMock(return_value=SimpleNamespace(
+                status=batch_status, output_file_id="file-out", error_file_id=None
+            )),
+            cancel=MagicMock()
+        ),
+        files=SimpleNamespace(content=MagicMock(return_value=SimpleNamespace(
+            text="\n".join([_output_line(0, "hola"), _output_line(1, "chao")])
+        )))
+    )
+    monkeypatch.setattr(chat_batch, "openai_clients", SimpleNamespace(client=client))
+
+    async def run_sync(operation, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+    recorder = MagicMock()
+    service = ChatBatchService(FakeRedis(), SimpleNamespace(run_sync=run_sync), MagicMock(), recorder, poll_seconds=0)
+    user = SimpleNamespace(id=1, company_id=1, api_key="key-test")
+    config = SimpleNamespace(system_prompt="Eres NOA", temperature=0.7, model="gpt4")
+    items = [{"custom_id": str(i), "lead_id": None, "prompt": f"p{i}"} for i in range(2)]
+    job_id = asyncio.run(service.create_job(user, config, items, mode="provider"))
+    asyncio.run(service.redis.hset(service._job_key(job_id), "provider_batch_id", "batch-1"))
+    return service, job_id, client, recorder
+
+
+def test_provider_rerun_does_not_count_or_bill_saved_results_again(monkeypatch):
+    service, job_id, _, recorder = _service(monkeypatch)
+
+    for _ in range(2):
+        job = asyncio.run(service.redis.hgetall(service._job_key(job_id)))
+        asyncio.run(service._run_provider(job_id, job))
+
+    job = asyncio.run(service.get_job(job_id, 1))
+    assert (job["status"], job["succeeded"], job["failed"]) == ("completed", 2, 0)
+    assert recorder.record.call_count == 2
+
+
+def test_provider_poll_cancels_the_batch_when_the_job_was_cancelled(monkeypatch):
+    service, job_id, client, _ = _service(monkeypatch, batch_status="in_progress")
+    # Cancelación hecha por otro worker: solo cambia el estado en Redis
+    asyncio.run(service.redis.hset(service._job_key(job_id), "status", "cancelled"))
+
+    job = asyncio.run(service.redis.hgetall(service._job_key(job_id)))
+    asyncio.run(service._run_provider(job_id, job))
+    assert not asyncio.run(service._set_status(job_id, "completed"))
+
+    client.batches.cancel.assert_called_once_with("batch-1")
+    assert asyncio.run(service.get_job(job_id, 1))["status"] == "cancelled"
@@ -0,0 +1,49 @@
+# tests/test_chat_endpoint.py
+
+
+def test_chat_endpoint_sends_routed_model(chat_app):
+    response = chat_app.client.post("/api/v1/chat/", json={"message": "hola"})
+
+    assert response.status_code == 200
+    assert response.json() == {"response": "Hola, ¿en qué puedo ayudarte?"}
+    assert len(chat_app.calls) == 1
+    sent = chat_app.calls[0]
+    assert sent["model"] in (chat_app.chat.settings.CHAT_FAST_MODEL, chat_app.chat.settings.CHAT_STRONG_MODEL)
+    assert sent["message"][-1] == {"role": "user", "content": "hola"}
+    chat_app.chat.usage_recorder.record.assert_called_once()
+    assert chat_app.chat.usage_recorder.record.call_args.kwargs["model"] == sent["model"]
+
+
+def test_chat_endpoint_records_route_latency_only_on_success(chat_app, monkeypatch):
+    from unittest.mock import MagicMock
+    record = MagicMock()
+    monkeypatch.setattr(chat_app.chat.model_router, "record", record)
+
+    assert chat_app.client.post("/api/v1/chat/", json={"message": "hola"}).status_code == 200
+    record.assert_called_once()
+    assert record.call_args.args[0].model == chat_app.calls[0]["model"]
+
+    record.reset_mock()
+    chat_app.error = RuntimeError("upstream 502")
+    assert chat_app.client.post("/api/v1/chat/", json={"message": "hola"}).status_code == 500
+    record.assert_not_called()
+
+
+def test_chat_endpoint_refunds_full_estimate_on_failure(chat_app):
+    chat_app.error = RuntimeError("upstream 502")
+    assert chat_app.client.post("/api/v1/chat/", json={"message": "hola"}).status_code == 500
+
+    estimated = chat_app.chat.chat_rate_limiter.acquire.await_args.args[2]
+    chat_app.chat.chat_rate_limiter.refund.assert_awaited_once_with(
+        chat_app.user.id, chat_app.user.company_id, estimated
+    )
+    chat_app.chat.usage_recorder.record.assert_not_called()
+
+
+def test_chat_endpoint_refunds_only_unused_tokens_on_success(chat_app):
+    assert chat_app.client.post("/api/v1/chat/", json={"message": "hola"}).status_code == 200
+
+    estimated = chat_app.chat.chat_rate_limiter.acquire.await_args.args[2]
+    chat_app.chat.chat_rate_limiter.refund.assert_awaited_once_with(
+        chat_app.user.id, chat_app.user.company_id, estimated - 50
+    )
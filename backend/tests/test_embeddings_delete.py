@@ -0,0 +1,38 @@
+# tests/test_embeddings_delete.py
+
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.services.ML.embeddings.generation import text_embeddings_processor
+from app.services.ML.embeddings.generation.text_embeddings_processor import EnhancedTextEmbeddingsProcessor
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    async def run_sync(operation, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+    monkeypatch.setattr(text_embeddings_processor.llm_limiter, "run_sync", run_sync)
+    processor = EnhancedTextEmbeddingsProcessor("user@example.com", 7)
+    processor.vector_store = MagicMock()
+    processor.vector_store.find_files.return_value = ["vs-legacy"]
+    return processor
+
+
+def test_delete_embeddings_uses_the_stored_vector_store_file_id(processor):
+    deleted = asyncio.run(processor.delete_embeddings("file", 42, "vs-file-42"))
+
+    assert deleted == ["vs-file-42"]
+    processor.vector_store.delete_file.assert_called_once_with("vs-file-42")
+    processor.vector_store.find_files.assert_not_called()
+
+
+def test_delete_embeddings_without_stored_id_matches_the_source_not_the_name(processor):
+    deleted = asyncio.run(processor.delete_embeddings("manual", 5))
+
+    assert deleted == ["vs-legacy"]
+    processor.vector_store.find_files.assert_called_once_with(
+        {"user_id": 7, "source_type": "manual", "source_id": 5}
+    )
+    processor.vector_store.delete_file.assert_called_once_with("vs-legacy")
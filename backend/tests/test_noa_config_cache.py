@@ -0,0 +1,79 @@
+# tests/test_noa_config_cache.py
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from app.services.noa_config_cache import NoaConfigCache, DEFAULT_CONFIG
+
+
+class SyncPipeline:
+    def __init__(self, store):
+        self.store = store
+        self.calls = []
+
+    def incr(self, key):
+        self.calls.append(lambda: self.store.__setitem__(key, str(int(self.store.get(key, 0)) + 1)))
+
+    def expire(self, key, seconds):
+        pass
+
+    def delete(self, key):
+        self.calls.append(lambda: self.store.pop(key, None))
+
+    def execute(self):
+        for call in self.calls:
+            call()
+
+
+class AsyncPipeline(SyncPipeline):
+    async def execute(self):
+        super().execute()
+
+
+class FakeRedis:
+    """Valores en memoria compartidos por el cliente asíncrono y el síncrono."""
+
+    def __init__(self, store, asynchronous=True):
+        self.store = store
+        self.asynchronous = asynchronous
+
+    def pipeline(self):
+        return AsyncPipeline(self.store) if self.asynchronous else SyncPipeline(self.store)
+
+    async def mget(self, keys):
+        return [self.store.get(key) for key in keys]
+
+    def register_script(self, script):
+        async def set_if_generation(keys, args):
+            if self.store.get(keys[1], "0") != args[0]:
+                return 0
+            self.store[keys[0]] = args[1]
+            return 1
+        return set_if_generation
+
+
+def test_invalidation_during_db_load_is_not_overwritten_by_the_old_config():
+    store = {}
+    cache = NoaConfigCache(FakeRedis(store), MagicMock(), FakeRedis(store, asynchronous=False))
+    user = SimpleNamespace(id=3)
+    loads = []
+
+    def load_from_db(db, user_id):
+        loads.append(user_id)
+        config = cache._compile(dict(DEFAULT_CONFIG))
+        if len(loads) == 1:
+            # save_noa_config guarda y se invalida mientras esta carga sigue en curso
+            cache.invalidate_sync(user_id)
+        return config
+    cache._load_from_db = load_from_db
+
+    asyncio.run(cache.get(None, user))
+    assert cache._key(3) not in store
+    assert 3 not in cache._local
+
+    # La siguiente lectura vuelve a la base y ahora sí se cachea
+    asyncio.run(cache.get(None, user))
+    assert cache._key(3) in store
+    assert 3 in cache._local
+    assert len(loads) == 2
@@ -0,0 +1,31 @@
+# tests/test_rate_limiter.py
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+from app.services.rate_limiter import TokenBucketRateLimiter
+
+
+def _limiter():
+    redis = MagicMock()
+    redis.register_script.side_effect = lambda script: AsyncMock(return_value=1)
+    return TokenBucketRateLimiter(redis, user_tpm=600, company_tpm=1200, global_tpm=6000)
+
+
+def test_refund_charges_usage_above_the_estimate():
+    limiter = _limiter()
+
+    asyncio.run(limiter.refund(1, 2, -150))
+
+    limiter._refund.assert_awaited_once_with(
+        keys=["ratelimit:llm:user:1", "ratelimit:llm:company:2", "ratelimit:llm:global"],
+        args=[-150, 600, 10.0, 1200, 20.0, 6000, 100.0]
+    )
+
+
+def test_refund_skips_exact_estimates():
+    limiter = _limiter()
+
+    asyncio.run(limiter.refund(1, None, 0))
+
+    limiter._refund.assert_not_awaited()
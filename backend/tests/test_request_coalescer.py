@@ -0,0 +1,76 @@
+# tests/test_request_coalescer.py
+
+import asyncio
+
+import pytest
+
+from app.services.request_coalescer import CoalescingConflictError, RequestCoalescer
+
+
+class FakeRedis:
+    """Cadenas en memoria con las operaciones que usa RequestCoalescer."""
+
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return False
+        self.values[key] = value
+        return True
+
+    async def setex(self, key, seconds, value):
+        self.values[key] = value
+
+    async def exists(self, key):
+        return int(key in self.values)
+
+    async def delete(self, key):
+        self.values.pop(key, None)
+
+
+def test_reused_key_with_another_fingerprint_is_rejected():
+    coalescer = RequestCoalescer(FakeRedis())
+
+    async def scenario():
+        async def factory():
+            return {"response": "hola"}
+        assert await coalescer.run("1:idem", factory, fingerprint="a") == {"response": "hola"}
+        assert await coalescer.run("1:idem", factory, fingerprint="a") == {"response": "hola"}
+        with pytest.raises(CoalescingConflictError):
+            await coalescer.run("1:idem", factory, fingerprint="b")
+
+    asyncio.run(scenario())
+
+
+def test_local_follower_reruns_when_the_leader_is_cancelled():
+    coalescer = RequestCoalescer(FakeRedis())
+
+    async def scenario():
+        started = asyncio.Event()
+        calls = []
+
+        async def slow():
+            calls.append("leader")
+            started.set()
+            await asyncio.sleep(10)
+
+        async def fast():
+            calls.append("follower")
+            return {"response": "hola"}
+
+        leader = asyncio.create_task(coalescer.run("1:k", slow))
+        await started.wait()
+        follower = asyncio.create_task(coalescer.run("1:k", fast))
+        await asyncio.sleep(0)
+        leader.cancel()
+
+        assert await follower == {"response": "hola"}
+        assert calls == ["leader", "follower"]
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+    asyncio.run(scenario())
@@ -0,0 +1,32 @@
+# tests/test_tokenizer.py
+
+from types import SimpleNamespace
+
+from app.services import tokenizer
+
+
+def test_get_encoder_retries_after_a_failed_load(monkeypatch):
+    encoder = SimpleNamespace(name="fake")
+    attempts = []
+
+    def load(model):
+        attempts.append(model)
+        if len(attempts) == 1:
+            raise OSError("sin red")
+        return encoder
+
+    now = [1000.0]
+    monkeypatch.setattr(tokenizer, "_load_encoder", load)
+    monkeypatch.setattr(tokenizer.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(tokenizer, "_encoders", {})
+    monkeypatch.setattr(tokenizer, "_retry_at", {})
+
+    assert tokenizer.get_encoder("modelo") is None
+    # Dentro de la espera no se vuelve a intentar la carga
+    assert tokenizer.get_encoder("modelo") is None
+    assert len(attempts) == 1
+
+    now[0] += tokenizer.ENCODER_RETRY_SECONDS
+    assert tokenizer.get_encoder("modelo") is encoder
+    assert tokenizer.get_encoder("modelo") is encoder
+    assert len(attempts) == 2